@@ -2,6 +2,8 @@
 # 应用工厂
 
 import os
+import click
+from datetime import datetime
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
@@ -11,10 +13,12 @@ db = SQLAlchemy()
 login_manager = LoginManager()
 login_manager.login_view = 'web.login'
 
-def create_app():
+def create_app(test_config=None):
     app = Flask(__name__)
-    # 从 config.py 加载配置
+    # 从 config.py 加载配置；测试时用 test_config 覆盖（如改用 SQLite 数据库）
     app.config.from_object('config')
+    if test_config:
+        app.config.update(test_config)
 
     # 2. 在工厂函数内部，将 app 和扩展绑定
     db.init_app(app)
@@ -27,6 +31,38 @@ def create_app():
         from .models import User
         return User.query.get(int(user_id))
 
+    # 接收压缩的API请求体（边读边解压）
+    from .compression import RequestDecompressor
+    app.wsgi_app = RequestDecompressor(app.wsgi_app, prefix='/api/',
+                                       max_size=app.config.get('REQUEST_MAX_DECOMPRESSED_BYTES', 256 * 1024 * 1024))
+
+    # 后台数据提交队列
+    from .ingestion import ingestion_queue
+    ingestion_queue.init_app(app)
+
+    # 提交数据归档
+    from .archive import submission_archive
+    submission_archive.init_app(app)
+
+    # GUI启动时查询数据的缓存（导入时注册失效事件）
+    from .bootstrap_cache import bootstrap_cache
+    bootstrap_cache.init_app(app)
+
+    # 项目月度汇总表（导入时注册提交前的维护事件）
+    from . import rollup
+
+    # GUI启动器下载的模块文件
+    from .module_registry import module_registry
+    module_registry.init_app(app)
+
+    # 看板快照的存储后端（进程内或同一主机上各进程共享的文件）
+    from .snapshot_store import snapshot_store
+    snapshot_store.init_app(app)
+
+    # 数据变更事件提交后只重算看板中受影响的部分
+    from .dashboard_cache import dashboard_change_listener
+    dashboard_change_listener.init_app(app)
+
     # --- 注册蓝图 ---
     from .routes.web import web as web_blueprint
     app.register_blueprint(web_blueprint)
@@ -52,4 +88,93 @@ def create_app():
             else:
                 print('管理员账户已存在。')
 
+    @app.cli.command("upgrade-db")
+    def upgrade_db_command():
+        """为关联表和项目表补充新增的列和索引并回填 production_period（可重复执行，升级部署时须在启动应用前执行）."""
+        from .schema import upgrade_schema
+        with app.app_context():
+            applied = upgrade_schema()
+            for sql in applied:
+                print(f'已执行: {sql}')
+            print(f'结构升级完成，共执行 {len(applied)} 条语句。')
+
+    @app.cli.command("backfill-periods")
+    def backfill_periods_command():
+        """为关联表的历史数据回填统一的电量生产年月 production_period（upgrade-db 已包含此步骤）."""
+        from .schema import backfill_production_periods
+        with app.app_context():
+            for table_name, count in backfill_production_periods().items():
+                print(f'{table_name}: 回填 {count} 行')
+
+    @app.cli.command("migrate-payloads")
+    def migrate_payloads_command():
+        """把项目表中旧的JSON列迁移到压缩的内容存储，并清理无引用的数据."""
+        from .payload_store import migrate_legacy_payloads, prune_orphan_payloads
+        with app.app_context():
+            migrated = migrate_legacy_payloads()
+            pruned = prune_orphan_payloads()
+            print(f'已迁移 {migrated} 份原始数据，清理 {pruned} 份无引用的数据。')
+
+    @app.cli.command("rebuild-derived")
+    @click.option('--project', 'project_names', multiple=True, help='只重建指定项目（可重复）')
+    @click.option('--source', 'sources', multiple=True, help='只重建指定数据源（可重复）')
+    @click.option('--workers', type=int, default=None, help='解析和规范化的子进程数')
+    @click.option('--writers', type=int, default=None, help='写库线程数')
+    @click.option('--resume', is_flag=True, help='从上次中断处继续')
+    def rebuild_derived_command(project_names, sources, workers, writers, resume):
+        """从已存的原始数据重建关联表."""
+        from .data_processors import SOURCE_TO_COLUMN_MAP
+        from .rebuild import rebuild_derived
+        unknown = [s for s in sources if s not in SOURCE_TO_COLUMN_MAP]
+        if unknown:
+            print(f'未知的数据源: {", ".join(unknown)}，可选: {", ".join(SOURCE_TO_COLUMN_MAP)}')
+            return
+        with app.app_context():
+            stats = rebuild_derived(app, project_names=project_names, sources=sources,
+                                    workers=workers, writers=writers, resume=resume)
+            print(f'重建完成: 成功 {stats["done"]} 个数据源，失败 {stats["failed"]} 个，'
+                  f'因原始数据已更新跳过 {stats["skipped"]} 个，写入 {stats["rows"]} 行，用时 {stats["seconds"]} 秒。')
+
+    @app.cli.command("rebuild-rollup")
+    @click.option('--project', 'project_names', multiple=True, help='只重建指定项目（可重复）')
+    @click.option('--no-wait', is_flag=True, help='不等待各服务进程看到重建状态（仅在服务已停止时使用）')
+    def rebuild_rollup_command(project_names, no_wait):
+        """由关联表重建项目月度汇总表（需先执行 flask upgrade-db 建表）."""
+        from .rollup import rebuild_rollup, STATE_TTL
+        with app.app_context():
+            if not project_names and not no_wait:
+                print(f'标记为重建中后将等待 {STATE_TTL} 秒，使各服务进程开始维护汇总表...')
+            count = rebuild_rollup(project_names=project_names, wait=not no_wait)
+            print(f'汇总表重建完成，共 {count} 个项目。')
+
+    @app.cli.command("archive-list")
+    @click.option('--project', 'project_name', default=None, help='项目名称')
+    @click.option('--source', default=None, help='数据源')
+    @click.option('--limit', default=20, help='最多显示的条数')
+    def archive_list_command(project_name, source, limit):
+        """列出归档中的历史提交."""
+        for entry in submission_archive.find(project_name=project_name, source=source, limit=limit):
+            received_at = datetime.fromtimestamp(entry['received_at']).strftime('%Y-%m-%d %H:%M:%S')
+            print(f"{entry['id']}\t{received_at}\t{entry['project_name']}\t{entry['source']}\t{entry['raw_size']}B")
+
+    @app.cli.command("archive-replay")
+    @click.argument('entry_id', type=int)
+    def archive_replay_command(entry_id):
+        """将一条历史提交重新写入项目及关联表."""
+        from .ingestion import apply_submission
+        from .models import Project
+        with app.app_context():
+            record = submission_archive.read(entry_id)
+            if record is None:
+                print(f'归档记录 {entry_id} 不存在。')
+                return
+            project = Project.query.filter_by(project_name=record['project_name']).first()
+            if project is None:
+                print(f'项目 "{record["project_name"]}" 在数据库中未找到。')
+                return
+            # 增量提交按合并方式重放，只会补回其中的记录
+            result = apply_submission(project, record['source'], record['data'], force=True,
+                                      delta=record.get('mode') == 'delta')
+            print(f'已重放 {record["project_name"]} / {record["source"]}: {result.row_counts}')
+
     return app
\ No newline at end of file
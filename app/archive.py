@@ -0,0 +1,215 @@
+# 文件: archive.py
+# 提交数据归档：每次提交压缩后由后台线程追加到滚动的段文件中，并用 sqlite 索引支持查询和重放
+
+import gzip
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import datetime
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = 'index.sqlite3'
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    project_name TEXT NOT NULL,
+    source TEXT NOT NULL,
+    received_at REAL NOT NULL,
+    segment TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    raw_size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_submissions_lookup ON submissions (project_name, source, received_at);
+CREATE INDEX IF NOT EXISTS idx_submissions_segment ON submissions (segment);
+"""
+
+
+class SubmissionArchive:
+    """
+    追加写入的提交归档。
+    每条记录是一个独立的 gzip 成员（整个段文件仍是合法的 gzip 流），索引中记录其所在段、偏移和长度，
+    因此可以直接定位读取单条历史提交。请求线程只把记录序列化为JSON字节后入队（此后请求对数据的修改不影响归档），
+    压缩和写盘都在后台线程中进行，请求从不等待。
+    多个进程共用同一目录和索引：段文件名带进程号，各进程只追加写自己的段。
+    未配置 ARCHIVE_DIR 时不归档，查询返回空结果。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.directory = None
+        self.segment_max_bytes = 64 * 1024 * 1024
+        self.retention_days = 90
+        self._queue = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._segment_name = None
+        self._segment_file = None
+        self._last_retention_check = 0
+        self.dropped = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.directory = app.config.get('ARCHIVE_DIR')
+        self.segment_max_bytes = app.config.get('ARCHIVE_SEGMENT_MAX_BYTES', 64 * 1024 * 1024)
+        self.retention_days = app.config.get('ARCHIVE_RETENTION_DAYS', 90)
+        self._queue = queue.Queue(maxsize=app.config.get('ARCHIVE_QUEUE_SIZE', 1000))
+        app.extensions['submission_archive'] = self
+
+    # --- 请求线程调用 ---
+    def append(self, project_name, source, data, mode=None):
+        """将一次提交序列化后放入归档队列；队列已满时丢弃并记录警告，不阻塞请求。增量提交的 mode 为 'delta'"""
+        if not self.directory:
+            return False
+        self._ensure_started()
+        if self._queue.full():
+            return self._drop(project_name, source)
+        received_at = time.time()
+        record = {'project_name': project_name, 'source': source, 'received_at': received_at, 'data': data}
+        if mode:
+            record['mode'] = mode
+        line = json.dumps(record, ensure_ascii=False).encode('utf-8')
+        try:
+            self._queue.put_nowait((project_name, source, received_at, line))
+            return True
+        except queue.Full:
+            return self._drop(project_name, source)
+
+    def _drop(self, project_name, source):
+        self.dropped += 1
+        logger.warning(f"归档队列已满，丢弃一次提交 (项目: {project_name}, 源: {source})")
+        return False
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._thread = threading.Thread(target=self._writer_loop, name='archive-writer', daemon=True)
+                self._thread.start()
+
+    # --- 后台写入线程 ---
+    def _writer_loop(self):
+        connection = self._connect()
+        while True:
+            try:
+                item = self._queue.get(timeout=60)
+            except queue.Empty:
+                item = None
+            try:
+                if item is not None:
+                    self._write(connection, *item)
+                if time.time() - self._last_retention_check > 3600:
+                    self._apply_retention(connection)
+            except Exception as e:
+                logger.error(f"写入提交归档失败: {e}")
+
+    def _connect(self):
+        connection = sqlite3.connect(os.path.join(self.directory, INDEX_FILENAME), timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(INDEX_SCHEMA)
+        return connection
+
+    def _open_segment(self):
+        if self._segment_file is not None:
+            self._segment_file.close()
+        self._segment_name = f"segment-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{os.getpid()}.jsonl.gz"
+        self._segment_file = open(os.path.join(self.directory, self._segment_name), 'ab')
+
+    def _write(self, connection, project_name, source, received_at, line):
+        member = gzip.compress(line, compresslevel=6)
+        # 长期空闲的段可能已被其他进程按保留期删除，此时换一个新段，不再写入已删除的文件
+        if (self._segment_file is None or self._segment_file.tell() + len(member) > self.segment_max_bytes
+                or not os.path.exists(os.path.join(self.directory, self._segment_name))):
+            self._open_segment()
+        offset = self._segment_file.tell()
+        self._segment_file.write(member)
+        self._segment_file.flush()
+
+        connection.execute(
+            "INSERT INTO submissions (project_name, source, received_at, segment, offset, length, raw_size) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (project_name, source, received_at, self._segment_name, offset, len(member), len(line)))
+        connection.commit()
+
+    def _apply_retention(self, connection):
+        """
+        删除所有记录都已超过保留期的段文件及其索引。
+        其他进程可能仍在追加写它们当前的段，因此文件在保留期内修改过的段一律跳过。
+        """
+        self._last_retention_check = time.time()
+        if not self.retention_days:
+            return
+        cutoff = time.time() - self.retention_days * 86400
+        expired = [row[0] for row in connection.execute(
+            "SELECT segment FROM submissions GROUP BY segment HAVING MAX(received_at) < ?", (cutoff,))
+            if row[0] != self._segment_name]
+        for segment in list(expired):
+            path = os.path.join(self.directory, segment)
+            if os.path.exists(path):
+                if os.path.getmtime(path) >= cutoff:
+                    expired.remove(segment)
+                    continue
+                os.remove(path)
+            connection.execute("DELETE FROM submissions WHERE segment = ?", (segment,))
+        connection.commit()
+        if expired:
+            logger.info(f"归档保留期清理：删除了 {len(expired)} 个段文件")
+
+    # --- 查询与重放（任意线程） ---
+    def find(self, project_name=None, source=None, since=None, until=None, limit=100):
+        """按 (项目, 数据源, 时间) 查询归档索引，最新的在前；未启用归档时返回空列表"""
+        if not self.directory:
+            return []
+        conditions, params = [], []
+        for column, op, value in (('project_name', '=', project_name), ('source', '=', source),
+                                  ('received_at', '>=', since), ('received_at', '<', until)):
+            if value is not None:
+                conditions.append(f"{column} {op} ?")
+                params.append(value.timestamp() if isinstance(value, datetime) else value)
+        where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        with self._reader() as connection:
+            rows = connection.execute(
+                f"SELECT id, project_name, source, received_at, segment, offset, length, raw_size "
+                f"FROM submissions {where_sql} ORDER BY received_at DESC LIMIT ?", params + [limit]).fetchall()
+        return [dict(row) for row in rows]
+
+    def read(self, entry_id):
+        """读取单条归档记录，返回包含 project_name、source、received_at、data 的字典；不存在或未启用归档时返回 None"""
+        if not self.directory:
+            return None
+        with self._reader() as connection:
+            row = connection.execute(
+                "SELECT segment, offset, length FROM submissions WHERE id = ?", (entry_id,)).fetchone()
+        if row is None:
+            return None
+        with open(os.path.join(self.directory, row['segment']), 'rb') as f:
+            f.seek(row['offset'])
+            member = f.read(row['length'])
+        return json.loads(gzip.decompress(member).decode('utf-8'))
+
+    def _reader(self):
+        index_path = os.path.join(self.directory, INDEX_FILENAME)
+        if not os.path.exists(index_path):
+            os.makedirs(self.directory, exist_ok=True)
+        connection = sqlite3.connect(index_path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        connection.executescript(INDEX_SCHEMA)
+        return closing(connection)
+
+    def stats(self):
+        return {'queued': self._queue.qsize() if self._queue else 0, 'dropped': self.dropped,
+                'segment': self._segment_name}
+
+
+submission_archive = SubmissionArchive()
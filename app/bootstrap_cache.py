@@ -0,0 +1,143 @@
+# 文件: bootstrap_cache.py
+# GUI启动时查询的数据（二级单位列表、单位的项目列表和更新时间）的进程内缓存，项目或用户变化提交后按单位失效（仅限本进程）
+
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from .models import db, Project, User
+from .cursors import unit_cursors
+
+# 会话中待失效的单位，提交后生效、回滚后丢弃
+_PENDING_KEY = 'bootstrap_cache_units'
+# 表示二级单位列表本身需要失效
+_ALL_UNITS = object()
+
+
+class BootstrapCache:
+    """
+    按 (类别, 单位) 缓存查询结果；项目或用户变化提交后立即失效，TTL 兜底。
+    失效只发生在提交变更的进程内：多进程部署时，其他进程中的缓存最多在 TTL 之后才会看到变化。
+    状态（含增量提交的游标）使用较短的 status_ttl，客户端据此取游标时最多落后这么久。
+    """
+
+    def __init__(self, ttl=300, status_ttl=10):
+        self.ttl = ttl
+        self.status_ttl = status_ttl
+        self._entries = {}
+        self._generation = 0  # 每次失效加一，加载期间发生过失效的结果不写入缓存
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('BOOTSTRAP_CACHE_TTL', 300)
+        self.status_ttl = app.config.get('BOOTSTRAP_STATUS_CACHE_TTL', 10)
+        app.extensions['bootstrap_cache'] = self
+
+    def get_or_load(self, key, loader, ttl=None):
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+        generation = self._generation
+        value = loader()
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = (now + (self.ttl if ttl is None else ttl), value)
+        return value
+
+    def invalidate(self, units):
+        """清除指定单位的项目列表和状态缓存；units 中含 _ALL_UNITS 时同时清除单位列表"""
+        with self._lock:
+            self._generation += 1
+            for key in list(self._entries):
+                if key[1] in units or (key[0] == 'units' and _ALL_UNITS in units):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+bootstrap_cache = BootstrapCache()
+
+
+def get_secondary_units():
+    """所有二级单位（不含管理员），用于GUI登录下拉框"""
+    def load():
+        rows = db.session.query(User.username).filter(User.username != 'admin').distinct() \
+            .order_by(User.username).all()
+        return [row[0] for row in rows]
+    return bootstrap_cache.get_or_load(('units', None), load)
+
+
+def get_unit_project_names(secondary_unit):
+    """单位的项目名称列表"""
+    def load():
+        rows = Project.query.filter_by(secondary_unit=secondary_unit).with_entities(Project.project_name) \
+            .order_by(Project.project_name).all()
+        return [row[0] for row in rows]
+    return bootstrap_cache.get_or_load(('projects', secondary_unit), load)
+
+
+def get_unit_status(secondary_unit):
+    """单位各项目每个数据源的最后更新时间和增量提交的游标；只查询需要的列"""
+    def load():
+        cursors = unit_cursors(secondary_unit)
+        rows = Project.query.filter_by(secondary_unit=secondary_unit).with_entities(
+            Project.id, Project.project_name, Project.data_nyj_updated_at, Project.data_lzy_updated_at,
+            Project.data_bjdl_updated_at, Project.data_gjdl_updated_at
+        ).order_by(Project.project_name).all()
+
+        def fmt(value):
+            return value.isoformat() if value else None
+
+        return [{
+            'project_name': row.project_name,
+            'data_nyj_updated_at': fmt(row.data_nyj_updated_at),
+            'data_lzy_updated_at': fmt(row.data_lzy_updated_at),
+            'data_bjdl_updated_at': fmt(row.data_bjdl_updated_at),
+            'data_gjdl_updated_at': fmt(row.data_gjdl_updated_at),
+            'cursors': cursors.get(row.id, {}),
+        } for row in rows]
+    return bootstrap_cache.get_or_load(('status', secondary_unit), load, bootstrap_cache.status_ttl)
+
+
+# --- 失效：在ORM刷新时记录受影响的单位，事务提交后再清除缓存 ---
+
+def _mark(target, units):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(_PENDING_KEY, set()).update(units)
+
+
+@event.listens_for(Project, 'after_insert')
+@event.listens_for(Project, 'after_update')
+@event.listens_for(Project, 'after_delete')
+def _project_changed(mapper, connection, target):
+    _mark(target, {target.secondary_unit})
+
+
+@event.listens_for(Project.secondary_unit, 'set', active_history=True)
+def _project_unit_changed(target, value, oldvalue, initiator):
+    # 修改了项目所属单位时，原单位也需要失效（active_history 保证能拿到未加载的旧值）
+    if isinstance(oldvalue, str) and oldvalue != value:
+        _mark(target, {oldvalue})
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    _mark(target, {_ALL_UNITS})
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    units = session.info.pop(_PENDING_KEY, None)
+    if units:
+        bootstrap_cache.invalidate(units)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_rollback(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,125 @@
+# 文件: bulk_writer.py
+# 关联表的批量写入：按表和列缓存INSERT语句，多行VALUES按字节预算分批；MySQL上可选 LOAD DATA LOCAL INFILE
+
+import logging
+import os
+import tempfile
+from functools import lru_cache
+from itertools import chain, islice
+from flask import current_app
+from .models import db
+from .timing import stage
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+# SQLite 单条语句最多 32766 个绑定参数（MySQL 为 65535），取较小者使本地数据库也能运行
+MAX_BIND_PARAMS = 32766
+
+# LOAD DATA 默认格式（制表符分隔、反斜杠转义）中需要转义的字符
+_LOAD_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', '\0': '\\0'})
+
+
+def quote_column(col):
+    """year、month 是MySQL关键字，作为列名时需要加反引号"""
+    return f"`{col}`" if col in ('year', 'month') else col
+
+
+@lru_cache(maxsize=256)
+def insert_statement(table_name, columns, row_count):
+    """
+    返回 (语句, 绑定参数名)：相同表、列和行数的批次复用同一个语句对象，
+    SQLAlchemy 按语句缓存编译结果，不必每批都重新拼接和编译SQL。
+    """
+    column_list = ', '.join(quote_column(col) for col in columns)
+    names = tuple(f"p{r}_{c}" for r in range(row_count) for c in range(len(columns)))
+    rows = ', '.join(
+        '(' + ', '.join(f":p{r}_{c}" for c in range(len(columns))) + ')' for r in range(row_count))
+    return db.text(f"INSERT INTO {table_name} ({column_list}) VALUES {rows}"), names
+
+
+def _row_bytes(values):
+    """估算一行值在SQL中的长度（字符串按字符数计，其它类型按定长计）"""
+    return sum(len(v) if isinstance(v, str) else 8 for v in values if v is not None) + 4 * len(values)
+
+
+def _iter_batches(rows, max_rows, max_bytes):
+    """将行切分为多行VALUES的批次，每批不超过 max_rows 行且估算长度不超过 max_bytes"""
+    batch, size = [], 0
+    for values in rows:
+        row_size = _row_bytes(values)
+        if batch and (len(batch) >= max_rows or size + row_size > max_bytes):
+            yield batch
+            batch, size = [], 0
+        batch.append(values)
+        size += row_size
+    if batch:
+        yield batch
+
+
+def insert_rows(table_name, columns, rows):
+    """以多行 INSERT ... VALUES (...), (...) 写入行（与 columns 对应的值元组），返回行数"""
+    config = current_app.config
+    max_rows = max(1, min(config.get('BULK_INSERT_MAX_ROWS', 500), MAX_BIND_PARAMS // len(columns)))
+    max_bytes = config.get('BULK_INSERT_MAX_BYTES', 1024 * 1024)
+    total = 0
+    for batch in _iter_batches(rows, max_rows, max_bytes):
+        statement, names = insert_statement(table_name, columns, len(batch))
+        params = dict(zip(names, chain.from_iterable(batch)))
+        with stage('insert'):
+            db.session.execute(statement, params)
+        total += len(batch)
+    return total
+
+
+def _load_value(value):
+    if value is None:
+        return '\\N'
+    # 与参数化插入一致，布尔值写为 1/0（str(True) 得到的 'True' 写入整数列会变成 0）
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return (value if isinstance(value, str) else str(value)).translate(_LOAD_ESCAPES)
+
+
+def load_rows(table_name, columns, rows):
+    """
+    用 LOAD DATA LOCAL INFILE 写入行，返回行数。
+    mysqlclient 只能从文件路径上传，因此先把行写成制表符分隔的临时文件，由客户端一次性发送。
+    需要服务端 local_infile=ON，且连接参数中开启 local_infile。
+    """
+    fd, path = tempfile.mkstemp(prefix=f"{table_name}-", suffix='.tsv')
+    total = 0
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            for values in rows:
+                f.write('\t'.join(map(_load_value, values)))
+                f.write('\n')
+                total += 1
+        column_list = ', '.join(quote_column(col) for col in columns)
+        # 文件名不能使用绑定参数；临时路径由 mkstemp 生成，统一为正斜杠以兼容 Windows
+        file_sql = path.replace('\\', '/').replace("'", "''")
+        with stage('insert'):
+            db.session.execute(db.text(
+                f"LOAD DATA LOCAL INFILE '{file_sql}' INTO TABLE {table_name} "
+                f"CHARACTER SET utf8mb4 ({column_list})"))
+    finally:
+        os.remove(path)
+    logger.info(f"{table_name} 通过 LOAD DATA 写入 {total} 行")
+    return total
+
+
+def bulk_insert(table_name, columns, rows):
+    """
+    写入一个值元组流，返回行数。
+    配置了 BULK_LOAD_DATA_MIN_ROWS 且数据库为MySQL时，行数达到阈值的写入改用 LOAD DATA；
+    其它情况（包括本地测试用的SQLite）使用多行 INSERT。
+    """
+    columns = tuple(columns)
+    rows = iter(rows)
+    threshold = current_app.config.get('BULK_LOAD_DATA_MIN_ROWS', 0)
+    if threshold and db.session.get_bind().dialect.name == 'mysql':
+        head = list(islice(rows, threshold))
+        if len(head) >= threshold:
+            return load_rows(table_name, columns, chain(head, rows))
+        return insert_rows(table_name, columns, head)
+    return insert_rows(table_name, columns, rows)
@@ -0,0 +1,93 @@
+# 文件: change_events.py
+# 数据变更事件：写入关联表或修改项目、客户时记录受影响的表和项目，事务提交后通知订阅者（如看板的分块重算）
+
+import logging
+from collections import namedtuple
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+from .models import db, Project, Customer
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+# 一次提交涉及的表和项目ID；project_ids 为 None 表示影响范围未知，订阅者应按全部项目处理
+ChangeEvent = namedtuple('ChangeEvent', ['tables', 'project_ids'])
+
+# 会话中待发布的变更，提交后发布、回滚后丢弃
+_PENDING_KEY = 'change_events'
+# 项目的这些列会出现在看板上，只修改更新时间、原始数据哈希等列时不发布事件
+PROJECT_DASHBOARD_COLUMNS = ('project_name', 'province', 'secondary_unit', 'power_type')
+
+_subscribers = []
+
+
+def subscribe(handler):
+    """注册订阅者，handler(ChangeEvent) 在提交变更的线程中同步调用，应尽快返回"""
+    if handler not in _subscribers:
+        _subscribers.append(handler)
+    return handler
+
+
+def record_change(tables, project_id=None, all_projects=False, session=None):
+    """
+    在会话中记录一次变更，所在事务提交后发布。
+    project_id 为受影响的项目；all_projects=True 表示可能影响任意项目（如批量重建）；
+    两者都未给出时只记录表（如客户表，与项目无关）。
+    """
+    session = session or db.session()
+    pending = session.info.setdefault(_PENDING_KEY, {'tables': set(), 'project_ids': set()})
+    pending['tables'].update(tables)
+    if all_projects:
+        pending['project_ids'] = None
+    elif project_id is not None and pending['project_ids'] is not None:
+        pending['project_ids'].add(project_id)
+
+
+def pending_change(session):
+    """会话中尚未提交的变更（提交前的钩子使用），没有时返回 None"""
+    pending = session.info.get(_PENDING_KEY)
+    if not pending or not pending['tables']:
+        return None
+    ids = pending['project_ids']
+    return ChangeEvent(frozenset(pending['tables']), frozenset(ids) if ids is not None else None)
+
+
+def publish(change):
+    for handler in list(_subscribers):
+        try:
+            handler(change)
+        except Exception as e:
+            logger.error(f"处理数据变更事件失败 {handler}: {e}")
+
+
+@event.listens_for(Project, 'after_insert')
+@event.listens_for(Project, 'after_delete')
+def _project_added_or_removed(mapper, connection, target):
+    record_change({'projects'}, target.id, session=object_session(target))
+
+
+@event.listens_for(Project, 'after_update')
+def _project_updated(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[column].history.has_changes() for column in PROJECT_DASHBOARD_COLUMNS):
+        record_change({'projects'}, target.id, session=object_session(target))
+
+
+@event.listens_for(Customer, 'after_insert')
+@event.listens_for(Customer, 'after_update')
+@event.listens_for(Customer, 'after_delete')
+def _customer_changed(mapper, connection, target):
+    record_change({'customers'}, session=object_session(target))
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_after_commit(session):
+    change = pending_change(session)
+    session.info.pop(_PENDING_KEY, None)
+    if change is not None:
+        publish(change)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_rollback(session):
+    session.info.pop(_PENDING_KEY, None)
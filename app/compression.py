@@ -0,0 +1,217 @@
+# 文件: compression.py
+# API 请求体和响应体的压缩：接收 gzip/deflate/zstd 编码的提交（流式解压并限制解压后大小），按客户端支持压缩JSON响应
+
+import gzip
+import io
+import logging
+import zlib
+from flask import request
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge, UnsupportedMediaType
+
+try:
+    import zstandard
+except ImportError:  # 未安装时不支持 zstd，gzip/deflate 不受影响
+    zstandard = None
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+_READ_SIZE = 64 * 1024
+
+# 解压数据损坏时抛出的异常类型
+_DECODE_ERRORS = (zlib.error,) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+# zstd 解压器不能限制单次输出，每次只送入这么多字节：每个块至少占4字节、最多解压出128KB，单次输出不超过8MB
+_ZSTD_INPUT_SLICE = 256
+
+
+class _Decoder:
+    """从原始请求体流中读取压缩数据并增量解压；read(size) 每次最多返回 size 字节，流结束时返回 b''"""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._input = b''
+        self._stream_eof = False
+
+    def _read_input(self):
+        """输入已用完时从请求体再读一块，返回是否还有输入"""
+        if not self._input and not self._stream_eof:
+            self._input = self._stream.read(_READ_SIZE)
+            self._stream_eof = not self._input
+        return bool(self._input)
+
+
+class _ZlibDecoder(_Decoder):
+    """
+    gzip/deflate 解压：以 max_length 限制每次的输出，未处理的输入留在 unconsumed_tail 中下次继续。
+    gzip 支持多个成员首尾相接；deflate 按前两个字节区分带 zlib 头的格式和部分客户端发送的原始 deflate。
+    """
+
+    def __init__(self, stream, gzip_format):
+        super().__init__(stream)
+        self._gzip = gzip_format
+        self._obj = None
+
+    def _start_member(self):
+        if self._gzip:
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        cmf, flg = self._input[0], self._input[1] if len(self._input) > 1 else 0
+        zlib_header = cmf & 0x0F == 8 and (cmf << 8 | flg) % 31 == 0
+        return zlib.decompressobj(zlib.MAX_WBITS if zlib_header else -zlib.MAX_WBITS)
+
+    def read(self, size):
+        while True:
+            has_input = self._read_input()
+            if self._obj is None or self._obj.eof:
+                if not has_input:
+                    if self._obj is None:
+                        raise BadRequest('请求体压缩数据不完整')
+                    return b''
+                if self._obj is not None:
+                    if not self._gzip:
+                        raise BadRequest('请求体 deflate 数据结束后还有多余的数据')
+                    if not self._input.strip(b'\x00'):
+                        # gzip 文件末尾允许填充零字节
+                        self._input = b''
+                        continue
+                if not self._gzip and len(self._input) < 2 and not self._stream_eof:
+                    self._input += self._stream.read(_READ_SIZE)
+                    continue
+                self._obj = self._start_member()
+            elif not has_input:
+                # 输入已读完：取出解压器中剩余的输出，仍未到达数据末尾说明请求体被截断
+                data = self._obj.flush()
+                if not self._obj.eof:
+                    raise BadRequest('请求体压缩数据不完整')
+                if data:
+                    return data
+                continue
+
+            data = self._obj.decompress(self._input, size)
+            self._input = self._obj.unused_data if self._obj.eof else self._obj.unconsumed_tail
+            if data:
+                return data
+
+
+class _ZstdDecoder(_Decoder):
+    """zstd 解压：按 _ZSTD_INPUT_SLICE 分片送入解压器以限制单次输出，支持多个帧首尾相接"""
+
+    def __init__(self, stream):
+        super().__init__(stream)
+        self._obj = None
+        self._output = b''
+
+    def read(self, size):
+        while not self._output:
+            has_input = self._read_input()
+            if self._obj is None or self._obj.eof:
+                if not has_input:
+                    if self._obj is None:
+                        raise BadRequest('请求体压缩数据不完整')
+                    return b''
+                self._obj = zstandard.ZstdDecompressor().decompressobj()
+            elif not has_input:
+                raise BadRequest('请求体压缩数据不完整')
+            piece, self._input = self._input[:_ZSTD_INPUT_SLICE], self._input[_ZSTD_INPUT_SLICE:]
+            self._output = self._obj.decompress(piece)
+            if self._obj.eof:
+                # 一帧结束，其后的数据属于下一帧
+                self._input = self._obj.unused_data + self._input
+        data, self._output = self._output[:size], self._output[size:]
+        return data
+
+
+def _make_decoder(encoding, stream):
+    """返回读取请求体并按其编码解压的解压器，不支持的编码返回 None"""
+    if encoding in ('gzip', 'x-gzip'):
+        return _ZlibDecoder(stream, gzip_format=True)
+    if encoding == 'deflate':
+        return _ZlibDecoder(stream, gzip_format=False)
+    if encoding == 'zstd' and zstandard is not None:
+        return _ZstdDecoder(stream)
+    return None
+
+
+class DecodedInput(io.RawIOBase):
+    """边读边解压的请求体，解压后的总大小超过 max_size 时抛出 413；数据损坏或不完整时抛出 400"""
+
+    def __init__(self, decoder, max_size):
+        self._decoder = decoder
+        self._max_size = max_size
+        self._buffer = b''
+        self._size = 0
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def _fill(self):
+        if self._buffer or self._eof:
+            return
+        try:
+            # 多读一个字节，刚好达到上限的请求体也能判断出是否超限
+            self._buffer = self._decoder.read(min(_READ_SIZE, self._max_size - self._size + 1))
+        except _DECODE_ERRORS as e:
+            raise BadRequest(f'请求体解压失败: {e}')
+        self._eof = not self._buffer
+        self._size += len(self._buffer)
+        if self._size > self._max_size:
+            raise RequestEntityTooLarge(f'解压后的请求体超过 {self._max_size} 字节')
+
+    def readinto(self, b):
+        self._fill()
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+class RequestDecompressor:
+    """
+    WSGI中间件：对指定路径前缀下带 Content-Encoding 的请求，把 wsgi.input 换成边读边解压的流。
+    解压后长度未知，因此去掉 Content-Length 并标记 wsgi.input_terminated，由应用读到流结束为止。
+    """
+
+    def __init__(self, wsgi_app, prefix='/api/', max_size=256 * 1024 * 1024):
+        self.wsgi_app = wsgi_app
+        self.prefix = prefix
+        self.max_size = max_size
+
+    def __call__(self, environ, start_response):
+        encoding = environ.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if encoding and encoding != 'identity' and environ.get('PATH_INFO', '').startswith(self.prefix):
+            decoder = _make_decoder(encoding, environ['wsgi.input'])
+            if decoder is None:
+                return UnsupportedMediaType(f'不支持的请求体编码: {encoding}')(environ, start_response)
+            environ['wsgi.input'] = io.BufferedReader(DecodedInput(decoder, self.max_size), _READ_SIZE)
+            environ['wsgi.input_terminated'] = True
+            environ.pop('CONTENT_LENGTH', None)
+            del environ['HTTP_CONTENT_ENCODING']
+        return self.wsgi_app(environ, start_response)
+
+
+def compress_response(response, min_size=1024, level=6):
+    """客户端声明支持时压缩JSON响应；文件下载、流式响应、带ETag的响应和过小的响应保持原样"""
+    response.vary.add('Accept-Encoding')
+    if (response.direct_passthrough or response.is_streamed or response.status_code < 200
+            or response.status_code in (204, 304) or 'Content-Encoding' in response.headers
+            or response.mimetype != 'application/json' or 'ETag' in response.headers):
+        return response
+
+    offered = ['zstd', 'gzip', 'deflate'] if zstandard is not None else ['gzip', 'deflate']
+    encoding = request.accept_encodings.best_match(offered)
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+
+    if encoding == 'zstd':
+        compressed = zstandard.ZstdCompressor(level=3).compress(data)
+    elif encoding == 'gzip':
+        compressed = gzip.compress(data, compresslevel=level, mtime=0)
+    else:
+        compressed = zlib.compress(data, level)
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,150 @@
+# 文件: cursors.py
+# 增量提交（mode=delta）：每个 (项目, 数据源) 的游标（已入库记录的最大时间和条数），以及把只含新记录的负载合并进已存数据
+
+import json
+import logging
+from datetime import datetime
+from itertools import chain
+from .models import db
+from .data_processors import SOURCE_RECORD_BUILDERS, normalize_key_part
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+# 关联表 -> (负载中记录的自然键字段, 游标列, 游标列对应的负载字段)
+# 自然键与 data_processors.DERIVED_TABLE_KEYS 一一对应
+RECORD_CURSORS = {
+    "nyj_transaction_records": (("orderId",), "transaction_time", "transactionTime"),
+    "nyj_green_certificate_ledger": (("gecUniqueCode", "productionYearMonth"),
+                                     "production_year_month", "productionYearMonth"),
+    "gzpt_unilateral_listings": (("orderId",), "order_time", "orderTime"),
+    "gzpt_bilateral_online_trades": (("orderId",), "order_time", "orderTime"),
+    "gzpt_bilateral_offline_trades": (("orderId",), "order_time", "orderTime"),
+    "beijing_power_exchange_trades": (("Unnamed: 9",), "transaction_time", "Unnamed: 12"),
+    "guangzhou_power_exchange_trades": (("orderNo",), "deal_time", "dealTime")
+}
+
+# 项目还没有某数据源的数据（区别于已存的 JSON null）
+MISSING = object()
+
+# 负载开头不属于记录的表头行数（增量负载同样需要带上表头）
+HEADER_ROWS = {"beijing_power_exchange_trades": 1}
+
+# 用于识别表头行的字段：表头中该字段是列名，记录中是数值（北京交易中心为成交数量）
+HEADER_FIELDS = {"beijing_power_exchange_trades": "Unnamed: 11"}
+
+
+def _is_header_row(table_name, row):
+    """判断一行是否为表头：该字段为非数值的文本"""
+    if not isinstance(row, dict):
+        return False
+    value = row.get(HEADER_FIELDS[table_name])
+    if not isinstance(value, str) or not value.strip():
+        return False
+    try:
+        float(value)
+    except ValueError:
+        return True
+    return False
+
+
+def _cursor_value(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S') if isinstance(value, datetime) else value
+
+
+def unit_cursors(secondary_unit):
+    """
+    单位下所有项目的游标：{项目ID: {数据源: {关联表: {'key', 'field', 'max', 'count'}}}}。
+    max 为库中该表游标列的最大值（时间已规范为 'YYYY-MM-DD HH:MM:SS'），每个关联表一条分组查询。
+    """
+    cursors = {}
+    for source, builders in SOURCE_RECORD_BUILDERS.items():
+        for table_name, key, _ in builders:
+            _, column, field = RECORD_CURSORS[table_name]
+            rows = db.session.execute(db.text(
+                f"SELECT t.project_id, MAX(t.{column}), COUNT(*) FROM {table_name} t "
+                f"JOIN projects p ON p.id = t.project_id WHERE p.secondary_unit = :unit GROUP BY t.project_id"
+            ), {'unit': secondary_unit}).fetchall()
+            for project_id, max_value, count in rows:
+                cursors.setdefault(project_id, {}).setdefault(source, {})[table_name] = {
+                    'key': key, 'field': field, 'max': _cursor_value(max_value), 'count': count}
+    return cursors
+
+
+def check_delta(source, delta):
+    """校验增量负载的结构与该数据源的完整负载一致，不一致时抛出 ValueError"""
+    builders = SOURCE_RECORD_BUILDERS.get(source)
+    if not builders:
+        raise ValueError(f'未知的数据源: "{source}"')
+    if builders[0][1] is None:
+        if not isinstance(delta, list):
+            raise ValueError('该数据源的增量数据应为记录数组')
+        arrays = [(builders[0][0], '', delta)]
+    else:
+        if not isinstance(delta, dict):
+            raise ValueError('该数据源的增量数据应为对象')
+        arrays = []
+        for table_name, key, _ in builders:
+            if delta.get(key) is not None and not isinstance(delta[key], list):
+                raise ValueError(f'增量数据中的 "{key}" 应为记录数组')
+            arrays.append((table_name, f'"{key}" ', delta.get(key)))
+    # 首行为表头的数据源，增量数据也必须带表头，否则规范化时会把第一条记录当作表头跳过
+    for table_name, label, items in arrays:
+        header_rows = HEADER_ROWS.get(table_name, 0)
+        if header_rows and items is not None and (
+                len(items) < header_rows or not all(_is_header_row(table_name, row) for row in items[:header_rows])):
+            raise ValueError(f'增量数据{label}缺少表头行')
+
+
+def _merge_items(old, new, table_name):
+    """
+    合并两段记录数组：同一自然键（规范化后）的记录以 new 中的为准并保留原来的位置，新记录追加在末尾；
+    缺少自然键的记录按完整内容去重。表头取 new 中的，new 没有表头时沿用 old 的。
+    """
+    key_fields = RECORD_CURSORS[table_name][0]
+    header_rows = HEADER_ROWS.get(table_name, 0)
+
+    def record_key(record):
+        # 与 sync_records 一样按规范化的键比较，1003 与 '1003'、大小写不同的编号视为同一条记录
+        if isinstance(record, dict):
+            key = tuple(normalize_key_part(record.get(field)) for field in key_fields)
+            if all(part is not None for part in key):
+                return key
+        return ('', json.dumps(record, ensure_ascii=False, sort_keys=True, default=str))
+
+    merged = {}
+    for record in chain(old[header_rows:], new[header_rows:]):
+        merged[record_key(record)] = record
+    return list(new[:header_rows] or old[:header_rows]) + list(merged.values())
+
+
+class DeltaMergeError(ValueError):
+    """已存（或排队中）的数据结构与增量数据不一致，无法合并；客户端应改为提交完整数据"""
+
+
+def merge_payload(source, stored, delta):
+    """
+    把增量负载 delta 合并进已存的完整负载 stored（均为已解析的数据），返回合并后的完整负载。
+    也用于合并排队中的两次提交：stored 为增量负载时结果仍是增量负载。
+    stored 为 MISSING 表示项目还没有该数据源的数据，此时增量数据即为全部数据；
+    结构不符（包括 JSON null）时抛出 DeltaMergeError，不会用增量数据替换已存的全部数据。
+    """
+    builders = SOURCE_RECORD_BUILDERS[source]
+    expected = list if builders[0][1] is None else dict
+    if not isinstance(delta, expected):
+        raise DeltaMergeError(f"{source} 的增量数据结构不正确，请提交完整数据")
+    if stored is MISSING:
+        return delta
+    if not isinstance(stored, expected):
+        logger.warning(f"{source} 的已存数据结构不正确（{type(stored).__name__}），拒绝增量合并")
+        raise DeltaMergeError(f"{source} 的已存数据无法与增量数据合并，请提交完整数据")
+    if expected is list:
+        return _merge_items(stored, delta, builders[0][0])
+
+    merged = dict(stored)
+    record_keys = {key for _, key, _ in builders}
+    merged.update((k, v) for k, v in delta.items() if k not in record_keys)
+    for table_name, key, _ in builders:
+        if delta.get(key):
+            merged[key] = _merge_items(stored.get(key) or [], delta[key], table_name)
+    return merged
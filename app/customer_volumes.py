@@ -0,0 +1,73 @@
+# 文件: customer_volumes.py
+# 客户（买方）成交汇总：各交易平台先在自己的表中按买方名称分组，再 UNION ALL 合并，代价与成交记录数成线性关系
+
+from sqlalchemy import bindparam, text
+
+# 平台 -> (关联表, 买方名称列, 成交量列, 成交金额表达式, 交易时间列, 附加条件)
+# 条件与客户成交情况页面一致：单向挂牌取状态 '1'，双边线下取状态 '3'
+CUSTOMER_SOURCES = {
+    'unilateral': ("gzpt_unilateral_listings", "member_name", "total_quantity",
+                   "CAST(total_amount AS DECIMAL(15,2))", "order_time_str", "AND order_status = '1'"),
+    'online': ("gzpt_bilateral_online_trades", "member_name", "total_quantity",
+               "CAST(total_amount AS DECIMAL(15,2))", "order_time_str", ""),
+    'offline': ("gzpt_bilateral_offline_trades", "member_name", "total_quantity",
+                "CAST(total_amount AS DECIMAL(15,2))", "order_time_str", "AND order_status = '3'"),
+    'beijing': ("beijing_power_exchange_trades", "buyer_entity_name", "transaction_quantity",
+                "CAST(transaction_quantity AS DECIMAL(15,2)) * CAST(transaction_price AS DECIMAL(15,2))",
+                "transaction_time", ""),
+    'guangzhou': ("guangzhou_power_exchange_trades", "buyer_entity_name", "gpc_certifi_num",
+                  "CAST(total_cost AS DECIMAL(15,2))", "deal_time", ""),
+}
+
+CUSTOMER_TABLES = frozenset(source[0] for source in CUSTOMER_SOURCES.values())
+
+
+def _platform_sql(platform, filters):
+    table_name, buyer, quantity, amount, time_column, condition = CUSTOMER_SOURCES[platform]
+    clauses = ''.join(f" AND {clause.format(time=time_column)}" for clause in filters)
+    return f"""
+            SELECT {buyer} AS customer_name,
+                   SUM(CAST({quantity} AS DECIMAL(15,2))) AS quantity,
+                   SUM({amount}) AS amount
+            FROM {table_name}
+            WHERE {buyer} IS NOT NULL AND {buyer} != '未知客户'
+              AND CAST({quantity} AS DECIMAL(15,2)) > 0 {condition}{clauses}
+            GROUP BY {buyer}"""
+
+
+def customer_totals(connection, project_ids=None, production_range=None, transaction_range=None, limit=None):
+    """
+    按买方汇总各交易平台的成交，返回按成交量降序的行 (customer_name, total_quantity, total_amount)，只含成交量大于0的客户。
+    project_ids 为 None 时统计全部项目；production_range 为 production_period 闭区间；
+    transaction_range 为交易日期闭区间 ('YYYY-MM-DD', 'YYYY-MM-DD')，截止日包含全天。
+    每个平台在自己的表中分组后再合并，不与台账按月连接，同一笔成交只计一次；
+    成交量不大于0的记录（退款、冲正等）不计入数量和金额。
+    """
+    filters, params, expanding = [], {}, []
+    if project_ids is not None:
+        if not project_ids:
+            return []
+        filters.append("project_id IN :project_ids")
+        params['project_ids'] = list(project_ids)
+        expanding.append(bindparam('project_ids', expanding=True))
+    if production_range is not None:
+        filters.append("production_period BETWEEN :start_period AND :end_period")
+        params['start_period'], params['end_period'] = production_range
+    if transaction_range is not None:
+        filters.append("{time} BETWEEN :start_time AND :end_time")
+        params['start_time'] = transaction_range[0]
+        params['end_time'] = f"{transaction_range[1]} 23:59:59"
+
+    union_sql = "\n            UNION ALL".join(_platform_sql(platform, filters) for platform in CUSTOMER_SOURCES)
+    sql = text(f"""
+        SELECT customer_name, SUM(quantity) AS total_quantity, SUM(amount) AS total_amount
+        FROM ({union_sql}
+        ) AS by_platform
+        GROUP BY customer_name
+        HAVING SUM(quantity) > 0
+        ORDER BY total_quantity DESC
+        {f'LIMIT {int(limit)}' if limit else ''}
+    """)
+    if expanding:
+        sql = sql.bindparams(*expanding)
+    return connection.execute(sql, params).fetchall()
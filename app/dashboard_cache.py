@@ -5,48 +5,99 @@ Dashboard数据缓存系统
 """
 
 import json
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from sqlalchemy import text
-from .models import db, Project, Customer
+from flask import current_app
+from sqlalchemy import bindparam, text
+from .models import db
 from decimal import Decimal
 from .utils import get_province_short_name
+from .snapshot_store import snapshot_store
+from .change_events import subscribe
+from .customer_volumes import customer_totals
+from .timing import StageTimer
 
-# 全局缓存存储
+# 快照键带数据结构版本号，结构变化后旧版本写入（或保存在磁盘上）的快照不会被新代码读到
+SNAPSHOT_SCHEMA_VERSION = 2
+SNAPSHOT_KEY = f'dashboard.v{SNAPSHOT_SCHEMA_VERSION}'
+
+# 全局缓存状态；计算结果本身保存在 snapshot_store 中，可由同一主机上的多个进程共享
 dashboard_cache = {
-    'data': None,
-    'timestamp': None,
     'cache_duration': 10 * 60,  # 10分钟，单位：秒
-    'is_calculating': False  # 防止重复计算的标志
 }
 
+# 完整计算的单飞锁：同一时间只有一次完整计算，其它请求和定时任务直接使用已有快照
+# 完整计算与按变更的部分重算都会读取并发布同一份快照，二者在 snapshot_store.lock 内依次进行
+# （mmap 后端时跨进程），避免后发布的覆盖先发布的
+_calculate_lock = threading.Lock()
+
+def _snapshot_data():
+    snapshot = snapshot_store.get(SNAPSHOT_KEY)
+    return snapshot.value if snapshot else None
+
+def snapshot_age():
+    """当前快照距计算完成的秒数，尚无快照时返回 None"""
+    snapshot = snapshot_store.get(SNAPSHOT_KEY)
+    return time.time() - snapshot.timestamp if snapshot else None
+
+def full_calculation_age():
+    """距上一次完整计算的秒数；按变更的部分重算不刷新这个时间"""
+    data = _snapshot_data()
+    if not data or '_full_calculated_at' not in data:
+        return None
+    return time.time() - data['_full_calculated_at']
+
 def is_cache_valid():
     """检查缓存是否有效"""
-    if dashboard_cache['data'] is None or dashboard_cache['timestamp'] is None:
-        return False
-    
-    current_time = time.time()
-    cache_time = dashboard_cache['timestamp']
-    
-    return (current_time - cache_time) < dashboard_cache['cache_duration']
+    age = snapshot_age()
+    return age is not None and age < dashboard_cache['cache_duration']
 
 def get_cached_data():
     """获取缓存的数据"""
     if is_cache_valid():
-        return dashboard_cache['data']
+        return _snapshot_data()
     return None
 
-def calculate_dashboard_data():
-    """计算dashboard页面所需的所有数据"""
-    print(f"[{datetime.now()}] 开始计算dashboard数据...")
-    
-    # 防止重复计算
-    if dashboard_cache['is_calculating']:
-        print("数据正在计算中，跳过本次计算")
-        return dashboard_cache['data']
-    
-    dashboard_cache['is_calculating'] = True
+def get_dashboard_data():
+    """
+    页面使用的看板数据，返回 (数据, 是否过期)。
+    快照过期后立即返回旧快照并在后台刷新一次；过期超过 DASHBOARD_MAX_STALENESS 秒或尚无快照时，
+    本次请求等待计算完成（已有计算在进行时等待它，而不是再算一次）。
+    """
+    age = snapshot_age()
+    if age is not None and age < dashboard_cache['cache_duration']:
+        return _snapshot_data(), False
+    if age is not None and age < current_app.config.get('DASHBOARD_MAX_STALENESS', 60 * 60):
+        refresh_in_background(current_app._get_current_object())
+        return _snapshot_data(), True
+    data = calculate_dashboard_data(wait=True)
+    return data, data is not None and not is_cache_valid()
+
+def refresh_in_background(app):
+    """在后台线程中完整计算一次；已有计算在进行时不再启动"""
+    if _calculate_lock.locked():
+        return False
+    def run():
+        with app.app_context():
+            calculate_dashboard_data()
+    threading.Thread(target=run, name='dashboard-refresh', daemon=True).start()
+    return True
+
+def calculate_dashboard_data(wait=False):
+    """
+    计算dashboard页面所需的所有数据。
+    已有计算在进行时不重复计算：wait=False 直接返回当前快照，wait=True 等它完成后返回新快照。
+    """
+    if not _calculate_lock.acquire(blocking=False):
+        if not wait:
+            print("数据正在计算中，跳过本次计算")
+            return _snapshot_data()
+        with _calculate_lock:
+            return _snapshot_data()
     
+    print(f"[{datetime.now()}] 开始计算dashboard数据...")
     try:
         # 【关键改动】: 移除了原来那段复杂的、有问题的app_context处理逻辑。
         # 现在，无论是Web请求还是后台调度器，调用方都会确保在正确的上下文中。
@@ -54,456 +105,478 @@ def calculate_dashboard_data():
     except Exception as e:
         print(f"[{datetime.now()}] Dashboard数据计算出错: {str(e)}")
         # 出错时可以考虑返回旧的缓存数据，避免前端页面崩溃
-        return dashboard_cache['data']
+        return _snapshot_data()
     finally:
-        dashboard_cache['is_calculating'] = False
+        _calculate_lock.release()
 
-def _do_calculate_dashboard_data():
-    """实际执行dashboard数据计算的内部函数"""
-    try:
-        # 1. 项目总数统计
-        total_projects = Project.query.count()
-        
-        # 2. 从各个数据表中获取核发和销售统计
-        with db.engine.connect() as connection:
-            # 获取核发总量（从绿证台账）
-            issued_result = connection.execute(text("""
-                SELECT COALESCE(SUM(CAST(ordinary_quantity AS DECIMAL(15,2))), 0) as total_issued
-                FROM nyj_green_certificate_ledger 
-                WHERE ordinary_quantity IS NOT NULL AND ordinary_quantity != ''
-            """))
-            total_issued = float(issued_result.scalar() or 0) / 10000  # 转换为万张
-            
-            # 获取销售总量（从绿证台账）
-            sold_result = connection.execute(text("""
-                SELECT COALESCE(SUM(CAST(sold_quantity AS DECIMAL(15,2))), 0) as total_sold
-                FROM nyj_green_certificate_ledger 
-                WHERE sold_quantity IS NOT NULL AND sold_quantity != ''
-            """))
-            total_sold = float(sold_result.scalar() or 0) / 10000  # 转换为万张
-            
-            # 获取平均成交价（加权平均）
-            avg_price_result = connection.execute(text("""
-                SELECT
-                    -- 计算加权平均价：总金额 / 总数量
-                    CASE
-                        WHEN SUM(total_quantity) > 0 THEN SUM(total_amount) / SUM(total_quantity)
-                        ELSE 0
-                    END as avg_price
-                FROM (
-                    -- 广州电力交易中心
-                    SELECT
-                        CAST(gpc_certifi_num AS DECIMAL(15,2)) as total_quantity,
-                        CAST(total_cost AS DECIMAL(15,2)) as total_amount
-                    FROM guangzhou_power_exchange_trades
-                    WHERE gpc_certifi_num IS NOT NULL AND gpc_certifi_num > 0 AND total_cost IS NOT NULL
-
-                    UNION ALL
-
-                    -- 绿证交易平台 - 单向挂牌
-                    SELECT
-                        CAST(total_quantity AS DECIMAL(15,2)) as total_quantity,
-                        CAST(total_amount AS DECIMAL(15,2)) as total_amount
-                    FROM gzpt_unilateral_listings
-                    WHERE total_quantity IS NOT NULL AND total_quantity > 0 AND total_amount IS NOT NULL AND order_status = '1'
-
-                    UNION ALL
-
-                    -- 绿证交易平台 - 双边线下
-                    SELECT
-                        CAST(total_quantity AS DECIMAL(15,2)) as total_quantity,
-                        CAST(total_amount AS DECIMAL(15,2)) as total_amount
-                    FROM gzpt_bilateral_offline_trades
-                    WHERE total_quantity IS NOT NULL AND total_quantity > 0 AND total_amount IS NOT NULL AND order_status = '3'
-                    
-                ) as all_trades;
-            """))
-            avg_price = float(avg_price_result.scalar() or 0)
-            
-            # 获取按省份的销售TOP10（卖方省份）
-            province_sales = connection.execute(text("""
-                SELECT province, COALESCE(SUM(CAST(sold_quantity AS DECIMAL(15,2))), 0) as sales
-                FROM nyj_green_certificate_ledger 
-                WHERE sold_quantity IS NOT NULL AND sold_quantity != '' AND province IS NOT NULL
-                GROUP BY province 
-                ORDER BY sales DESC 
-            """)).fetchall()
-            
-            # 获取按买方省份的成交TOP10
-            projects = Project.query.all()
-            project_ids_list = [p.id for p in projects]
-            
-            if not project_ids_list:
-                buyer_province_sales = []
-                full_buyer_provinces_for_map = []
-            else:
-                # 获取交易数据
-                transaction_sql = """
-                    SELECT 
-                        CASE 
-                            WHEN bj.buyer_entity_name IS NOT NULL THEN bj.buyer_entity_name
-                            WHEN gz.buyer_entity_name IS NOT NULL THEN gz.buyer_entity_name
-                            WHEN ul.member_name IS NOT NULL THEN ul.member_name
-                            WHEN ol.member_name IS NOT NULL THEN ol.member_name
-                            WHEN off.member_name IS NOT NULL THEN off.member_name
-                            ELSE '未知客户'
-                        END as customer_name,
-                        
-                        -- 总成交量
-                        COALESCE(SUM(CAST(ul.total_quantity AS DECIMAL(15,2))), 0) + 
-                        COALESCE(SUM(CAST(ol.total_quantity AS DECIMAL(15,2))), 0) + 
-                        COALESCE(SUM(CAST(off.total_quantity AS DECIMAL(15,2))), 0) + 
-                        COALESCE(SUM(CAST(bj.transaction_quantity AS DECIMAL(15,2))), 0) + 
-                        COALESCE(SUM(CAST(gz.gpc_certifi_num AS DECIMAL(15,2))), 0) as total_quantity
-                    FROM projects p 
-                    JOIN nyj_green_certificate_ledger n ON p.id = n.project_id
-                    LEFT JOIN gzpt_unilateral_listings ul ON n.project_id = ul.project_id AND n.production_year_month = ul.generate_ym AND ul.order_status = '1'
-                    LEFT JOIN gzpt_bilateral_online_trades ol ON n.project_id = ol.project_id AND n.production_year_month = ol.generate_ym
-                    LEFT JOIN gzpt_bilateral_offline_trades off ON n.project_id = off.project_id AND n.production_year_month = off.generate_ym
-                    LEFT JOIN beijing_power_exchange_trades bj ON n.project_id = bj.project_id AND n.production_year_month = bj.production_year_month
-                    LEFT JOIN guangzhou_power_exchange_trades gz ON n.project_id = gz.project_id AND n.production_year_month = gz.product_date
-                    WHERE p.id IN :project_ids
-                    AND n.production_year_month >= '0000-01'
-                    AND n.production_year_month <= '9999-12'
-                    GROUP BY customer_name
-                    HAVING total_quantity > 0
-                """
-                
-                transaction_result = connection.execute(
-                    text(transaction_sql),
-                    {"project_ids": project_ids_list}
-                )
-                
-                # 按客户名称聚合交易量
-                customer_volumes = {}
-                for row in transaction_result:
-                    if row.customer_name and row.customer_name != '未知客户':
-                        customer_volumes[row.customer_name] = float(row.total_quantity or 0)
-            
-                # 获取所有有省份信息的客户
-                all_customers = Customer.query.filter(
-                    Customer.province.isnot(None),
-                    Customer.province != '未设置'
-                ).all()
-                
-                # 按省份聚合成交量
-                province_volumes = {}
-                for customer in all_customers:
-                    if customer.customer_name in customer_volumes:
-                        province = customer.province
-                        volume = customer_volumes[customer.customer_name]
-                        if province not in province_volumes:
-                            province_volumes[province] = 0
-                        province_volumes[province] += volume
-                
-                # 省份名称映射
-                province_name_mapping = {
-                    '北京市': '北京', '天津市': '天津', '河北省': '河北', '山西省': '山西',
-                    '内蒙古自治区': '内蒙古', '辽宁省': '辽宁', '吉林省': '吉林', '黑龙江省': '黑龙江',
-                    '上海市': '上海', '江苏省': '江苏', '浙江省': '浙江', '安徽省': '安徽',
-                    '福建省': '福建', '江西省': '江西', '山东省': '山东', '河南省': '河南',
-                    '湖北省': '湖北', '湖南省': '湖南', '广东省': '广东', '广西壮族自治区': '广西',
-                    '海南省': '海南', '重庆市': '重庆', '四川省': '四川', '贵州省': '贵州',
-                    '云南省': '云南', '西藏自治区': '西藏', '陕西省': '陕西', '甘肃省': '甘肃',
-                    '青海省': '青海', '宁夏回族自治区': '宁夏', '新疆维吾尔自治区': '新疆',
-                    '台湾省': '台湾', '香港特别行政区': '香港', '澳门特别行政区': '澳门'
-                }
-                
-                # 转换为前端需要的格式
-                # 【修改点 A】: 转换买方省份数据，并保存完整列表
-                province_data_list = []
-                for province, volume in province_volumes.items():
-                    mapped_name = province_name_mapping.get(province, province)
-                    province_data_list.append({
-                        'name': mapped_name,
-                        'value': round(volume / 10000, 2)
-                    })
-                
-                province_data_list.sort(key=lambda x: x['value'], reverse=True)
-                
-                # 这一份是完整的买方省份数据，用于热力图
-                full_buyer_provinces_for_map = province_data_list
-                
-                # 这一份是截取前10的数据，用于Top10榜单
-                top_buyer_provinces = province_data_list[:10]
+# --- 看板的各个部分 ---
+# 每个部分是一个函数 (connection, data, project_ids) -> 要写入快照的键值，data 为当前快照（完整计算时为本次已算出的部分）。
+# project_ids 为本次变更涉及的项目（None 表示全部），只有可按项目累加的部分会用到它。
+# 以下划线开头的键是内部状态，不在页面上使用。
 
+LEDGER = 'nyj_green_certificate_ledger'
+GZPT_UNILATERAL = 'gzpt_unilateral_listings'
+GZPT_ONLINE = 'gzpt_bilateral_online_trades'
+GZPT_OFFLINE = 'gzpt_bilateral_offline_trades'
+BEIJING = 'beijing_power_exchange_trades'
+GUANGZHOU = 'guangzhou_power_exchange_trades'
+
+def _section_project_count(connection, data, project_ids):
+    """项目总数"""
+    return {'_project_count': connection.execute(text("SELECT COUNT(*) FROM projects")).scalar() or 0}
+
+def _section_ledger_totals(connection, data, project_ids):
+    """
+    各项目的核发量和销售量（单位：张），总量由它们相加得到。
+    给出 project_ids 时只重新查询这些项目，其它项目沿用快照中的值。
+    """
+    sql = """
+        SELECT project_id,
+            COALESCE(SUM(CASE WHEN ordinary_quantity IS NOT NULL AND ordinary_quantity != ''
+                THEN CAST(ordinary_quantity AS DECIMAL(15,2)) END), 0) as issued,
+            COALESCE(SUM(CASE WHEN sold_quantity IS NOT NULL AND sold_quantity != ''
+                THEN CAST(sold_quantity AS DECIMAL(15,2)) END), 0) as sold
+        FROM nyj_green_certificate_ledger
+    """
+    previous = data.get('_ledger_totals')
+    if project_ids is None or previous is None:
+        totals = {}
+        rows = connection.execute(text(sql + " GROUP BY project_id")).fetchall()
+    else:
+        changed = {str(project_id) for project_id in project_ids}
+        totals = {pid: value for pid, value in previous.items() if pid not in changed}
+        rows = connection.execute(
+            text(sql + " WHERE project_id IN :ids GROUP BY project_id").bindparams(bindparam('ids', expanding=True)),
+            {'ids': sorted(project_ids)}).fetchall()
+    for project_id, issued, sold in rows:
+        totals[str(project_id)] = [float(issued or 0), float(sold or 0)]
+    return {'_ledger_totals': totals}
+
+def _section_avg_price(connection, data, project_ids):
+    """平均成交价（加权平均）"""
+    avg_price_result = connection.execute(text("""
+        SELECT
+            -- 计算加权平均价：总金额 / 总数量
+            CASE
+                WHEN SUM(total_quantity) > 0 THEN SUM(total_amount) / SUM(total_quantity)
+                ELSE 0
+            END as avg_price
+        FROM (
+            -- 广州电力交易中心
+            SELECT
+                CAST(gpc_certifi_num AS DECIMAL(15,2)) as total_quantity,
+                CAST(total_cost AS DECIMAL(15,2)) as total_amount
+            FROM guangzhou_power_exchange_trades
+            WHERE gpc_certifi_num IS NOT NULL AND gpc_certifi_num > 0 AND total_cost IS NOT NULL
+
+            UNION ALL
+
+            -- 绿证交易平台 - 单向挂牌
+            SELECT
+                CAST(total_quantity AS DECIMAL(15,2)) as total_quantity,
+                CAST(total_amount AS DECIMAL(15,2)) as total_amount
+            FROM gzpt_unilateral_listings
+            WHERE total_quantity IS NOT NULL AND total_quantity > 0 AND total_amount IS NOT NULL AND order_status = '1'
+
+            UNION ALL
+
+            -- 绿证交易平台 - 双边线下
+            SELECT
+                CAST(total_quantity AS DECIMAL(15,2)) as total_quantity,
+                CAST(total_amount AS DECIMAL(15,2)) as total_amount
+            FROM gzpt_bilateral_offline_trades
+            WHERE total_quantity IS NOT NULL AND total_quantity > 0 AND total_amount IS NOT NULL AND order_status = '3'
+
+        ) as all_trades;
+    """))
+    return {'_avg_price': float(avg_price_result.scalar() or 0)}
+
+def _section_seller_provinces(connection, data, project_ids):
+    """按卖方省份的销售量：完整列表用于热力图，前10用于榜单"""
+    province_sales = connection.execute(text("""
+        SELECT province, COALESCE(SUM(CAST(sold_quantity AS DECIMAL(15,2))), 0) as sales
+        FROM nyj_green_certificate_ledger 
+        WHERE sold_quantity IS NOT NULL AND sold_quantity != '' AND province IS NOT NULL
+        GROUP BY province 
+        ORDER BY sales DESC 
+    """)).fetchall()
+
+    full_seller_provinces = [
+        {'name': row[0], 'value': round(float(row[1])/10000, 2)} 
+        for row in province_sales
+    ] if province_sales else []
+    top_provinces = [{'name': get_province_short_name(row['name']), 'value': row['value']}
+                     for row in full_seller_provinces[:10]]
+    return {'map_seller_provinces': full_seller_provinces, 'top_provinces': top_provinces}
+
+# 省份名称映射
+PROVINCE_NAME_MAPPING = {
+    '北京市': '北京', '天津市': '天津', '河北省': '河北', '山西省': '山西',
+    '内蒙古自治区': '内蒙古', '辽宁省': '辽宁', '吉林省': '吉林', '黑龙江省': '黑龙江',
+    '上海市': '上海', '江苏省': '江苏', '浙江省': '浙江', '安徽省': '安徽',
+    '福建省': '福建', '江西省': '江西', '山东省': '山东', '河南省': '河南',
+    '湖北省': '湖北', '湖南省': '湖南', '广东省': '广东', '广西壮族自治区': '广西',
+    '海南省': '海南', '重庆市': '重庆', '四川省': '四川', '贵州省': '贵州',
+    '云南省': '云南', '西藏自治区': '西藏', '陕西省': '陕西', '甘肃省': '甘肃',
+    '青海省': '青海', '宁夏回族自治区': '宁夏', '新疆维吾尔自治区': '新疆',
+    '台湾省': '台湾', '香港特别行政区': '香港', '澳门特别行政区': '澳门'
+}
+
+def _section_buyer_provinces(connection, data, project_ids):
+    """按买方（客户所在）省份的成交量：完整列表用于热力图，前10用于榜单"""
+    # 各平台分别按买方汇总后合并，不与台账按月连接
+    customer_volumes = {row.customer_name: float(row.total_quantity or 0) for row in customer_totals(connection)}
+
+    # 获取所有有省份信息的客户（各部分在线程池中计算，不经过 ORM 会话）
+    all_customers = connection.execute(text("""
+        SELECT customer_name, province FROM customers
+        WHERE province IS NOT NULL AND province != '未设置'
+    """)).fetchall()
+    
+    # 按省份聚合成交量
+    province_volumes = {}
+    for customer_name, province in all_customers:
+        if customer_name in customer_volumes:
+            volume = customer_volumes[customer_name]
+            if province not in province_volumes:
+                province_volumes[province] = 0
+            province_volumes[province] += volume
+    
+    # 转换为前端需要的格式
+    province_data_list = []
+    for province, volume in province_volumes.items():
+        mapped_name = PROVINCE_NAME_MAPPING.get(province, province)
+        province_data_list.append({
+            'name': mapped_name,
+            'value': round(volume / 10000, 2)
+        })
+    
+    province_data_list.sort(key=lambda x: x['value'], reverse=True)
+    
+    # 完整的买方省份数据用于热力图，前10用于Top10榜单
+    return {'map_buyer_provinces': province_data_list, 'top_buyer_provinces': province_data_list[:10]}
+
+def _section_secondary_units(connection, data, project_ids):
+    """按二级单位的销售TOP10"""
+    unit_sales = connection.execute(text("""
+        SELECT p.secondary_unit, COALESCE(SUM(CAST(n.sold_quantity AS DECIMAL(15,2))), 0) as sales
+        FROM projects p 
+        LEFT JOIN nyj_green_certificate_ledger n ON p.id = n.project_id
+        WHERE n.sold_quantity IS NOT NULL AND n.sold_quantity != '' 
+        AND p.secondary_unit IS NOT NULL
+        GROUP BY p.secondary_unit 
+        ORDER BY sales DESC 
+        LIMIT 10
+    """)).fetchall()
+
+    top_secondary_units = [
+        {'name': row[0], 'value': round(float(row[1])/10000, 1)} 
+        for row in unit_sales
+    ] if unit_sales else []
+    return {'top_secondary_units': top_secondary_units}
+
+def _section_volume_top10(connection, data, project_ids):
+    """成交量TOP10买方"""
+    top_volume_trades = []
+    for row in customer_totals(connection, limit=10):
+        quantity = float(row.total_quantity)
+        price = float(row.total_amount or 0) / quantity
+        top_volume_trades.append({
+            'buyer': row.customer_name or '未知',
+            'quantity': round(quantity, 0),
+            'price': round(price, 1)
+        })
+    return {'top_volume_trades': top_volume_trades}
+
+def _section_price_top10(connection, data, project_ids):
+    """成交价TOP10"""
+    price_top10 = connection.execute(text("""
+        SELECT 
+            buyer_name,
+            seller_name,
+            total_quantity,
+            unit_price,
+            platform
+        FROM (
+            -- 广州电力交易中心
+            SELECT 
+                buyer_entity_name as buyer_name,
+                COALESCE(p.secondary_unit, '未知单位') as seller_name,
+                CAST(gpc_certifi_num AS DECIMAL(15,2)) as total_quantity,
+                CAST(unit_price AS DECIMAL(10,2)) as unit_price,
+                '广交平台' as platform
+            FROM guangzhou_power_exchange_trades gz
+            LEFT JOIN projects p ON gz.project_id = p.id
+            WHERE gpc_certifi_num IS NOT NULL AND gpc_certifi_num >= 100 
+            AND unit_price IS NOT NULL AND unit_price > 0
             
-            # 获取按二级单位的销售TOP10
-            unit_sales = connection.execute(text("""
-                SELECT p.secondary_unit, COALESCE(SUM(CAST(n.sold_quantity AS DECIMAL(15,2))), 0) as sales
-                FROM projects p 
-                LEFT JOIN nyj_green_certificate_ledger n ON p.id = n.project_id
-                WHERE n.sold_quantity IS NOT NULL AND n.sold_quantity != '' 
-                AND p.secondary_unit IS NOT NULL
-                GROUP BY p.secondary_unit 
-                ORDER BY sales DESC 
-                LIMIT 10
-            """)).fetchall()
-            
-            # 获取成交量TOP10买方
-            volume_top10 = connection.execute(text("""
-                SELECT
-                    customer_name,
-                    SUM(total_quantity) as total_quantity,
-                    CASE
-                        WHEN SUM(total_quantity) > 0 THEN SUM(total_amount) / SUM(total_quantity)
-                        ELSE 0
-                    END as avg_price
-                FROM (
-                    -- 绿证交易平台 - 单向挂牌
-                    SELECT
-                        ul.member_name as customer_name,
-                        CAST(ul.total_quantity AS DECIMAL(15,2)) as total_quantity,
-                        CAST(ul.total_amount AS DECIMAL(15,2)) as total_amount
-                    FROM gzpt_unilateral_listings ul
-                    WHERE ul.total_quantity IS NOT NULL AND ul.total_quantity > 0 AND ul.order_status = '1'
-
-                    UNION ALL
-
-                    -- 绿证交易平台 - 双边线下
-                    SELECT
-                        off.member_name as customer_name,
-                        CAST(off.total_quantity AS DECIMAL(15,2)) as total_quantity,
-                        CAST(off.total_amount AS DECIMAL(15,2)) as total_amount
-                    FROM gzpt_bilateral_offline_trades off
-                    WHERE off.total_quantity IS NOT NULL AND off.total_quantity > 0 AND off.order_status = '3'
-
-                    UNION ALL
-                    
-                    -- 绿证交易平台 - 双边线上 (如有)
-                    SELECT
-                        ol.member_name as customer_name,
-                        CAST(ol.total_quantity AS DECIMAL(15,2)) as total_quantity,
-                        CAST(ol.total_amount AS DECIMAL(15,2)) as total_amount
-                    FROM gzpt_bilateral_online_trades ol
-                    WHERE ol.total_quantity IS NOT NULL AND ol.total_quantity > 0
-
-                    UNION ALL
-
-                    -- 北京电力交易中心
-                    SELECT
-                        bj.buyer_entity_name as customer_name,
-                        CAST(bj.transaction_quantity AS DECIMAL(15,2)) as total_quantity,
-                        CAST(bj.transaction_quantity AS DECIMAL(15,2)) * CAST(bj.transaction_price AS DECIMAL(15,2)) as total_amount
-                    FROM beijing_power_exchange_trades bj
-                    WHERE bj.transaction_quantity IS NOT NULL AND bj.transaction_quantity > 0
-
-                    UNION ALL
-
-                    -- 广州电力交易中心
-                    SELECT
-                        gz.buyer_entity_name as customer_name,
-                        CAST(gz.gpc_certifi_num AS DECIMAL(15,2)) as total_quantity,
-                        CAST(gz.total_cost AS DECIMAL(15,2)) as total_amount
-                    FROM guangzhou_power_exchange_trades gz
-                    WHERE gz.gpc_certifi_num IS NOT NULL AND gz.gpc_certifi_num > 0
-                ) as all_trades
-                WHERE customer_name IS NOT NULL AND customer_name != '未知客户'
-                GROUP BY customer_name
-                HAVING total_quantity > 0
-                ORDER BY total_quantity DESC
-                LIMIT 10
-            """)).fetchall()
+            UNION ALL
             
-            # 获取成交价TOP10
-            price_top10 = connection.execute(text("""
-                SELECT 
-                    buyer_name,
-                    seller_name,
-                    total_quantity,
-                    unit_price,
-                    platform
-                FROM (
-                    -- 广州电力交易中心
-                    SELECT 
-                        buyer_entity_name as buyer_name,
-                        COALESCE(p.secondary_unit, '未知单位') as seller_name,
-                        CAST(gpc_certifi_num AS DECIMAL(15,2)) as total_quantity,
-                        CAST(unit_price AS DECIMAL(10,2)) as unit_price,
-                        '广交平台' as platform
-                    FROM guangzhou_power_exchange_trades gz
-                    LEFT JOIN projects p ON gz.project_id = p.id
-                    WHERE gpc_certifi_num IS NOT NULL AND gpc_certifi_num >= 100 
-                    AND unit_price IS NOT NULL AND unit_price > 0
-                    
-                    UNION ALL
-                    
-                    -- 绿证交易平台 - 双边线下
-                    SELECT 
-                        member_name as buyer_name,
-                        COALESCE(p.secondary_unit, '双边交易') as seller_name,
-                        CAST(total_quantity AS DECIMAL(15,2)) as total_quantity,
-                        CAST(total_amount / total_quantity AS DECIMAL(10,2)) as unit_price,
-                        '绿证平台-双边' as platform
-                    FROM gzpt_bilateral_offline_trades off
-                    LEFT JOIN projects p ON off.project_id = p.id
-                    WHERE total_quantity IS NOT NULL AND total_quantity >= 100 
-                    AND total_amount IS NOT NULL AND total_amount > 0
-                    AND order_status = '3'
-                    
-                    UNION ALL
-                    
-                    -- 北京电力交易中心
-                    SELECT 
-                        buyer_entity_name as buyer_name,
-                        COALESCE(p.secondary_unit, '北交平台') as seller_name,
-                        CAST(transaction_quantity AS DECIMAL(15,2)) as total_quantity,
-                        CAST(transaction_price AS DECIMAL(10,2)) as unit_price,
-                        '北交平台' as platform
-                    FROM beijing_power_exchange_trades bj
-                    LEFT JOIN projects p ON bj.project_id = p.id
-                    WHERE transaction_quantity IS NOT NULL AND transaction_quantity >= 100 
-                    AND transaction_price IS NOT NULL AND transaction_price > 0
-                ) as all_trades
-                ORDER BY unit_price DESC
-                LIMIT 10
-            """)).fetchall()
+            -- 绿证交易平台 - 双边线下
+            SELECT 
+                member_name as buyer_name,
+                COALESCE(p.secondary_unit, '双边交易') as seller_name,
+                CAST(total_quantity AS DECIMAL(15,2)) as total_quantity,
+                CAST(total_amount / total_quantity AS DECIMAL(10,2)) as unit_price,
+                '绿证平台-双边' as platform
+            FROM gzpt_bilateral_offline_trades off
+            LEFT JOIN projects p ON off.project_id = p.id
+            WHERE total_quantity IS NOT NULL AND total_quantity >= 100 
+            AND total_amount IS NOT NULL AND total_amount > 0
+            AND order_status = '3'
             
-            # 获取近6个月的趋势数据
-            trend_data = connection.execute(text("""
-                SELECT 
-                    DATE_FORMAT(STR_TO_DATE(production_year_month, '%Y%m'), '%m月') as month_name,
-                    COALESCE(SUM(CAST(shelf_load AS DECIMAL(15,2))), 0) / 10000 as issued,
-                    COALESCE(SUM(CAST(sold_quantity AS DECIMAL(15,2))), 0) / 10000 as sold
-                FROM nyj_green_certificate_ledger 
-                WHERE production_year_month IS NOT NULL 
-                AND production_year_month REGEXP '^[0-9]{6}$'
-                AND production_year_month >= DATE_FORMAT(DATE_SUB(NOW(), INTERVAL 6 MONTH), '%Y%m')
-                GROUP BY production_year_month 
-                ORDER BY production_year_month 
-                LIMIT 6
-            """)).fetchall()
+            UNION ALL
             
-            # 获取主要项目信息表数据
-            main_projects = connection.execute(text("""
-                SELECT 
-                    p.project_name,
-                    p.province,
-                    p.secondary_unit,
-                    p.power_type,
-                    COALESCE(SUM(CAST(n.shelf_load AS DECIMAL(15,2))), 0) as issued,
-                    COALESCE(SUM(CAST(n.sold_quantity AS DECIMAL(15,2))), 0) as sold,
-                    COALESCE(AVG(CASE 
-                        WHEN n.sold_quantity > 0 AND CAST(n.sold_quantity AS DECIMAL) > 0 
-                        THEN CAST(n.tra_quantity AS DECIMAL) / CAST(n.sold_quantity AS DECIMAL) 
-                        ELSE NULL 
-                    END), 0) as avg_price
-                FROM projects p 
-                LEFT JOIN nyj_green_certificate_ledger n ON p.id = n.project_id
-                WHERE p.project_name IS NOT NULL
-                GROUP BY p.id, p.project_name, p.province, p.secondary_unit, p.power_type
-                ORDER BY issued DESC 
-                LIMIT 10
-            """)).fetchall()
-        
-        # 处理和格式化数据
-        stats = {
-            'total_projects': total_projects,
-            'total_issued': round(total_issued, 1),
-            'total_sold': round(total_sold, 1),
-            'avg_price': round(avg_price, 1)
-        }
-        
-        # 【修改点 B】: 处理卖方省份数据，并保存完整列表
-        # 这一份是完整的卖方省份数据，用于热力图
-        full_seller_provinces = [
-            {'name': row[0], 'value': round(float(row[1])/10000, 2)} 
-            for row in province_sales
-        ] if province_sales else []
-        # 这一份是截取前10的数据，用于Top10榜单
-        top_provinces = full_seller_provinces[:10]
-
-        top_provinces = [{'name': get_province_short_name(row['name']), 'value': row['value']} for row in top_provinces]
-        
-        # 处理二级单位数据
-        top_secondary_units = [
-            {'name': row[0], 'value': round(float(row[1])/10000, 1)} 
-            for row in unit_sales
-        ] if unit_sales else []
-        
-        # 处理成交量TOP10数据
-        top_volume_trades = [
-            {
-                'buyer': row[0] or '未知',
-                'quantity': round(float(row[1]), 0) if row[1] else 0,
-                'price': round(float(row[2]), 1) if row[2] else 0
-            }
-            for row in volume_top10
-        ] if volume_top10 else []
-        
-        # 处理成交价TOP10数据
-        top_price_trades = [
-            {
-                'buyer': row[0] or '未知',
-                'seller': row[1] or '未知',
-                'quantity': round(float(row[2]), 0) if row[2] else 0,
-                'price': round(float(row[3]), 1) if row[3] else 0,
-                'platform': row[4] or '未知'
-            }
-            for row in price_top10
-        ] if price_top10 else []
-        
-        # 处理趋势数据
-        trend_labels = [row[0] for row in trend_data] if trend_data else ['01月','02月','03月','04月','05月','06月']
-        trend_issued = [round(float(row[1]), 1) for row in trend_data] if trend_data else [0, 0, 0, 0, 0, 0]
-        trend_sold = [round(float(row[2]), 1) for row in trend_data] if trend_data else [0, 0, 0, 0, 0, 0]
-        
-        trend = {
-            'labels': trend_labels,
-            'issued': trend_issued,
-            'sold': trend_sold
-        }
-        
-        # 处理主要项目数据
-        main_projects_list = []
-        for row in main_projects:
-            main_projects_list.append({
-                'project_name': row[0],
-                'province': row[1],
-                'secondary_unit': row[2],
-                'power_type': row[3],
-                'total_issued': round(float(row[4])/10000, 1),
-                'total_sold': round(float(row[5])/10000, 1),
-            })
-        
-        # 【修改点 C】: 组装最终数据，加入为热力图准备的新键
-        cached_data = {
-            'stats': stats,
-            'top_provinces': top_provinces,
-            'top_buyer_provinces': top_buyer_provinces,
-            # --- 新增的两个键 ---
-            'map_seller_provinces': full_seller_provinces,
-            'map_buyer_provinces': full_buyer_provinces_for_map,
-            # --- ---------------- ---
-            'top_secondary_units': top_secondary_units,
-            'top_volume_trades': top_volume_trades,
-            'top_price_trades': top_price_trades,
-            'trend': trend,
-            'main_projects': main_projects_list,
-            'calculated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            -- 北京电力交易中心
+            SELECT 
+                buyer_entity_name as buyer_name,
+                COALESCE(p.secondary_unit, '北交平台') as seller_name,
+                CAST(transaction_quantity AS DECIMAL(15,2)) as total_quantity,
+                CAST(transaction_price AS DECIMAL(10,2)) as unit_price,
+                '北交平台' as platform
+            FROM beijing_power_exchange_trades bj
+            LEFT JOIN projects p ON bj.project_id = p.id
+            WHERE transaction_quantity IS NOT NULL AND transaction_quantity >= 100 
+            AND transaction_price IS NOT NULL AND transaction_price > 0
+        ) as all_trades
+        ORDER BY unit_price DESC
+        LIMIT 10
+    """)).fetchall()
+
+    top_price_trades = [
+        {
+            'buyer': row[0] or '未知',
+            'seller': row[1] or '未知',
+            'quantity': round(float(row[2]), 0) if row[2] else 0,
+            'price': round(float(row[3]), 1) if row[3] else 0,
+            'platform': row[4] or '未知'
         }
+        for row in price_top10
+    ] if price_top10 else []
+    return {'top_price_trades': top_price_trades}
+
+def _section_trend(connection, data, project_ids):
+    """近6个月的核发和销售趋势"""
+    six_months_ago = datetime.now() - timedelta(days=183)
+    trend_data = connection.execute(text("""
+        SELECT 
+            CONCAT(LPAD(production_period % 100, 2, '0'), '月') as month_name,
+            COALESCE(SUM(CAST(shelf_load AS DECIMAL(15,2))), 0) / 10000 as issued,
+            COALESCE(SUM(CAST(sold_quantity AS DECIMAL(15,2))), 0) / 10000 as sold
+        FROM nyj_green_certificate_ledger 
+        WHERE production_period >= :start_period
+        GROUP BY production_period 
+        ORDER BY production_period 
+        LIMIT 6
+    """), {'start_period': six_months_ago.year * 100 + six_months_ago.month}).fetchall()
+
+    trend_labels = [row[0] for row in trend_data] if trend_data else ['01月','02月','03月','04月','05月','06月']
+    trend_issued = [round(float(row[1]), 1) for row in trend_data] if trend_data else [0, 0, 0, 0, 0, 0]
+    trend_sold = [round(float(row[2]), 1) for row in trend_data] if trend_data else [0, 0, 0, 0, 0, 0]
+    return {'trend': {'labels': trend_labels, 'issued': trend_issued, 'sold': trend_sold}}
+
+def _section_main_projects(connection, data, project_ids):
+    """主要项目信息表"""
+    main_projects = connection.execute(text("""
+            SELECT 
+                p.project_name,
+                p.province,
+                p.secondary_unit,
+                p.power_type,
+                COALESCE(SUM(CAST(n.shelf_load AS DECIMAL(15,2))), 0) as issued,
+                COALESCE(SUM(CAST(n.sold_quantity AS DECIMAL(15,2))), 0) as sold,
+                COALESCE(AVG(CASE 
+                    WHEN n.sold_quantity > 0 AND CAST(n.sold_quantity AS DECIMAL) > 0 
+                    THEN CAST(n.tra_quantity AS DECIMAL) / CAST(n.sold_quantity AS DECIMAL) 
+                    ELSE NULL 
+                END), 0) as avg_price
+            FROM projects p 
+            LEFT JOIN nyj_green_certificate_ledger n ON p.id = n.project_id
+            WHERE p.project_name IS NOT NULL
+            GROUP BY p.id, p.project_name, p.province, p.secondary_unit, p.power_type
+            ORDER BY issued DESC 
+            LIMIT 10
+    """)).fetchall()
+
+    main_projects_list = []
+    for row in main_projects:
+        main_projects_list.append({
+            'project_name': row[0],
+            'province': row[1],
+            'secondary_unit': row[2],
+            'power_type': row[3],
+            'total_issued': round(float(row[4])/10000, 1),
+            'total_sold': round(float(row[5])/10000, 1),
+        })
+    return {'main_projects': main_projects_list}
+
+# 部分名称 -> (依赖的表, 计算函数)；依赖表发生变化时只重算对应的部分
+DASHBOARD_SECTIONS = {
+    'project_count': ({'projects'}, _section_project_count),
+    'ledger_totals': ({LEDGER}, _section_ledger_totals),
+    'avg_price': ({GUANGZHOU, GZPT_UNILATERAL, GZPT_OFFLINE}, _section_avg_price),
+    'seller_provinces': ({LEDGER}, _section_seller_provinces),
+    'buyer_provinces': ({'customers', GZPT_UNILATERAL, GZPT_ONLINE, GZPT_OFFLINE, BEIJING, GUANGZHOU},
+                        _section_buyer_provinces),
+    'secondary_units': ({'projects', LEDGER}, _section_secondary_units),
+    'volume_top10': ({GZPT_UNILATERAL, GZPT_ONLINE, GZPT_OFFLINE, BEIJING, GUANGZHOU}, _section_volume_top10),
+    'price_top10': ({'projects', GUANGZHOU, GZPT_OFFLINE, BEIJING}, _section_price_top10),
+    'trend': ({LEDGER}, _section_trend),
+    'main_projects': ({'projects', LEDGER}, _section_main_projects),
+}
+
+def _finish(data):
+    """由内部状态汇总顶部统计，并记录计算时间"""
+    totals = data.get('_ledger_totals', {}).values()
+    data['stats'] = {
+        'total_projects': data.get('_project_count', 0),
+        'total_issued': round(sum(issued for issued, _ in totals) / 10000, 1),  # 转换为万张
+        'total_sold': round(sum(sold for _, sold in totals) / 10000, 1),  # 转换为万张
+        'avg_price': round(data.get('_avg_price', 0), 1)
+    }
+    data['calculated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return data
+
+def _run_sections(names, data, project_ids):
+    """
+    在有界线程池（DASHBOARD_WORKERS 个线程）中并发计算各部分，每个部分使用连接池中的独立连接，
+    总耗时接近最慢的一个查询。成功部分的结果合并进 data，失败的部分保留 data 中原有的值。
+    返回 (计时器, 失败的部分名称)。
+    """
+    engine = db.engine  # 工作线程中没有应用上下文，先取出引擎
+    timer = StageTimer('dashboard')
+
+    def run(name):
+        start = time.perf_counter()
+        try:
+            with engine.connect() as connection:
+                return DASHBOARD_SECTIONS[name][1](connection, data, project_ids)
+        finally:
+            timer.add(name, time.perf_counter() - start)
+
+    workers = max(1, min(current_app.config.get('DASHBOARD_WORKERS', 4), len(names)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dashboard') as executor:
+        futures = {name: executor.submit(run, name) for name in names}
+    updates, failed = {}, []
+    for name, future in futures.items():
+        try:
+            updates.update(future.result())
+        except Exception as e:
+            failed.append(name)
+            print(f"[{datetime.now()}] Dashboard部分 {name} 计算出错: {str(e)}")
+    data.update(updates)
+    return timer, failed
+
+def _do_calculate_dashboard_data():
+    """实际执行dashboard数据计算的内部函数：并发计算所有部分，个别部分失败时沿用上一份快照中的值"""
+    try:
+        started = time.time()
+        with snapshot_store.lock(SNAPSHOT_KEY):
+            data = dict(_snapshot_data() or {})
+            if data.get('_full_calculated_at', 0) >= started:
+                # 等锁期间其它进程刚完成了一次完整计算，直接使用它
+                return data
+            timer, failed = _run_sections(list(DASHBOARD_SECTIONS), data, None)
+            if len(failed) == len(DASHBOARD_SECTIONS):
+                print(f"[{datetime.now()}] Dashboard数据计算失败，保留旧快照")
+                return _snapshot_data()
+            _finish(data)
+            data['_full_calculated_at'] = time.time()
+            data['_timings'] = timer.to_dict()
+            data['_failed_sections'] = failed
+            
+            # 发布快照（共享存储时同一主机上的其它进程也会读到）
+            snapshot_store.put(SNAPSHOT_KEY, data)
         
-        # 更新缓存
-        dashboard_cache['data'] = cached_data
-        dashboard_cache['timestamp'] = time.time()
-        
-        print(f"[{datetime.now()}] Dashboard数据计算完成")
-        return cached_data
+        print(f"[{datetime.now()}] Dashboard数据计算完成，耗时(毫秒): {data['_timings']}")
+        return data
         
     except Exception as e:
         print(f"[{datetime.now()}] Dashboard数据计算出错: {str(e)}")
-        return dashboard_cache['data']  # 返回旧数据
+        return _snapshot_data()  # 返回旧数据
+
+def refresh_sections(tables, project_ids=None):
+    """
+    只重算依赖 tables 的部分，合并进当前快照后发布，返回重算的部分名称。
+    尚无快照时不做任何事，等待下一次完整计算。
+    发布时沿用快照原来的计算时间：其余部分没有重算，快照照常按完整计算的时间过期。
+    """
+    names = [name for name, (depends, _) in DASHBOARD_SECTIONS.items() if depends & tables]
+    if not names or snapshot_store.get(SNAPSHOT_KEY) is None:
+        return []
+    with snapshot_store.lock(SNAPSHOT_KEY):
+        # 在锁内重新读取快照，避免覆盖另一次（或另一进程）刚发布的结果
+        snapshot = snapshot_store.get(SNAPSHOT_KEY)
+        if snapshot is None:
+            return []
+        data = dict(snapshot.value)
+        timer, failed = _run_sections(names, data, project_ids)
+        if len(failed) == len(names):
+            return []
+        snapshot_store.put(SNAPSHOT_KEY, _finish(data), timestamp=snapshot.timestamp)
+    print(f"[{datetime.now()}] Dashboard按变更重算，耗时(毫秒): {timer.to_dict()}")
+    return [name for name in names if name not in failed]
+
+class DashboardChangeListener:
+    """
+    订阅数据变更事件：合并 DASHBOARD_EVENT_DELAY 秒内的事件，在后台线程中只重算受影响的部分，
+    使新的提交在几秒内反映到看板上，而不必等下一次完整计算。
+    """
+
+    def __init__(self):
+        self.app = None
+        self.delay = 2
+        self._tables = set()
+        self._project_ids = set()
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.delay = app.config.get('DASHBOARD_EVENT_DELAY', 2)
+        if app.config.get('DASHBOARD_EVENT_REFRESH', True):
+            subscribe(self.on_change)
+        app.extensions['dashboard_change_listener'] = self
+
+    def on_change(self, change):
+        with self._lock:
+            self._tables.update(change.tables)
+            if change.project_ids is None or self._project_ids is None:
+                self._project_ids = None
+            else:
+                self._project_ids.update(change.project_ids)
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay, self._run)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _run(self):
+        with self._lock:
+            tables, project_ids = self._tables, self._project_ids
+            self._tables, self._project_ids, self._timer = set(), set(), None
+        with self.app.app_context():
+            try:
+                refresh_sections(tables, project_ids)
+            except Exception as e:
+                print(f"[{datetime.now()}] Dashboard按变更重算出错: {str(e)}")
+
+dashboard_change_listener = DashboardChangeListener()
 
 def force_refresh_cache():
-    """强制刷新缓存"""
-    dashboard_cache['timestamp'] = None
-    return calculate_dashboard_data()
+    """强制刷新缓存；已有计算在进行时等待它完成"""
+    return calculate_dashboard_data(wait=True)
 
 def get_cache_info():
     """获取缓存信息"""
+    snapshot = snapshot_store.get(SNAPSHOT_KEY)
     return {
         'is_valid': is_cache_valid(),
-        'last_updated': datetime.fromtimestamp(dashboard_cache['timestamp']).strftime('%Y-%m-%d %H:%M:%S') if dashboard_cache['timestamp'] else None,
+        'is_stale': snapshot is not None and not is_cache_valid(),
+        'last_updated': datetime.fromtimestamp(snapshot.timestamp).strftime('%Y-%m-%d %H:%M:%S') if snapshot else None,
+        'generation': snapshot.generation if snapshot else None,
         'cache_duration_minutes': dashboard_cache['cache_duration'] // 60,
-        'is_calculating': dashboard_cache['is_calculating']
+        'is_calculating': _calculate_lock.locked(),
+        # 上一次完整计算各部分的耗时（毫秒）和失败的部分
+        'timings': snapshot.value.get('_timings') if snapshot else None,
+        'failed_sections': snapshot.value.get('_failed_sections', []) if snapshot else []
     }
\ No newline at end of file
@@ -1,54 +1,336 @@
 # 文件: data_processors.py
 # 包含数据处理核心函数、清空和插入逻辑
 
+import hashlib
 import json
 import logging
+from collections import defaultdict
+from itertools import chain, islice, repeat
+from operator import itemgetter
 from datetime import datetime
 from decimal import Decimal, InvalidOperation
+from flask import current_app
 from .models import db, Project
-from .utils import parse_lzy_datetime, safe_int_cast
+from .schema import has_column
+from .payload_store import get_project_payload
+from .bulk_writer import bulk_insert, quote_column
+from .timing import stage, timed_iter
+from .change_events import record_change
+from .utils import (parse_lzy_datetime_column, safe_int_cast_column, iter_payload_items, to_production_period,
+                    period_from_year_month, production_period_column)
 
 # 创建日志记录器
 logger = logging.getLogger(__name__)
 
+# 数据源 -> (JSON数据列, 更新时间列)
+SOURCE_TO_COLUMN_MAP = {
+    "能源局网站": ("data_nyj", "data_nyj_updated_at"),
+    "绿证交易平台": ("data_lzy", "data_lzy_updated_at"),
+    "北京电力交易中心": ("data_bjdl", "data_bjdl_updated_at"),
+    "广州电力交易中心": ("data_gjdl", "data_gjdl_updated_at")
+}
+
+# 数据源 -> 关联表
+SOURCE_TABLES = {
+    "能源局网站": ["nyj_green_certificate_ledger", "nyj_transaction_records"],
+    "绿证交易平台": ["gzpt_unilateral_listings", "gzpt_bilateral_online_trades", "gzpt_bilateral_offline_trades"],
+    "北京电力交易中心": ["beijing_power_exchange_trades"],
+    "广州电力交易中心": ["guangzhou_power_exchange_trades"]
+}
+
+# 增量刷新时用于识别同一条记录的自然键（在同一 project_id 范围内）
+DERIVED_TABLE_KEYS = {
+    "nyj_transaction_records": ("order_id",),
+    "nyj_green_certificate_ledger": ("gec_unique_code", "production_year_month"),
+    "gzpt_unilateral_listings": ("order_id",),
+    "gzpt_bilateral_online_trades": ("order_id",),
+    "gzpt_bilateral_offline_trades": ("order_id",),
+    "beijing_power_exchange_trades": ("certificate_code",),
+    "guangzhou_power_exchange_trades": ("order_no",)
+}
+
 def clear_derived_data(project_id, source):
     """根据数据源，清空指定项目在关联表中的旧数据"""
-    source_map = {
-        "能源局网站": ["nyj_green_certificate_ledger", "nyj_transaction_records"],
-        "绿证交易平台": ["gzpt_unilateral_listings", "gzpt_bilateral_online_trades", "gzpt_bilateral_offline_trades"],
-        "北京电力交易中心": ["beijing_power_exchange_trades"],
-        "广州电力交易中心": ["guangzhou_power_exchange_trades"]
-    }
-    tables_to_clear = source_map.get(source, [])
-    for table_name in tables_to_clear:
-        # 使用原生SQL执行删除，更高效
+    tables_to_clear = SOURCE_TABLES.get(source, [])
+    record_change(tables_to_clear, project_id)
+    with stage('clear'):
+        for table_name in tables_to_clear:
+            # 使用原生SQL执行删除，更高效
+            db.session.execute(db.text(f"DELETE FROM {table_name} WHERE project_id = :pid"), {'pid': project_id})
+
+# 由 flask upgrade-db 补充的列：表中还没有这些列时，写入时会跳过
+OPTIONAL_COLUMNS = ('row_hash', 'production_period')
+
+def row_hasher(columns):
+    """
+    返回对与 columns 对应的值元组计算行哈希的函数，用于判断记录内容是否变化。
+    哈希覆盖除project_id和派生列以外的列，按列名排序后序列化；列的排序只在这里做一次。
+    """
+    pairs = sorted((col, i) for i, col in enumerate(columns) if col not in ('project_id',) + OPTIONAL_COLUMNS)
+
+    def row_hash(row):
+        values = [[col, row[i]] for col, i in pairs]
+        payload = json.dumps(values, ensure_ascii=False, default=str, separators=(',', ':'))
+        return hashlib.md5(payload.encode('utf-8')).hexdigest()
+    return row_hash
+
+def get_chunk_size():
+    """每批写入的记录数，决定了单次提交处理时的内存峰值"""
+    return current_app.config.get('INGEST_CHUNK_SIZE', 1000)
+
+def iter_chunks(records, chunk_size):
+    """将记录流切分为固定大小的批次"""
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def writable_columns(table_name, columns):
+    """可以写入该表的列（去掉表中尚不存在的可选列）"""
+    return [col for col in columns if col not in OPTIONAL_COLUMNS or has_column(table_name, col)]
+
+def insert_rows(table_name, columns, rows):
+    """
+    将与 columns 对应的值元组流交给批量写入，返回插入的行数。
+    表中有row_hash列而 columns 中没有时逐行追加哈希；表中尚不存在的可选列不写入。
+    """
+    columns = tuple(columns)
+    if not columns:
+        return 0
+    if 'row_hash' not in columns and has_column(table_name, 'row_hash'):
+        row_hash = row_hasher(columns)
+        rows = (row + (row_hash(row),) for row in rows)
+        columns += ('row_hash',)
+    keep = writable_columns(table_name, columns)
+    if len(keep) != len(columns):
+        rows = map(itemgetter(*[columns.index(col) for col in keep]), rows)
+    return bulk_insert(table_name, keep, rows)
+
+def normalize_key_part(value):
+    """
+    自然键比对用的规范形式，新旧两侧必须用同一规则：库中读出的值与JSON中的值类型可能不同（整数与字符串、
+    数字字符串的不同写法），MySQL 默认排序规则比较时又不区分大小写并忽略尾部空格。
+    统一为去掉首尾空白的小写字符串，数字按数值规范；规范得过粗只会让两个键相撞而退回全量重建，不会误删数据。
+    空值返回 None。
+    """
+    if value is None:
+        return None
+    text = str(value).strip()
+    if not text:
+        return None
+    try:
+        number = Decimal(text)
+    except InvalidOperation:
+        return text.lower()
+    return format(number.normalize(), 'f') if number.is_finite() else text.lower()
+
+def row_key(row, key_indexes):
+    """值元组的规范化自然键；任一部分为空时返回 None"""
+    key = tuple(normalize_key_part(row[i]) for i in key_indexes)
+    return None if any(part is None for part in key) else key
+
+def sync_records(project_id, table_name, make_rows):
+    """
+    增量刷新：按自然键比对新旧记录的哈希，只对变化的行执行INSERT/UPDATE/DELETE。
+    make_rows 每次调用返回一个新的 (列名, 值元组流)；新数据或库中数据存在空键、重复键时无法可靠比对，
+    退回到清空后重新插入（在同一事务中，已写入的批次会被一并覆盖）。
+    返回本次的变更统计。
+    """
+    key_columns = DERIVED_TABLE_KEYS[table_name]
+    chunk_size = get_chunk_size()
+
+    def fallback(reason):
+        logger.info(f"{table_name} (项目ID: {project_id}) 无法增量刷新（{reason}），改为全量重建")
         db.session.execute(db.text(f"DELETE FROM {table_name} WHERE project_id = :pid"), {'pid': project_id})
+        inserted = insert_rows(table_name, *make_rows())
+        return {'inserted': inserted, 'updated': 0, 'deleted': 0, 'unchanged': 0, 'full_rebuild': True}
+
+    if not has_column(table_name, 'row_hash'):
+        return fallback('缺少row_hash列，请先执行 flask upgrade-db')
+
+    # 库中只读取键和哈希，内存占用与行数成正比但远小于完整记录；
+    # existing 以规范化的键索引，值为 (库中原始键, 行哈希)，删除时按库中原始的键值匹配
+    existing = {}
+    key_sql = ', '.join(key_columns)
+    with stage('sync'):
+        rows = db.session.execute(
+            db.text(f"SELECT {key_sql}, row_hash FROM {table_name} WHERE project_id = :pid"),
+            {'pid': project_id}).fetchall()
+    for row in rows:
+        raw_key = tuple(row[:len(key_columns)])
+        key = tuple(normalize_key_part(part) for part in raw_key)
+        if key in existing:
+            return fallback('库中数据存在重复键')
+        existing[key] = (raw_key, row[-1])
+
+    where_sql = ' AND '.join(f"{col} = :key_{i}" for i, col in enumerate(key_columns))
+
+    def key_params(key):
+        return dict({'project_id': project_id}, **{f"key_{i}": part for i, part in enumerate(key)})
+
+    columns, rows = make_rows()
+    if columns and any(col not in columns for col in key_columns):
+        return fallback('新数据缺少自然键列')
+    key_indexes = [columns.index(col) for col in key_columns] if columns else []
+    row_hash = row_hasher(columns)
+    # 写入的行在末尾追加哈希
+    columns += ('row_hash',)
+    set_columns = [col for col in writable_columns(table_name, columns)
+                   if col != 'project_id' and col not in key_columns]
+    set_sql = ', '.join(f"{quote_column(col)} = :{col}" for col in set_columns)
+
+    def flush_updates(updates):
+        """updates 为 [(值元组, 库中原始键)]，按库中的键值定位要更新的行"""
+        params = []
+        for row, raw_key in updates:
+            param = dict(zip(columns, row))
+            param.update({f"key_{i}": part for i, part in enumerate(raw_key)})
+            params.append(param)
+        with stage('sync'):
+            db.session.execute(
+                db.text(f"UPDATE {table_name} SET {set_sql} WHERE project_id = :project_id AND {where_sql}"), params)
+
+    seen = set()
+    to_insert, to_update = [], []
+    inserted = updated = unchanged = 0
+    for row in rows:
+        key = row_key(row, key_indexes)
+        if key is None or key in seen:
+            return fallback('新数据存在空键或重复键')
+        seen.add(key)
+        row += (row_hash(row),)
+
+        if key not in existing:
+            to_insert.append(row)
+        elif existing[key][1] != row[-1]:
+            to_update.append((row, existing[key][0]))
+        else:
+            unchanged += 1
+
+        if len(to_insert) >= chunk_size:
+            inserted += insert_rows(table_name, columns, to_insert)
+            to_insert = []
+        if len(to_update) >= chunk_size:
+            flush_updates(to_update)
+            updated += len(to_update)
+            to_update = []
+
+    if to_insert:
+        inserted += insert_rows(table_name, columns, to_insert)
+    if to_update:
+        flush_updates(to_update)
+        updated += len(to_update)
+
+    deleted = 0
+    for chunk in iter_chunks((raw_key for key, (raw_key, _) in existing.items() if key not in seen), chunk_size):
+        with stage('sync'):
+            db.session.execute(
+                db.text(f"DELETE FROM {table_name} WHERE project_id = :project_id AND {where_sql}"),
+                [key_params(key) for key in chunk])
+        deleted += len(chunk)
 
-def process_nyj_data(project):
-    """处理能源局数据并准备插入"""
-    data = json.loads(project.data_nyj) if project.data_nyj else {}
+    return {'inserted': inserted, 'updated': updated, 'deleted': deleted,
+            'unchanged': unchanged, 'full_rebuild': False}
 
-    # 1. 处理交易记录
-    records = []
-    for record in data.get("交易记录", []):
-        records.append({
-            'project_id': project.id, 'city': record.get('city'), 'county': record.get('county'),
+def write_derived_records(project_id, table_name, make_rows):
+    """增量刷新一个关联表：只写入发生变化的行，返回记录数；有行变化时记录变更事件"""
+    stats = sync_records(project_id, table_name, make_rows)
+    logger.info(f"{table_name} (项目ID: {project_id}) 增量刷新: {stats}")
+    if stats['inserted'] or stats['updated'] or stats['deleted'] or stats['full_rebuild']:
+        record_change({table_name}, project_id)
+    return stats['inserted'] + stats['updated'] + stats['unchanged']
+
+def _count_records(records, row_counts, table_name):
+    """在记录流经过时统计条数"""
+    row_counts[table_name] = 0
+    for record in records:
+        row_counts[table_name] += 1
+        yield record
+
+def replace_derived_tables(items):
+    """
+    全量刷新一批 (项目ID, 数据源, 数据)：先清空各项目该数据源的关联表数据，再重新插入，
+    返回与 items 对应的 {关联表: 记录数} 列表。单条提交和批量提交都经由此函数，
+    同一关联表的所有记录合并为一个记录流分批插入，减少语句往返。
+    """
+    results, grouped = [], defaultdict(list)
+    for project_id, source, data in items:
+        clear_derived_data(project_id, source)
+        row_counts = {}
+        for table_name, make_rows in iter_source_rows(project_id, source, data):
+            columns, rows = make_rows()
+            row_counts[table_name] = 0
+            if columns:
+                grouped[table_name].append((columns, _count_records(rows, row_counts, table_name)))
+        results.append(row_counts)
+    for table_name, streams in grouped.items():
+        insert_rows(table_name, streams[0][0], chain.from_iterable(rows for _, rows in streams))
+    return results
+
+def merge_derived_records(project_id, table_name, columns, rows):
+    """
+    增量提交：按自然键用 rows（与 columns 对应的值元组列表）替换库中的同键记录（先删除再插入），
+    不影响其它记录，返回写入的行数。rows 中存在空键或重复键时返回 None，由调用方改为按合并后的完整数据刷新。
+    """
+    if not rows:
+        return 0
+    key_columns = DERIVED_TABLE_KEYS[table_name]
+    if any(col not in columns for col in key_columns):
+        return None
+    key_indexes = [columns.index(col) for col in key_columns]
+    keys, seen = [], set()
+    for row in rows:
+        # 按规范化的键判断重复（与 sync_records 一致），删除时仍用记录中的原值
+        key = row_key(row, key_indexes)
+        if key is None or key in seen:
+            return None
+        seen.add(key)
+        keys.append(tuple(row[i] for i in key_indexes))
+
+    record_change({table_name}, project_id)
+    where_sql = ' AND '.join(f"{col} = :key_{i}" for i, col in enumerate(key_columns))
+    for chunk in iter_chunks(keys, get_chunk_size()):
+        with stage('sync'):
+            db.session.execute(
+                db.text(f"DELETE FROM {table_name} WHERE project_id = :project_id AND {where_sql}"),
+                [dict({'project_id': project_id}, **{f"key_{i}": part for i, part in enumerate(key)})
+                 for key in chunk])
+    return insert_rows(table_name, columns, rows)
+
+def merge_derived_tables(project_id, source, delta):
+    """增量提交：只把 delta 中的记录写入关联表，返回各关联表写入的行数；无法按键合并时返回 None"""
+    row_counts = {}
+    for table_name, make_rows in iter_source_rows(project_id, source, delta):
+        columns, rows = make_rows()
+        count = merge_derived_records(project_id, table_name, columns, list(rows))
+        if count is None:
+            logger.info(f"{table_name} (项目ID: {project_id}) 增量数据存在空键或重复键，改为按完整数据刷新")
+            return None
+        row_counts[table_name] = count
+    return row_counts
+
+def iter_nyj_transactions(project_id, records):
+    """逐条规范化能源局的交易记录"""
+    for record in records:
+        yield {
+            'project_id': project_id, 'city': record.get('city'), 'county': record.get('county'),
             'order_id': record.get('orderId'), 'province': record.get('province'),
             'record_project_name': record.get('projectName'), 'production_year': record.get('productionYear'),
             'transaction_num': record.get('transactionNum'), 'buyer_unique_code': record.get('buyerUniqueCode'),
             'production_month': record.get('productionMonth'), 'transaction_time': record.get('transactionTime'),
-            'transaction_type': record.get('transactionType')
-        })
-    if records:
-        db.session.execute(db.text(
-            "INSERT INTO nyj_transaction_records (project_id, city, county, order_id, province, record_project_name, production_year, transaction_num, buyer_unique_code, production_month, transaction_time, transaction_type) VALUES (:project_id, :city, :county, :order_id, :province, :record_project_name, :production_year, :transaction_num, :buyer_unique_code, :production_month, :transaction_time, :transaction_type)"),
-                           records)
-
-    # 2. 处理绿证台账
-    ledgers = []
-    for ledger in data.get("绿证台账", []):
-        ledgers.append({
-            'project_id': project.id, 'city': ledger.get('city'), 'year': ledger.get('year'),
+            'transaction_type': record.get('transactionType'),
+            'production_period': period_from_year_month(record.get('productionYear'), record.get('productionMonth'))
+        }
+
+def iter_nyj_ledgers(project_id, records):
+    """逐条规范化能源局的绿证台账"""
+    for ledger in records:
+        yield {
+            'project_id': project_id, 'city': ledger.get('city'), 'year': ledger.get('year'),
             'month': ledger.get('month'), 'county': ledger.get('county'), 'province': ledger.get('province'),
             'issue_type': ledger.get('issueType'), 'shelf_load': ledger.get('shelfLoad'),
             'project_code': ledger.get('projectCode'), 'record_project_name': ledger.get('projectName'),
@@ -57,90 +339,101 @@ def process_nyj_data(project):
             'green_quantity': ledger.get('greenQuantity'), 'un_tra_quantity': ledger.get('unTraQuantity'),
             'unsold_quantity': ledger.get('unsoldQuantity'), 'release_quantity': ledger.get('releaseQuantity'),
             'ordinary_quantity': ledger.get('ordinaryQuantity'),
-            'production_year_month': ledger.get('productionYearMonth')
-        })
-    if ledgers:
-        sql = db.text(
-            "INSERT INTO nyj_green_certificate_ledger (project_id, city, `year`, `month`, county, province, issue_type, shelf_load, project_code, record_project_name, tra_quantity, unshelf_load, sold_quantity, gec_unique_code, green_quantity, un_tra_quantity, unsold_quantity, release_quantity, ordinary_quantity, production_year_month) VALUES (:project_id, :city, :year, :month, :county, :province, :issue_type, :shelf_load, :project_code, :record_project_name, :tra_quantity, :unshelf_load, :sold_quantity, :gec_unique_code, :green_quantity, :un_tra_quantity, :unsold_quantity, :release_quantity, :ordinary_quantity, :production_year_month)")
-        db.session.execute(sql, ledgers)
-
-def process_gzpt_data(project):
-    """处理绿证平台数据并准备插入 - 适配新的API数据结构"""
-    data = json.loads(project.data_lzy) if project.data_lzy else {}
-    trade_types = {"单向挂牌": "gzpt_unilateral_listings", "双边线上": "gzpt_bilateral_online_trades",
-                   "双边线下": "gzpt_bilateral_offline_trades"}
-
-    for trade_key, table_name in trade_types.items():
-        records_to_insert = []
-        for record in data.get(trade_key, []):
-            # 映射新的API数据结构到数据库字段
-            records_to_insert.append({
-                'project_id': project.id,
-                'order_id': record.get('orderId'),
-                'item_id': record.get('itemId'),
-                'product': record.get('product'),
-                'brokers': record.get('brokers'),
-                'project_name': record.get('projectName'),
-                'project_type': record.get('projectType'),
-                'transfer': record.get('transfer'),
-                'create_date': parse_lzy_datetime(record.get('createDate')),
-                'product_source': record.get('productSource'),
-                'project_property': record.get('projectProperty'),
-                'sn': record.get('sn'),
-                'member_name': record.get('memberName'),
-                'seller_name': record.get('sellerName'),
-                'generate_ym': record.get('generateYm'),
-                'member': safe_int_cast(record.get('member')),
-                'seller': safe_int_cast(record.get('seller')),
-                'total_quantity': record.get('totalQuantity'),
-                'total_amount': record.get('totalAmount'),
-                'order_time': parse_lzy_datetime(record.get('orderTime')),
-                'payment_method_name': record.get('paymentMethodName'),
-                'payment_method': record.get('paymentMethod'),
-                'payment_status': record.get('paymentStatus'),
-                'order_status': record.get('orderStatus'),
-                'order_type': record.get('orderType'),
-                'trade_code': record.get('tradeCode'),
-                'expire': parse_lzy_datetime(record.get('expire')),
-                'pay_time': parse_lzy_datetime(record.get('payTime')),
-                'approve_time': parse_lzy_datetime(record.get('approveTime')),
-                'rest_time': parse_lzy_datetime(record.get('restTime')),
-                'agreement': record.get('agreement'),
-                'is_online': record.get('isOnline'),
-                'thumbnail': record.get('thumbnail'),
-                'approve_reason': record.get('approveReason'),
-                'pay_failure_reason': record.get('payFailureReason'),
-                'interest': record.get('interest'),
-                'province': record.get('province'),
-                'payment_sn': record.get('paymentSn'),
-                'certificate_honor': record.get('certificateHonor'),
-                'platform_type': record.get('platformType'),
-                'price': record.get('price'),
-                'possessor': record.get('possessor'),
-                'center': record.get('center'),
-                'is_anonymous': record.get('isAnonymous'),
-                'tx_code': record.get('txCode'),
-                'quantity': record.get('quantity'),
-                'amount': record.get('amount'),
-                'order_time_str': record.get('orderTimeStr')
-            })
-        if records_to_insert:
-            # 构建动态SQL插入语句，包含所有字段
-            columns = list(records_to_insert[0].keys())
-            placeholders = [f":{col}" for col in columns]
-            sql = db.text(
-                f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join(placeholders)})")
-            db.session.execute(sql, records_to_insert)
-
-def process_beijing_trades(project):
-    """处理北京交易中心数据并准备插入"""
-    data = json.loads(project.data_bjdl) if project.data_bjdl else []
-    if not data or len(data) < 2: return
-    records_to_insert = []
-    for record in data[1:]:
+            'production_year_month': ledger.get('productionYearMonth'),
+            'production_period': to_production_period(ledger.get('productionYearMonth'))
+        }
+
+# 绿证平台交易记录的字段映射：(数据库列, API字段, 列转换函数)，转换函数作用于整列
+GZPT_TRADE_FIELDS = [
+    ('order_id', 'orderId', None),
+    ('item_id', 'itemId', None),
+    ('product', 'product', None),
+    ('brokers', 'brokers', None),
+    ('project_name', 'projectName', None),
+    ('project_type', 'projectType', None),
+    ('transfer', 'transfer', None),
+    ('create_date', 'createDate', parse_lzy_datetime_column),
+    ('product_source', 'productSource', None),
+    ('project_property', 'projectProperty', None),
+    ('sn', 'sn', None),
+    ('member_name', 'memberName', None),
+    ('seller_name', 'sellerName', None),
+    ('generate_ym', 'generateYm', None),
+    ('member', 'member', safe_int_cast_column),
+    ('seller', 'seller', safe_int_cast_column),
+    ('total_quantity', 'totalQuantity', None),
+    ('total_amount', 'totalAmount', None),
+    ('order_time', 'orderTime', parse_lzy_datetime_column),
+    ('payment_method_name', 'paymentMethodName', None),
+    ('payment_method', 'paymentMethod', None),
+    ('payment_status', 'paymentStatus', None),
+    ('order_status', 'orderStatus', None),
+    ('order_type', 'orderType', None),
+    ('trade_code', 'tradeCode', None),
+    ('expire', 'expire', parse_lzy_datetime_column),
+    ('pay_time', 'payTime', parse_lzy_datetime_column),
+    ('approve_time', 'approveTime', parse_lzy_datetime_column),
+    ('rest_time', 'restTime', parse_lzy_datetime_column),
+    ('agreement', 'agreement', None),
+    ('is_online', 'isOnline', None),
+    ('thumbnail', 'thumbnail', None),
+    ('approve_reason', 'approveReason', None),
+    ('pay_failure_reason', 'payFailureReason', None),
+    ('interest', 'interest', None),
+    ('province', 'province', None),
+    ('payment_sn', 'paymentSn', None),
+    ('certificate_honor', 'certificateHonor', None),
+    ('platform_type', 'platformType', None),
+    ('price', 'price', None),
+    ('possessor', 'possessor', None),
+    ('center', 'center', None),
+    ('is_anonymous', 'isAnonymous', None),
+    ('tx_code', 'txCode', None),
+    ('quantity', 'quantity', None),
+    ('amount', 'amount', None),
+    ('order_time_str', 'orderTimeStr', None),
+    ('production_period', 'generateYm', production_period_column)
+]
+
+def normalize_columns(project_id, records, fields):
+    """
+    列式规范化：先把一批记录按字段拆成列，再对需要转换的列整列转换（日期一次性解析并带备忘表），
+    最后按行组装成与 ('project_id', 各字段的列名) 对应的值元组，直接交给批量写入，不为每行构建字典。
+    """
+    if not records:
+        return []
+    source_keys = [source_key for _, source_key, _ in fields]
+    try:
+        # 接口返回的记录通常字段齐全，itemgetter 一次取出整行
+        rows = list(map(itemgetter(*source_keys), records))
+    except KeyError:
+        rows = [tuple(record.get(key) for key in source_keys) for record in records]
+
+    columns = [repeat(project_id, len(records))] + list(zip(*rows))
+    for index, (_, _, convert) in enumerate(fields, start=1):
+        if convert:
+            columns[index] = convert(columns[index])
+    return list(zip(*columns))
+
+# 绿证平台交易记录值元组对应的列
+GZPT_TRADE_COLUMNS = ('project_id',) + tuple(column for column, _, _ in GZPT_TRADE_FIELDS)
+
+def iter_gzpt_rows(project_id, records, chunk_size=None):
+    """按批列式规范化绿证平台的交易记录，产出与 GZPT_TRADE_COLUMNS 对应的值元组 - 适配新的API数据结构"""
+    for chunk in iter_chunks(records, chunk_size or get_chunk_size()):
+        yield from normalize_columns(project_id, chunk, GZPT_TRADE_FIELDS)
+
+def iter_gzpt_trades(project_id, records, chunk_size=None):
+    """按批列式规范化绿证平台的交易记录，产出字典；写库时使用 iter_gzpt_rows"""
+    for row in iter_gzpt_rows(project_id, records, chunk_size):
+        yield dict(zip(GZPT_TRADE_COLUMNS, row))
+
+def iter_beijing_trades(project_id, records):
+    """逐条规范化北京交易中心的成交记录，首行为表头"""
+    for record in islice(records, 1, None):
         try:
-            records_to_insert.append({
-                'project_id': project.id, 'transaction_type': record.get('Unnamed: 1'),
+            row = {
+                'project_id': project_id, 'transaction_type': record.get('Unnamed: 1'),
                 'seller_entity_name': record.get('Unnamed: 2'), 'seller_province': record.get('Unnamed: 3'),
                 'buyer_entity_name': record.get('Unnamed: 4'), 'buyer_province': record.get('Unnamed: 5'),
                 'transaction_year': record.get('Unnamed: 6'), 'production_year_month': record.get('Unnamed: 7'),
@@ -149,21 +442,16 @@ def process_beijing_trades(project):
                     'Unnamed: 10') is not None else None,
                 'transaction_quantity': int(record.get('Unnamed: 11')) if record.get(
                     'Unnamed: 11') is not None else None,
-                'transaction_time': record.get('Unnamed: 12'), 'record_project_name': record.get('平价绿证交易结果')
-            })
+                'transaction_time': record.get('Unnamed: 12'), 'record_project_name': record.get('平价绿证交易结果'),
+                'production_period': to_production_period(record.get('Unnamed: 7'))
+            }
         except (InvalidOperation, ValueError, TypeError) as e:
             logger.warning(f"跳过一条格式错误的bjdl记录: {record}，错误: {e}")
             continue
-    if records_to_insert:
-        sql = db.text(
-            "INSERT INTO beijing_power_exchange_trades (project_id, transaction_type, seller_entity_name, seller_province, buyer_entity_name, buyer_province, transaction_year, production_year_month, subsidy_type, certificate_code, transaction_price, transaction_quantity, transaction_time, record_project_name) VALUES (:project_id, :transaction_type, :seller_entity_name, :seller_province, :buyer_entity_name, :buyer_province, :transaction_year, :production_year_month, :subsidy_type, :certificate_code, :transaction_price, :transaction_quantity, :transaction_time, :record_project_name)")
-        db.session.execute(sql, records_to_insert)
-
-def process_guangzhou_trades(project):
-    """【已重构】处理来自广州交易中心(GJDL)的数据，包含所有字段"""
-    # 确保从JSON加载数据，如果字段为空则视为空列表
-    data = json.loads(project.data_gjdl) if project.data_gjdl else []
+        yield row
 
+def iter_guangzhou_trades(project_id, records):
+    """【已重构】逐条规范化来自广州交易中心(GJDL)的数据，包含所有字段"""
     def parse_iso_datetime(dt_str):
         """辅助函数，用于解析API返回的日期时间字符串"""
         if not dt_str or not isinstance(dt_str, str):
@@ -189,11 +477,10 @@ def process_guangzhou_trades(project):
         # 如果不符合上述格式，返回原值
         return date_str
 
-    records_to_insert = []
-    for record in data:
+    for record in records:
         # 将每一行JSON数据映射到一个字典，键名与数据库列名一致
-        records_to_insert.append({
-            'project_id': project.id,
+        yield {
+            'project_id': project_id,
             'order_no': record.get('orderNo'),
             'declare_no': record.get('declareNo'),
             'record_project_name': record.get('projectName'),
@@ -243,54 +530,76 @@ def process_guangzhou_trades(project):
             'env_equity': record.get('envEquity'),
             'province_other': record.get('provinceOther'),
             'primary_value': record.get('primaryValue'),
-        })
-
-    if records_to_insert:
-        # 构建一个包含所有列的、完整的INSERT语句
-        # 使用命名参数 (:key) 可以让代码更清晰，并能自动处理None值
-        sql = db.text("""
-            INSERT INTO guangzhou_power_exchange_trades (
-                project_id, order_no, declare_no, record_project_name, product_date, project_type, subsidy_type, 
-                seller_entity_name, buyer_entity_name, trade_type, unit_price, gpc_certifi_num, total_cost, 
-                pay_status, distri_status, pt_status, gcc_wares_id, project_img_atta_id, province, 
-                deal_time, pay_time, distri_time, pt_time, order_detail_id, gpc_creei_status, 
-                market_entity_id_buyer, is_show, list_mode, order_status, pay_categ, refund_flag, 
-                gpc_certifi_cost, fee_cost_buyer, fee_cost_seller, buyer_ss_cost, seller_ss_cost, 
-                total_fee, oper_order_type, refund_cause_flag, market_entity_id_seller, declare_time, 
-                pay_type, pay_order_total, pay_sxf_total, total_fee_seller, total_fee_buyer, list_type, 
-                env_equity, province_other, primary_value
-            ) VALUES (
-                :project_id, :order_no, :declare_no, :record_project_name, :product_date, :project_type, :subsidy_type, 
-                :seller_entity_name, :buyer_entity_name, :trade_type, :unit_price, :gpc_certifi_num, :total_cost, 
-                :pay_status, :distri_status, :pt_status, :gcc_wares_id, :project_img_atta_id, :province, 
-                :deal_time, :pay_time, :distri_time, :pt_time, :order_detail_id, :gpc_creei_status, 
-                :market_entity_id_buyer, :is_show, :list_mode, :order_status, :pay_categ, :refund_flag, 
-                :gpc_certifi_cost, :fee_cost_buyer, :fee_cost_seller, :buyer_ss_cost, :seller_ss_cost, 
-                :total_fee, :oper_order_type, :refund_cause_flag, :market_entity_id_seller, :declare_time, 
-                :pay_type, :pay_order_total, :pay_sxf_total, :total_fee_seller, :total_fee_buyer, :list_type, 
-                :env_equity, :province_other, :primary_value
-            )
-        """)
-        # 使用 executemany 的方式批量插入，效率更高
-        db.session.execute(sql, records_to_insert)
-
-def update_derived_tables(project_id, source):
-    """核心函数：根据项目ID和数据源，清空并重新填充关联表数据"""
+            'production_period': to_production_period(record.get('productDate')),
+        }
+
+# 数据源 -> [(关联表, 负载中记录数组所在的键, 记录规范化函数)]；键为 None 表示负载本身就是记录数组
+SOURCE_RECORD_BUILDERS = {
+    "能源局网站": [
+        ("nyj_transaction_records", "交易记录", iter_nyj_transactions),
+        ("nyj_green_certificate_ledger", "绿证台账", iter_nyj_ledgers)
+    ],
+    "绿证交易平台": [
+        ("gzpt_unilateral_listings", "单向挂牌", iter_gzpt_trades),
+        ("gzpt_bilateral_online_trades", "双边线上", iter_gzpt_trades),
+        ("gzpt_bilateral_offline_trades", "双边线下", iter_gzpt_trades)
+    ],
+    "北京电力交易中心": [("beijing_power_exchange_trades", None, iter_beijing_trades)],
+    "广州电力交易中心": [("guangzhou_power_exchange_trades", None, iter_guangzhou_trades)]
+}
+
+# 有列式版本的记录规范化函数 -> (列名, 直接产出值元组的规范化函数)
+SOURCE_ROW_BUILDERS = {
+    iter_gzpt_trades: (GZPT_TRADE_COLUMNS, iter_gzpt_rows)
+}
+
+def iter_source_rows(project_id, source, data):
+    """
+    返回数据源对应的 [(关联表, make_rows)]，每次调用 make_rows 都会得到一个新的 (列名, 值元组流)。
+    有列式版本的规范化函数直接产出值元组；其它函数产出的字典按首条记录的键转为值元组，没有记录时列名为空。
+    """
+    tables = []
+    for table_name, key, build in SOURCE_RECORD_BUILDERS.get(source, []):
+        def make_rows(key=key, build=build):
+            items = iter_payload_items(data, key)
+            if build in SOURCE_ROW_BUILDERS:
+                columns, build_rows = SOURCE_ROW_BUILDERS[build]
+                return columns, timed_iter(build_rows(project_id, items), 'normalize')
+            records = timed_iter(build(project_id, items), 'normalize')
+            first = next(records, None)
+            if first is None:
+                return (), iter(())
+            columns = tuple(first)
+            return columns, map(itemgetter(*columns), chain([first], records))
+        tables.append((table_name, make_rows))
+    return tables
+
+def is_incremental_refresh():
+    return current_app.config.get('DERIVED_REFRESH_MODE', 'incremental') == 'incremental'
+
+def update_derived_tables(project_id, source, incremental=None, data=None):
+    """
+    核心函数：根据项目ID和数据源，刷新关联表数据，返回各关联表的记录数。
+    data 为已解析的提交数据；为空时从内容存储中解压项目的JSON文本并流式读取，不会整体反序列化。
+    记录以生成器方式逐条规范化，并按 INGEST_CHUNK_SIZE 分批写入。
+    incremental 为 None 时按配置 DERIVED_REFRESH_MODE 决定：
+    'replace' 清空后重新插入，'incremental' 只写入发生变化的行。
+    """
+    if incremental is None:
+        incremental = is_incremental_refresh()
     try:
-        clear_derived_data(project_id, source)
-        project = Project.query.get(project_id)
-        if not project: return
-
-        if source == "能源局网站":
-            process_nyj_data(project)
-        elif source == "绿证交易平台":
-            process_gzpt_data(project)
-        elif source == "北京电力交易中心":
-            process_beijing_trades(project)
-        elif source == "广州电力交易中心":
-            process_guangzhou_trades(project)
+        if data is None:
+            project = Project.query.get(project_id)
+            if not project: return {}
+            data = get_project_payload(project, SOURCE_TO_COLUMN_MAP[source][0])
+        if not incremental:
+            row_counts = replace_derived_tables([(project_id, source, data)])[0]
+        else:
+            row_counts = {table_name: write_derived_records(project_id, table_name, make_rows)
+                          for table_name, make_rows in iter_source_rows(project_id, source, data)}
 
         logger.info(f"项目 {project_id} 的 {source} 关联数据已更新。")
+        return row_counts
     except Exception as e:
         logger.error(f"更新关联表时出错 (项目ID: {project_id}, 源: {source}): {e}")
-        raise e
\ No newline at end of file
+        raise e
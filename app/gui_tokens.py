@@ -0,0 +1,102 @@
+# 文件: gui_tokens.py
+# GUI客户端的登录令牌：/api/login 签发带时效的签名令牌，后续请求只做HMAC校验，不再重复计算密码哈希；并按单位统计请求数
+
+import threading
+import time
+from functools import wraps
+from flask import current_app, g, jsonify, request
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+# 令牌放在该请求头中，与外部API使用的 Authorization: Bearer 区分
+TOKEN_HEADER = 'X-GUI-Token'
+_SALT = 'gui-token'
+
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt=_SALT)
+
+
+def issue_token(username, issued_at=None):
+    """
+    为二级单位签发令牌，返回 (令牌, 有效秒数)。
+    issued_at 为最初凭密码登录的时间，续期时沿用，令牌的总寿命不超过 GUI_TOKEN_MAX_LIFETIME。
+    """
+    config = current_app.config
+    issued_at = int(issued_at or time.time())
+    remaining = issued_at + config.get('GUI_TOKEN_MAX_LIFETIME', 7 * 86400) - time.time()
+    expires_in = int(max(0, min(config.get('GUI_TOKEN_TTL', 8 * 3600), remaining)))
+    return _serializer().dumps({'u': username, 'iat': issued_at}), expires_in
+
+
+def read_token(token):
+    """校验令牌，返回 (单位名称, 最初登录时间)；签名无效、已过期或超过最长寿命时返回 None"""
+    config = current_app.config
+    try:
+        payload, signed_at = _serializer().loads(
+            token, max_age=config.get('GUI_TOKEN_TTL', 8 * 3600), return_timestamp=True)
+    except (SignatureExpired, BadSignature):
+        return None
+    if not isinstance(payload, dict) or not payload.get('u'):
+        return None
+    # 旧版令牌没有 iat，按签发时间计算
+    issued_at = payload.get('iat') or int(signed_at.timestamp())
+    if time.time() - issued_at > config.get('GUI_TOKEN_MAX_LIFETIME', 7 * 86400):
+        return None
+    return payload['u'], issued_at
+
+
+def verify_token(token):
+    """校验令牌，返回其中的单位名称；无效时返回 None"""
+    result = read_token(token)
+    return result[0] if result else None
+
+
+class UnitUsage:
+    """按二级单位统计各接口的请求次数和最近访问时间，为按单位限流提供依据"""
+
+    def __init__(self):
+        self._counts = {}
+        self._last_seen = {}
+        self._lock = threading.Lock()
+
+    def record(self, unit, endpoint):
+        with self._lock:
+            counts = self._counts.setdefault(unit, {})
+            counts[endpoint] = counts.get(endpoint, 0) + 1
+            self._last_seen[unit] = time.time()
+
+    def to_dict(self):
+        with self._lock:
+            return {unit: {'requests': dict(counts), 'total': sum(counts.values()),
+                           'last_seen': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self._last_seen[unit]))}
+                    for unit, counts in self._counts.items()}
+
+
+unit_usage = UnitUsage()
+
+
+def unit_allowed(secondary_unit):
+    """带令牌的请求只能访问本单位的数据（管理员不受限）；旧客户端未带令牌时不做限制"""
+    unit = g.get('gui_unit')
+    return unit is None or unit == 'admin' or unit == secondary_unit
+
+
+def gui_auth(view):
+    """
+    GUI接口的令牌校验：带令牌时必须有效，单位名称放入 g.gui_unit 并计入统计；
+    未带令牌时，GUI_TOKEN_REQUIRED 为 False 则按旧客户端放行（g.gui_unit 为 None），否则返回 401。
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.gui_unit = None
+        token = request.headers.get(TOKEN_HEADER)
+        if token:
+            unit = verify_token(token)
+            if unit is None:
+                return jsonify({'success': False, 'message': '登录已过期，请重新登录', 'token_expired': True}), 401
+            g.gui_unit = unit
+            unit_usage.record(unit, request.endpoint)
+        elif current_app.config.get('GUI_TOKEN_REQUIRED', False):
+            return jsonify({'success': False, 'message': '缺少登录令牌，请先登录'}), 401
+        return view(*args, **kwargs)
+    return wrapper
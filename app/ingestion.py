@@ -0,0 +1,459 @@
+# 文件: ingestion.py
+# 数据提交的异步处理队列：接口线程只做校验和入队，由有界线程池在后台写库
+
+import json
+import logging
+import math
+import threading
+import time
+import uuid
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from .models import db, Project
+from .data_processors import (update_derived_tables, replace_derived_tables, merge_derived_tables,
+                              is_incremental_refresh, SOURCE_TO_COLUMN_MAP)
+from .cursors import MISSING, merge_payload
+from .timing import RollingStats, stage, start_timer, stop_timer
+from .write_locks import project_write_lock
+from .payload_store import (encode_payload, payload_hash, is_payload_unchanged, get_project_payload,
+                            set_project_payload, release_payload)
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+
+class IngestionMetrics:
+    """
+    进程内的提交统计：处理/跳过/失败的次数、写入的行数、内容未变而省下的数据量，
+    以及最近若干次提交各阶段耗时（毫秒）和各数据源每秒处理记录数的滚动分位数。
+    """
+
+    def __init__(self, window=500):
+        self._lock = threading.Lock()
+        self.stages = RollingStats(window)
+        self.throughput = RollingStats(window)
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self.submissions = 0
+            self.applied = 0
+            self.unchanged = 0
+            self.failed = 0
+            self.rows_written = 0
+            self.bytes_received = 0
+            self.bytes_skipped = 0
+        self.stages.clear()
+        self.throughput.clear()
+
+    def record(self, size, row_counts=None, unchanged=False, failed=False):
+        with self._lock:
+            self.submissions += 1
+            self.bytes_received += size
+            if failed:
+                self.failed += 1
+            elif unchanged:
+                self.unchanged += 1
+                self.bytes_skipped += size
+            else:
+                self.applied += 1
+                self.rows_written += sum((row_counts or {}).values())
+
+    def record_timings(self, timer, source=None, records=0):
+        """记录一次计时的各阶段耗时；给出数据源和记录数时同时记录吞吐量"""
+        for name, ms in timer.to_dict().items():
+            self.stages.add(f"{timer.label}.{name}", ms)
+        seconds = timer.total()
+        if source and records and seconds > 0:
+            self.throughput.add(source, records / seconds)
+
+    def to_dict(self):
+        with self._lock:
+            counters = {
+                'since': datetime.fromtimestamp(self.started_at).isoformat(),
+                'submissions': self.submissions,
+                'applied': self.applied,
+                'unchanged': self.unchanged,
+                'failed': self.failed,
+                'unchanged_ratio': round(self.unchanged / self.submissions, 4) if self.submissions else 0,
+                'rows_written': self.rows_written,
+                'bytes_received': self.bytes_received,
+                'bytes_skipped': self.bytes_skipped
+            }
+        counters['stages_ms'] = self.stages.summary()
+        counters['records_per_second'] = self.throughput.summary()
+        return counters
+
+
+ingestion_metrics = IngestionMetrics()
+
+def _reload_in_lock(projects):
+    """
+    拿到写入锁后调用：结束锁外开始的事务，再按ID重新加载项目，返回与 projects 对应的新实例。
+    InnoDB 可重复读的快照在事务的第一次读取时建立，锁外加载项目时已经开始，
+    不结束它就读不到之前持锁的提交写入的原始数据哈希和关联表。项目已被删除时抛出 LookupError。
+    """
+    ids = [project.id for project in projects]
+    db.session.rollback()
+    loaded = {project.id: project for project in Project.query.filter(Project.id.in_(set(ids)))}
+    missing = [project_id for project_id in ids if project_id not in loaded]
+    if missing:
+        raise LookupError(f"项目 {missing[0]} 已被删除")
+    return [loaded[project_id] for project_id in ids]
+
+
+# apply_submission 的结果：各关联表写入的行数，以及是否因内容未变而跳过了写库
+SubmissionResult = namedtuple('SubmissionResult', ['row_counts', 'unchanged'])
+
+
+def apply_submission(project, source, scraped_data, force=False, delta=False):
+    """
+    在一个事务中写入项目的原始数据、时间戳和关联表，返回 SubmissionResult。
+    规范化后的内容哈希与已存数据相同时只更新时间戳；force=True 时总是重写（如重放归档）。
+    delta=True 时 scraped_data 只含游标之后的新记录：先按自然键合并进已存数据，关联表只写入这些记录。
+    """
+    data_col, time_col = SOURCE_TO_COLUMN_MAP[source]
+    with stage('encode'):
+        text = encode_payload(scraped_data)
+        content_hash = payload_hash(text)
+    size = len(text)
+    try:
+        # 同一项目和数据源的写入依次进行，避免并发的 DELETE/INSERT 在同一 project_id 范围上互相等锁或死锁
+        with project_write_lock([(project.id, source)]):
+            project, = _reload_in_lock([project])
+            data = scraped_data
+            if delta:
+                # 合并必须在锁内读取已存数据，否则并发的两次增量提交会互相覆盖
+                with stage('merge'):
+                    stored = get_project_payload(project, data_col)
+                    data = merge_payload(source, json.loads(stored) if stored else MISSING, scraped_data)
+                    text = encode_payload(data)
+                    content_hash = payload_hash(text)
+
+            if not force and is_payload_unchanged(project, data_col, content_hash):
+                # 内容未变：只更新时间戳，不重写原始数据和关联表
+                setattr(project, time_col, datetime.now())
+                with stage('commit'):
+                    db.session.commit()
+                ingestion_metrics.record(size, unchanged=True)
+                logger.info(f"项目 {project.project_name} 的 {source} 数据未变化，跳过关联表刷新")
+                return SubmissionResult({}, True)
+
+            with stage('payload'):
+                old_hash = set_project_payload(project, data_col, text, content_hash)
+            setattr(project, time_col, datetime.now())
+
+            row_counts = merge_derived_tables(project.id, source, scraped_data) if delta else None
+            if row_counts is None:
+                # 直接使用已解析的数据，避免把刚序列化的JSON再反序列化一遍
+                row_counts = update_derived_tables(project.id, source, data=data) or {}
+
+            with stage('payload'):
+                release_payload(old_hash)
+            with stage('commit'):
+                db.session.commit()
+        ingestion_metrics.record(size, row_counts)
+        return SubmissionResult(row_counts, False)
+    except Exception:
+        db.session.rollback()
+        ingestion_metrics.record(size, failed=True)
+        raise
+
+
+def _apply_grouped(batch, incremental):
+    """
+    在一个事务中写入一批 (project, source, data)。
+    全量模式下由 replace_derived_tables 一次刷新整批（同一关联表的记录合并插入），与单条提交共用同一写入路径。
+    返回与 batch 对应的 SubmissionResult 列表。
+    """
+    with project_write_lock([(project.id, source) for project, source, _ in batch]):
+        projects = _reload_in_lock([project for project, _, _ in batch])
+        batch = [(project, source, data) for project, (_, source, data) in zip(projects, batch)]
+        return _apply_grouped_locked(batch, incremental)
+
+
+def _apply_grouped_locked(batch, incremental):
+    results, old_hashes, applied, replaced = [], [], [], []
+    for project, source, data in batch:
+        data_col, time_col = SOURCE_TO_COLUMN_MAP[source]
+        text = encode_payload(data)
+        content_hash = payload_hash(text)
+        if is_payload_unchanged(project, data_col, content_hash):
+            setattr(project, time_col, datetime.now())
+            results.append(SubmissionResult({}, True))
+            applied.append((len(text), None))
+            continue
+
+        old_hashes.append(set_project_payload(project, data_col, text, content_hash))
+        setattr(project, time_col, datetime.now())
+
+        if incremental:
+            row_counts = update_derived_tables(project.id, source, incremental=True, data=data)
+        else:
+            # 行数在整批写入后填入
+            row_counts = {}
+            replaced.append(((project.id, source, data), row_counts))
+        results.append(SubmissionResult(row_counts, False))
+        applied.append((len(text), row_counts))
+
+    if replaced:
+        for (_, row_counts), counts in zip(replaced, replace_derived_tables([item for item, _ in replaced])):
+            row_counts.update(counts)
+    for old_hash in old_hashes:
+        release_payload(old_hash)
+    db.session.commit()
+
+    # 提交成功后再计入统计，失败的批次会逐条重试并在那里计数
+    for size, row_counts in applied:
+        ingestion_metrics.record(size, row_counts, unchanged=row_counts is None)
+    return results
+
+
+def apply_batch(items, batch_size=50):
+    """
+    批量写入多个 (project, source, data)，每 batch_size 条提交一次。
+    某一批失败时回滚该批，并逐条重试，以便把失败限定在具体的条目上。
+    返回与 items 对应的结果列表：{'success': bool, 'row_counts' 和 'unchanged' 或 'message'}。
+    """
+    incremental = is_incremental_refresh()
+    results = []
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        try:
+            for result in _apply_grouped(batch, incremental):
+                results.append({'success': True, 'row_counts': result.row_counts, 'unchanged': result.unchanged})
+            continue
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"批量提交第 {start // batch_size + 1} 批失败，改为逐条处理: {e}")
+
+        for project, source, data in batch:
+            try:
+                result = apply_submission(project, source, data)
+                results.append({'success': True, 'row_counts': result.row_counts, 'unchanged': result.unchanged})
+            except Exception as e:
+                logger.error(f"批量提交中的条目失败，项目: {project.project_name}, 源: {source}: {e}")
+                results.append({'success': False, 'message': f'数据库错误，该条目已回滚: {str(e)}'})
+    return results
+
+
+class IngestionJob:
+    """一次数据提交任务，状态依次为 queued -> running -> done/failed"""
+
+    def __init__(self, project_id, project_name, source, payload, delta=False):
+        self.id = uuid.uuid4().hex
+        self.project_id = project_id
+        self.project_name = project_name
+        self.source = source
+        self.payload = payload
+        self.delta = delta  # 负载只含游标之后的新记录
+        self.status = 'queued'
+        self.coalesced = 0  # 排队期间被更新的提交覆盖的次数
+        self.row_counts = {}
+        self.unchanged = False  # 内容与已存数据相同，只更新了时间戳
+        self.timings = {}  # 后台处理各阶段耗时（毫秒）
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def key(self):
+        return self.project_id, self.source
+
+    def to_dict(self):
+        def fmt(ts):
+            return datetime.fromtimestamp(ts).isoformat() if ts else None
+
+        wait_ms = None
+        if self.started_at:
+            wait_ms = round((self.started_at - self.updated_at) * 1000, 1)
+        run_ms = None
+        if self.started_at and self.finished_at:
+            run_ms = round((self.finished_at - self.started_at) * 1000, 1)
+
+        return {
+            'job_id': self.id,
+            'project_name': self.project_name,
+            'source': self.source,
+            'mode': 'delta' if self.delta else 'full',
+            'status': self.status,
+            'coalesced': self.coalesced,
+            'row_counts': self.row_counts,
+            'unchanged': self.unchanged,
+            'timings': self.timings,
+            'total_rows': sum(self.row_counts.values()),
+            'error': self.error,
+            'created_at': fmt(self.created_at),
+            'updated_at': fmt(self.updated_at),
+            'started_at': fmt(self.started_at),
+            'finished_at': fmt(self.finished_at),
+            'wait_ms': wait_ms,
+            'run_ms': run_ms
+        }
+
+
+class IngestionBusy(Exception):
+    """写库繁忙：后台队列积压过深或同步写库的并发已满；retry_after 为建议客户端等待的秒数"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class IngestionQueue:
+    """
+    有界线程池驱动的提交队列。
+    同一 (项目, 数据源) 在排队期间的重复提交会合并到同一个任务中：完整提交替换排队的负载，
+    增量提交按自然键合并进排队的负载，不会丢失先到的记录。
+    排队和执行中的任务数达到 INGEST_MAX_BACKLOG 时拒绝新的提交（合并到已排队任务的除外），
+    同步写库的接口也通过 sync_slot 限制并发，使突发提交时的延迟保持有界。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.max_workers = 2
+        self.retention_seconds = 3600
+        self.max_backlog = 200
+        self.admission_wait = 2
+        self.retry_after_max = 120
+        self._executor = None
+        self._jobs = {}
+        self._pending = {}  # (project_id, source) -> 排队中的job_id
+        self._running = 0
+        self._avg_run_seconds = 1.0  # 任务耗时的指数滑动平均，用于估算 Retry-After
+        self._sync_slots = threading.BoundedSemaphore(4)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.max_workers = app.config.get('INGEST_WORKERS', 2)
+        self.retention_seconds = app.config.get('INGEST_JOB_RETENTION_SECONDS', 3600)
+        self.max_backlog = app.config.get('INGEST_MAX_BACKLOG', 200)
+        self.admission_wait = app.config.get('INGEST_ADMISSION_WAIT', 2)
+        self.retry_after_max = app.config.get('INGEST_RETRY_AFTER_MAX', 120)
+        self._sync_slots = threading.BoundedSemaphore(app.config.get('INGEST_MAX_SYNC_WRITERS', 4))
+        window = app.config.get('INGEST_METRICS_WINDOW', 500)
+        ingestion_metrics.stages.window = ingestion_metrics.throughput.window = window
+        app.extensions['ingestion_queue'] = self
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                thread_name_prefix='ingest')
+        return self._executor
+
+    def submit(self, project_id, project_name, source, payload, delta=False):
+        """入队一次提交；若同一项目和数据源已有排队任务，则将负载合并到该任务并返回它"""
+        with self._lock:
+            self._prune()
+            pending_id = self._pending.get((project_id, source))
+            job = self._jobs.get(pending_id) if pending_id else None
+            if job is not None and job.status == 'queued':
+                if delta:
+                    job.payload = merge_payload(source, job.payload, payload)
+                else:
+                    job.payload, job.delta = payload, False
+                job.coalesced += 1
+                job.updated_at = time.time()
+                logger.info(f"提交已合并到排队任务 {job.id} (项目: {project_name}, 源: {source})")
+                return job
+
+            backlog = len(self._pending) + self._running
+            if self.max_backlog and backlog >= self.max_backlog:
+                raise IngestionBusy(f'服务器繁忙，当前有 {backlog} 个提交待处理，请稍后重试',
+                                    self._retry_after(backlog))
+
+            job = IngestionJob(project_id, project_name, source, payload, delta)
+            self._jobs[job.id] = job
+            self._pending[job.key] = job.id
+
+        self._get_executor().submit(self._run, job.id)
+        return job
+
+    def _retry_after(self, backlog):
+        """按当前积压和平均任务耗时估算队列排空所需的秒数"""
+        seconds = math.ceil(backlog * self._avg_run_seconds / max(1, self.max_workers))
+        return max(1, min(self.retry_after_max, seconds))
+
+    @contextmanager
+    def sync_slot(self):
+        """同步写库（不经过后台队列）的并发许可；等待 INGEST_ADMISSION_WAIT 秒仍无空位时抛出 IngestionBusy"""
+        if not self._sync_slots.acquire(timeout=self.admission_wait):
+            with self._lock:
+                backlog = len(self._pending) + self._running
+            raise IngestionBusy('服务器繁忙，同时写库的请求过多，请稍后重试', self._retry_after(backlog + 1))
+        try:
+            yield
+        finally:
+            self._sync_slots.release()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return counts
+
+    def _run(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != 'queued':
+                return
+            job.status = 'running'
+            job.started_at = time.time()
+            self._running += 1
+            if self._pending.get(job.key) == job.id:
+                del self._pending[job.key]
+            payload, job.payload = job.payload, None
+
+        timer = start_timer('job')
+        with self.app.app_context():
+            try:
+                with stage('lookup'):
+                    project = Project.query.get(job.project_id)
+                if project is None:
+                    raise LookupError(f'项目 "{job.project_name}" 在数据库中未找到')
+                result = apply_submission(project, job.source, payload, delta=job.delta)
+                ingestion_metrics.record_timings(timer, job.source, sum(result.row_counts.values()))
+                with self._lock:
+                    job.row_counts = result.row_counts
+                    job.unchanged = result.unchanged
+                    job.timings = timer.to_dict()
+                    job.finished_at = time.time()
+                    job.status = 'done'
+            except Exception as e:
+                logger.error(f"后台提交任务失败 {job.id}，项目: {job.project_name}: {e}")
+                with self._lock:
+                    job.error = str(e)
+                    job.timings = timer.to_dict()
+                    job.finished_at = time.time()
+                    job.status = 'failed'
+            finally:
+                stop_timer()
+                with self._lock:
+                    self._running -= 1
+                    elapsed = (job.finished_at or time.time()) - job.started_at
+                    self._avg_run_seconds = 0.8 * self._avg_run_seconds + 0.2 * elapsed
+
+    def _prune(self):
+        """清理超过保留期的已完成任务（调用方需持有锁）"""
+        cutoff = time.time() - self.retention_seconds
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+ingestion_queue = IngestionQueue()
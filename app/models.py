@@ -1,6 +1,7 @@
 from flask_login import UserMixin
 from passlib.hash import sha256_crypt
 from datetime import datetime
+from sqlalchemy.dialects.mysql import LONGBLOB
 
 # 从 app/__init__.py 中导入 db 实例
 from . import db
@@ -47,11 +48,17 @@ class Project(db.Model):
     has_guangzhou_transaction = db.Column(db.Boolean, default=True) # 在广交做过交易
     has_green_cert_transaction = db.Column(db.Boolean, default=True) # 在绿证交易平台做过交易
 
-    # --- 新增字段，用于存储JSON数据 ---
-    data_nyj = db.Column(db.Text, nullable=True)  # 能源局网站
-    data_lzy = db.Column(db.Text, nullable=True)  # 绿证交易平台
-    data_bjdl = db.Column(db.Text, nullable=True) # 北京电力交易中心
-    data_gjdl = db.Column(db.Text, nullable=True) # 广州电力交易中心
+    # --- 旧的JSON数据列：新数据写入 source_payloads，这些列延迟加载，仅用于兼容未迁移的数据 ---
+    data_nyj = db.deferred(db.Column(db.Text, nullable=True))  # 能源局网站
+    data_lzy = db.deferred(db.Column(db.Text, nullable=True))  # 绿证交易平台
+    data_bjdl = db.deferred(db.Column(db.Text, nullable=True)) # 北京电力交易中心
+    data_gjdl = db.deferred(db.Column(db.Text, nullable=True)) # 广州电力交易中心
+
+    # --- 原始数据在 source_payloads 中的内容哈希（由 flask upgrade-db 补充，部署新版本前须先执行） ---
+    data_nyj_hash = db.Column(db.String(64), nullable=True)
+    data_lzy_hash = db.Column(db.String(64), nullable=True)
+    data_bjdl_hash = db.Column(db.String(64), nullable=True)
+    data_gjdl_hash = db.Column(db.String(64), nullable=True)
 
     data_nyj_updated_at = db.Column(db.DateTime, nullable=True)
     data_lzy_updated_at = db.Column(db.DateTime, nullable=True)
@@ -62,6 +69,39 @@ class Project(db.Model):
         return f'<Project {self.project_name}>'
 
 
+class SourcePayload(db.Model):
+    """按内容寻址的原始提交数据，压缩后存储，只在处理关联表时按需解压"""
+    __tablename__ = 'source_payloads'
+    content_hash = db.Column(db.String(64), primary_key=True)  # 原始JSON文本的sha256
+    codec = db.Column(db.String(16), nullable=False, default='zlib')
+    raw_size = db.Column(db.Integer, nullable=False)
+    stored_size = db.Column(db.Integer, nullable=False)
+    content = db.deferred(db.Column(db.LargeBinary().with_variant(LONGBLOB(), 'mysql'), nullable=False))
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    last_used_at = db.Column(db.DateTime, nullable=True)  # 最近一次被保存或引用的时间，释放时据此留出宽限期
+
+    def __repr__(self):
+        return f'<SourcePayload {self.content_hash[:12]} {self.raw_size}B>'
+
+
+class MonthlyRollup(db.Model):
+    """关联表按 (项目, 电量生产年月, 交易年月, 平台) 的汇总，在写入关联表的同一事务中维护，供统计分析页面查询"""
+    __tablename__ = 'project_monthly_rollup'
+    project_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    production_period = db.Column(db.Integer, primary_key=True, autoincrement=False)  # YYYYMM，无法识别时为0
+    transaction_month = db.Column(db.String(7), primary_key=True)  # 'YYYY-MM'，台账和没有交易时间的记录为''
+    platform = db.Column(db.String(16), primary_key=True)
+    quantity = db.Column(db.Numeric(18, 2), nullable=False, default=0)  # 成交量
+    amount = db.Column(db.Numeric(18, 2), nullable=False, default=0)  # 成交金额
+    issued = db.Column(db.Numeric(18, 2), nullable=False, default=0)  # 台账：普通绿证核发量
+    green = db.Column(db.Numeric(18, 2), nullable=False, default=0)  # 台账：绿电绿证核发量
+    sold = db.Column(db.Numeric(18, 2), nullable=False, default=0)  # 台账：已售量
+    __table_args__ = (db.Index('idx_rollup_period', 'production_period', 'platform'),)
+
+    def __repr__(self):
+        return f'<MonthlyRollup {self.project_id} {self.production_period} {self.transaction_month} {self.platform}>'
+
+
 class ExpectedPrice(db.Model):
     __tablename__ = 'expected_prices'
     id = db.Column(db.Integer, primary_key=True)
@@ -0,0 +1,100 @@
+# 文件: module_registry.py
+# GUI启动器下载的模块文件：按内容哈希生成版本清单，文件内容和预压缩版本缓存在内存中，文件变化后自动重新加载
+
+import gzip
+import hashlib
+import logging
+import os
+import threading
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+
+class ModuleFile:
+    """一个模块文件的当前版本：原始字节、sha256 以及可选的 gzip 预压缩字节"""
+
+    def __init__(self, name, path, data, stat, precompress):
+        self.name = name
+        self.path = path
+        self.filename = os.path.basename(path)
+        self.data = data
+        self.sha256 = hashlib.sha256(data).hexdigest()
+        self.stat_key = (stat.st_mtime_ns, stat.st_size)
+        self.gzip_data = gzip.compress(data, compresslevel=9, mtime=0) if precompress else None
+
+    @property
+    def version(self):
+        return self.sha256[:12]
+
+    def etag(self, encoding=None):
+        """强ETag；压缩版本的字节不同，使用不同的ETag"""
+        return f"{self.sha256}-gzip" if encoding == 'gzip' else self.sha256
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'filename': self.filename,
+            'version': self.version,
+            'sha256': self.sha256,
+            'size': len(self.data),
+            'gzip_size': len(self.gzip_data) if self.gzip_data is not None else None
+        }
+
+
+class ModuleRegistry:
+    """按名称提供模块文件；每次访问只做一次 stat，文件未变化时直接使用内存中的版本"""
+
+    def __init__(self, app=None):
+        self.directory = None
+        self.modules = {}
+        self.precompress = True
+        self._cache = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = app.config.get('MODULE_DIR') or os.path.join(app.root_path, 'routes')
+        self.modules = dict(app.config.get('MODULES', {'m1': 'm1.py'}))
+        self.precompress = app.config.get('MODULE_PRECOMPRESS', True)
+        app.extensions['module_registry'] = self
+
+    def get(self, name):
+        """返回模块的当前版本；未登记或文件不存在时返回 None"""
+        filename = self.modules.get(name)
+        if filename is None:
+            return None
+        path = os.path.join(self.directory, filename)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            logger.error(f"模块文件不存在: {path}")
+            return None
+
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+        module = self._cache.get(name)
+        if module is not None and module.stat_key == stat_key:
+            return module
+
+        with self._lock:
+            module = self._cache.get(name)
+            if module is None or module.stat_key != stat_key:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                module = ModuleFile(name, path, data, stat, self.precompress)
+                self._cache[name] = module
+                logger.info(f"已加载模块 {name} 版本 {module.version} ({len(data)} 字节)")
+            return module
+
+    def manifest(self):
+        """所有可用模块的版本清单"""
+        result = {}
+        for name in self.modules:
+            module = self.get(name)
+            if module is not None:
+                result[name] = module.to_dict()
+        return result
+
+
+module_registry = ModuleRegistry()
@@ -0,0 +1,148 @@
+# 文件: payload_store.py
+# 原始提交数据的内容寻址存储：JSON文本压缩后按sha256存入 source_payloads，项目只保存哈希
+
+import hashlib
+import json
+import logging
+import zlib
+from datetime import datetime, timedelta
+from flask import current_app
+from .models import db, Project, SourcePayload
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+# 项目中引用原始数据的哈希列
+PAYLOAD_HASH_COLUMNS = ["data_nyj_hash", "data_lzy_hash", "data_bjdl_hash", "data_gjdl_hash"]
+
+
+def encode_payload(data):
+    """将提交数据序列化为规范化的JSON文本：键排序、无多余空白，内容相同的提交得到相同的文本和哈希"""
+    return json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+
+def payload_hash(text):
+    """计算JSON文本的内容哈希（与 source_payloads.content_hash 一致）"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def store_payload(text, content_hash=None):
+    """
+    保存一段JSON文本（内容相同则只存一份），返回其内容哈希；调用方已算好哈希时可直接传入。
+    已存在时更新其 last_used_at：该 UPDATE 持有行锁直到本事务提交，与 release_payload 的删除互斥，
+    并让删除在宽限期内跳过它，避免另一个项目刚释放同一份内容（例如 []）时把正要引用的数据删掉。
+    """
+    raw = text.encode('utf-8')
+    content_hash = content_hash or hashlib.sha256(raw).hexdigest()
+    now = datetime.now()
+    touched = db.session.execute(
+        db.text("UPDATE source_payloads SET last_used_at = :now WHERE content_hash = :h"),
+        {'h': content_hash, 'now': now})
+    if touched.rowcount:
+        return content_hash
+
+    compressed = zlib.compress(raw, current_app.config.get('PAYLOAD_COMPRESS_LEVEL', 6))
+    # 两个后台任务可能同时写入相同内容，INSERT IGNORE 保证幂等
+    ignore = 'IGNORE' if db.session.get_bind().dialect.name == 'mysql' else 'OR IGNORE'
+    db.session.execute(db.text(
+        f"INSERT {ignore} INTO source_payloads "
+        "(content_hash, codec, raw_size, stored_size, content, created_at, last_used_at) "
+        "VALUES (:h, 'zlib', :raw_size, :stored_size, :content, :now, :now)"
+    ), {'h': content_hash, 'raw_size': len(raw), 'stored_size': len(compressed), 'content': compressed, 'now': now})
+    logger.info(f"已保存原始数据 {content_hash[:12]}: {len(raw)} -> {len(compressed)} 字节")
+    return content_hash
+
+
+def load_payload(content_hash):
+    """按哈希读取并解压JSON文本；项目引用的数据不存在时抛出 LookupError，而不是当作空数据清空关联表"""
+    if not content_hash:
+        return None
+    row = db.session.execute(
+        db.text("SELECT codec, content FROM source_payloads WHERE content_hash = :h"), {'h': content_hash}).first()
+    if row is None:
+        raise LookupError(f"原始数据 {content_hash} 不存在")
+    codec, content = row
+    if codec != 'zlib':
+        raise ValueError(f"不支持的原始数据编码: {codec}")
+    return zlib.decompress(content).decode('utf-8')
+
+
+def get_project_payload(project, data_column):
+    """读取项目某个数据源的JSON文本：优先使用内容存储，未迁移的项目回退到旧的Text列"""
+    content_hash = getattr(project, f"{data_column}_hash", None)
+    if content_hash:
+        return load_payload(content_hash)
+    return getattr(project, data_column)
+
+
+def is_payload_unchanged(project, data_column, content_hash):
+    """判断项目该数据源当前引用的内容哈希是否与给定哈希相同（未迁移的项目始终视为已变化）"""
+    return getattr(project, f"{data_column}_hash", None) == content_hash
+
+
+def set_project_payload(project, data_column, text, content_hash=None):
+    """保存JSON文本并让项目引用它，同时清空旧的Text列；返回被替换的旧哈希"""
+    hash_column = f"{data_column}_hash"
+    old_hash = getattr(project, hash_column)
+    setattr(project, hash_column, store_payload(text, content_hash))
+    setattr(project, data_column, None)
+    return old_hash if old_hash != getattr(project, hash_column) else None
+
+
+def release_cutoff():
+    """早于该时间未被使用的原始数据才允许删除（宽限期内可能有尚未提交的事务正要引用它）"""
+    return datetime.now() - timedelta(seconds=current_app.config.get('PAYLOAD_RELEASE_GRACE', 3600))
+
+
+def release_payload(content_hash):
+    """若没有任何项目再引用该哈希、且宽限期内没有被重新保存，则删除对应的原始数据"""
+    if not content_hash:
+        return False
+    db.session.flush()
+    conditions = ' OR '.join(f"{column} = :h" for column in PAYLOAD_HASH_COLUMNS)
+    referenced = db.session.execute(
+        db.text(f"SELECT 1 FROM projects WHERE {conditions} LIMIT 1"), {'h': content_hash}).first()
+    if referenced:
+        return False
+    # 并发的 store_payload 已更新 last_used_at 时，删除会等待其行锁并按提交后的值重新判断，从而跳过
+    result = db.session.execute(db.text(
+        "DELETE FROM source_payloads WHERE content_hash = :h AND COALESCE(last_used_at, created_at) < :cutoff"
+    ), {'h': content_hash, 'cutoff': release_cutoff()})
+    return result.rowcount > 0
+
+
+def prune_orphan_payloads():
+    """删除所有未被项目引用、且宽限期内未被使用的原始数据（例如项目被删除后遗留的），返回删除的条数"""
+    subqueries = ' UNION '.join(
+        f"SELECT {column} AS h FROM projects WHERE {column} IS NOT NULL" for column in PAYLOAD_HASH_COLUMNS)
+    result = db.session.execute(db.text(
+        f"DELETE FROM source_payloads WHERE content_hash NOT IN (SELECT h FROM ({subqueries}) AS refs) "
+        "AND COALESCE(last_used_at, created_at) < :cutoff"), {'cutoff': release_cutoff()})
+    db.session.commit()
+    return result.rowcount
+
+
+def migrate_legacy_payloads(batch_size=20):
+    """把 projects 中旧Text列里的JSON迁移到内容存储，返回迁移的数据源数量"""
+    data_columns = [column[:-len('_hash')] for column in PAYLOAD_HASH_COLUMNS]
+    conditions = ' OR '.join(f"{column} IS NOT NULL" for column in data_columns)
+    project_ids = [row[0] for row in db.session.execute(db.text(f"SELECT id FROM projects WHERE {conditions}"))]
+
+    migrated = 0
+    for start in range(0, len(project_ids), batch_size):
+        for project in Project.query.filter(Project.id.in_(project_ids[start:start + batch_size])):
+            for data_column in data_columns:
+                text = getattr(project, data_column)
+                if text is None:
+                    continue
+                # 迁移时统一为规范化文本，之后内容相同的重复提交可以直接命中哈希
+                try:
+                    text = encode_payload(json.loads(text))
+                except ValueError:
+                    logger.warning(f"项目 {project.id} 的 {data_column} 不是合法JSON，按原文迁移")
+                set_project_payload(project, data_column, text)
+                migrated += 1
+        # 分批提交，避免一次把所有项目的JSON都留在会话中
+        db.session.commit()
+        db.session.expunge_all()
+    return migrated
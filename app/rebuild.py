@@ -0,0 +1,208 @@
+# 文件: rebuild.py
+# 从已存的原始JSON批量重建关联表：子进程并行解析和规范化，少量写库线程负责写入，进度按 (项目, 数据源) 记录检查点
+
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from flask import Flask
+from .models import db, Project
+from .data_processors import SOURCE_TO_COLUMN_MAP, clear_derived_data, insert_rows, iter_source_rows, row_hasher
+from .payload_store import get_project_payload, payload_hash
+from .write_locks import project_write_lock
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+
+class RebuildCheckpoint:
+    """重建进度文件：每完成一个 (项目, 数据源) 追加一行，中断后用 --resume 跳过已完成的部分"""
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.done = set()
+        if resume and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    project_id, _, source = line.rstrip('\n').partition('\t')
+                    if source:
+                        self.done.add((int(project_id), source))
+        self._file = open(path, 'a' if resume else 'w', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def is_done(self, project_id, source):
+        return (project_id, source) in self.done
+
+    def mark(self, project_id, source):
+        with self._lock:
+            self._file.write(f"{project_id}\t{source}\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def _init_worker():
+    """子进程只需要配置（如 INGEST_CHUNK_SIZE），不连接数据库"""
+    app = Flask(__name__)
+    app.config.from_object('config')
+    app.app_context().push()
+
+
+def normalize_payload(project_id, source, text, version):
+    """在子进程中解析并规范化一个数据源的原始数据，返回 (项目ID, 数据源, [(关联表, 列名, 值元组列表)], 版本)"""
+    tables = []
+    for table_name, make_rows in iter_source_rows(project_id, source, text):
+        columns, rows = make_rows()
+        row_hash = row_hasher(columns)
+        tables.append((table_name, columns + ('row_hash',), [row + (row_hash(row),) for row in rows]))
+    return project_id, source, tables, version
+
+
+def payload_version(project, data_col):
+    """项目某数据源原始数据的版本：内容存储的哈希，未迁移的项目为旧Text列内容的哈希，没有数据时为 None"""
+    content_hash = getattr(project, f"{data_col}_hash", None)
+    if content_hash:
+        return content_hash
+    text = getattr(project, data_col)
+    return payload_hash(text) if text else None
+
+
+def _current_payload_version(project_id, data_col):
+    """在写入锁内读取项目当前的原始数据版本；项目已删除时返回 False"""
+    # 结束锁外开始的事务，使读取看到其他事务在拿到锁之前提交的数据
+    db.session.rollback()
+    row = db.session.execute(db.text(
+        f"SELECT {data_col}_hash, CASE WHEN {data_col}_hash IS NULL THEN {data_col} END "
+        f"FROM projects WHERE id = :pid"), {'pid': project_id}).first()
+    if row is None:
+        return False
+    return row[0] or (payload_hash(row[1]) if row[1] else None)
+
+
+def write_rebuilt(project_id, source, tables, version):
+    """
+    在一个事务中用规范化结果替换项目该数据源的关联表数据，返回写入的行数；与在线提交共用写入锁。
+    version 为规范化所用原始数据的版本；锁内发现项目的原始数据已被新的提交替换时不写入，返回 None。
+    tables 为空表示项目该数据源没有数据，只清空关联表。
+    """
+    data_col = SOURCE_TO_COLUMN_MAP[source][0]
+    with project_write_lock([(project_id, source)]):
+        if _current_payload_version(project_id, data_col) != version:
+            return None
+        clear_derived_data(project_id, source)
+        total = 0
+        for table_name, columns, rows in tables:
+            if rows:
+                # 表中尚未添加的可选列（row_hash、production_period）不写入
+                total += insert_rows(table_name, columns, rows)
+        db.session.commit()
+    return total
+
+
+def iter_rebuild_tasks(project_names=None, sources=None, skip=None):
+    """
+    按项目ID顺序给出 (项目ID, 数据源, JSON文本, 原始数据版本)；每次只加载一个项目的原始数据。
+    没有数据的数据源也会给出（JSON文本为 None），以便清空其关联表中遗留的行。
+    """
+    query = Project.query.with_entities(Project.id).order_by(Project.id)
+    if project_names:
+        query = query.filter(Project.project_name.in_(project_names))
+    for (project_id,) in query.all():
+        project = None
+        for source, (data_col, _) in SOURCE_TO_COLUMN_MAP.items():
+            if (sources and source not in sources) or (skip and skip(project_id, source)):
+                continue
+            project = project or Project.query.get(project_id)
+            try:
+                text = get_project_payload(project, data_col)
+            except LookupError as e:
+                logger.error(f"跳过项目 {project_id} 的 {source}: {e}")
+                continue
+            yield project_id, source, text or None, payload_version(project, data_col)
+        db.session.expunge_all()
+
+
+def rebuild_derived(app, project_names=None, sources=None, workers=None, writers=None, resume=False):
+    """
+    重建关联表，返回 {'done', 'failed', 'skipped', 'rows', 'seconds'}；skipped 为重建期间原始数据已被新提交替换的数据源。
+    解析和规范化在 workers 个子进程中进行；结果经有界队列交给 writers 个写库线程，各自使用独立的数据库连接。
+    """
+    workers = workers or app.config.get('REBUILD_WORKERS') or os.cpu_count() or 2
+    writers = writers or app.config.get('REBUILD_WRITERS', 2)
+    checkpoint = RebuildCheckpoint(app.config.get('REBUILD_CHECKPOINT_FILE', 'rebuild_checkpoint.txt'), resume)
+    if checkpoint.done:
+        print(f'从检查点继续，跳过 {len(checkpoint.done)} 个已完成的数据源。')
+
+    stats = {'done': 0, 'failed': 0, 'skipped': 0, 'rows': 0}
+    stats_lock = threading.Lock()
+    write_queue = queue.Queue(maxsize=writers * 2)
+    started = time.time()
+
+    def finish(outcome, rows=0):
+        with stats_lock:
+            stats[outcome] += 1
+            stats['rows'] += rows
+            count = stats['done'] + stats['failed'] + stats['skipped']
+            if count % 100 == 0:
+                print(f'已处理 {count} 个数据源，写入 {stats["rows"]} 行，用时 {time.time() - started:.0f} 秒')
+
+    def writer():
+        with app.app_context():
+            while True:
+                item = write_queue.get()
+                if item is None:
+                    return
+                project_id, source, tables, version = item
+                try:
+                    rows = write_rebuilt(project_id, source, tables, version)
+                    checkpoint.mark(project_id, source)
+                    if rows is None:
+                        # 原始数据在重建期间被新的提交替换，关联表已由那次提交写入
+                        logger.info(f"项目 {project_id} 的 {source} 原始数据已变化，跳过重建")
+                        finish('skipped')
+                    else:
+                        finish('done', rows)
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"重建关联表失败 (项目ID: {project_id}, 源: {source}): {e}")
+                    finish('failed')
+
+    def dispatch(futures):
+        for future in futures:
+            try:
+                write_queue.put(future.result())
+            except Exception as e:
+                logger.error(f"解析原始数据失败: {e}")
+                finish('failed')
+
+    threads = [threading.Thread(target=writer, name=f'rebuild-writer-{i}', daemon=True) for i in range(writers)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            pending = set()
+            for project_id, source, text, version in iter_rebuild_tasks(project_names, sources,
+                                                                         skip=checkpoint.is_done):
+                if text is None:
+                    # 没有数据：无需解析，直接交给写库线程清空关联表
+                    write_queue.put((project_id, source, [], version))
+                    continue
+                pending.add(pool.submit(normalize_payload, project_id, source, text, version))
+                # 限制在途任务数，原始数据和规范化结果不会在内存中堆积
+                if len(pending) >= workers * 2:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    dispatch(finished)
+            dispatch(wait(pending).done)
+    finally:
+        for _ in threads:
+            write_queue.put(None)
+        for thread in threads:
+            thread.join()
+        checkpoint.close()
+
+    stats['seconds'] = round(time.time() - started, 1)
+    return stats
@@ -0,0 +1,251 @@
+# 文件: rollup.py
+# 按 (项目, 电量生产年月, 交易年月, 平台) 汇总的统计表：关联表写入提交前在同一事务中重算受影响项目的汇总行，统计分析页面直接查询汇总表
+
+import calendar
+import logging
+import re
+import time
+from sqlalchemy import bindparam, event, text, update
+from sqlalchemy.orm import Session
+from .models import db, Project, SystemSetting
+from .change_events import pending_change
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+ROLLUP_TABLE = 'project_monthly_rollup'
+# system_settings 中记录汇总表状态的键：'building' 表示正在重建（写入时维护，查询仍走明细），'ready' 表示可以查询
+STATE_KEY = 'monthly_rollup_state'
+# 各进程缓存汇总表状态的秒数：状态变化后最多这么久各进程都会看到（rebuild-rollup 据此等待）
+STATE_TTL = 10
+
+
+def _number(column):
+    return f"CASE WHEN {column} IS NOT NULL AND {column} != '' THEN CAST({column} AS DECIMAL(15,2)) ELSE 0 END"
+
+
+def _amount(quantity_column, amount_sql, *columns):
+    valid = ' AND '.join(f"{col} IS NOT NULL AND {col} != ''" for col in (quantity_column,) + columns)
+    return f"CASE WHEN {valid} THEN {amount_sql} ELSE 0 END"
+
+
+# 平台 -> (关联表, 交易时间列, 附加条件, 成交量, 成交金额, 核发量, 绿电核发量, 已售量)
+# 条件与统计分析页面原有的明细查询一致：绿证平台按订单状态取成交记录，金额只计数量和金额都不为空的记录
+ROLLUP_SOURCES = {
+    'ledger': ("nyj_green_certificate_ledger", None, "", "0", "0",
+               _number('ordinary_quantity'), _number('green_quantity'), _number('sold_quantity')),
+    'nyj': ("nyj_transaction_records", "transaction_time", "", _number('transaction_num'), "0", "0", "0", "0"),
+    'unilateral': ("gzpt_unilateral_listings", "order_time_str", "AND order_status = '1'",
+                   _number('total_quantity'),
+                   _amount('total_quantity', "CAST(total_amount AS DECIMAL(15,2))", 'total_amount'), "0", "0", "0"),
+    'online': ("gzpt_bilateral_online_trades", "order_time_str", "AND order_status = '2'",
+               _number('total_quantity'),
+               _amount('total_quantity', "CAST(total_amount AS DECIMAL(15,2))", 'total_amount'), "0", "0", "0"),
+    'offline': ("gzpt_bilateral_offline_trades", "order_time_str", "AND order_status = '3'",
+                _number('total_quantity'),
+                _amount('total_quantity', "CAST(total_amount AS DECIMAL(15,2))", 'total_amount'), "0", "0", "0"),
+    'beijing': ("beijing_power_exchange_trades", "transaction_time", "",
+                _number('transaction_quantity'),
+                _amount('transaction_quantity',
+                        "CAST(transaction_quantity AS DECIMAL(15,2)) * CAST(transaction_price AS DECIMAL(15,2))",
+                        'transaction_price'), "0", "0", "0"),
+    'guangzhou': ("guangzhou_power_exchange_trades", "deal_time", "",
+                  "CASE WHEN gpc_certifi_num IS NOT NULL AND gpc_certifi_num != 0 "
+                  "THEN CAST(gpc_certifi_num AS DECIMAL(15,2)) ELSE 0 END",
+                  "CASE WHEN gpc_certifi_num IS NOT NULL AND gpc_certifi_num != 0 AND total_cost IS NOT NULL "
+                  "AND total_cost != 0 THEN CAST(total_cost AS DECIMAL(15,2)) ELSE 0 END", "0", "0", "0"),
+}
+
+# 交易平台（不含能源局核发平台）
+TRADE_PLATFORMS = ('unilateral', 'online', 'offline', 'beijing', 'guangzhou')
+
+_state = {'value': None, 'checked_at': 0.0}
+
+
+def _refresh_sql(platform):
+    table_name, time_column, condition, quantity, amount, issued, green, sold = ROLLUP_SOURCES[platform]
+    month = f"COALESCE(SUBSTRING({time_column}, 1, 7), '')" if time_column else "''"
+    return text(f"""
+        INSERT INTO {ROLLUP_TABLE}
+            (project_id, production_period, transaction_month, platform, quantity, amount, issued, green, sold)
+        SELECT project_id, COALESCE(production_period, 0), {month}, '{platform}',
+               SUM({quantity}), SUM({amount}), SUM({issued}), SUM({green}), SUM({sold})
+        FROM {table_name}
+        WHERE project_id = :project_id {condition}
+        GROUP BY project_id, COALESCE(production_period, 0), {month}
+    """)
+
+
+def platforms_for_tables(tables):
+    return [platform for platform, source in ROLLUP_SOURCES.items() if source[0] in tables]
+
+
+def refresh_project_rollup(project_id, platforms=None, session=None):
+    """在当前事务中按关联表重算项目的汇总行（platforms 为空时重算全部平台），不提交"""
+    session = session or db.session()
+    platforms = list(platforms or ROLLUP_SOURCES)
+    session.execute(
+        text(f"DELETE FROM {ROLLUP_TABLE} WHERE project_id = :project_id AND platform IN :platforms")
+        .bindparams(bindparam('platforms', expanding=True)),
+        {'project_id': project_id, 'platforms': platforms})
+    for platform in platforms:
+        session.execute(_refresh_sql(platform), {'project_id': project_id})
+
+
+def rollup_state(session=None):
+    """汇总表状态：None（未启用）、'building' 或 'ready'；缓存 STATE_TTL 秒，其他进程改为未就绪后也能及时看到"""
+    if time.monotonic() - _state['checked_at'] < STATE_TTL:
+        return _state['value']
+    session = session or db.session()
+    try:
+        value = session.query(SystemSetting.value).filter(SystemSetting.key == STATE_KEY).scalar()
+    except Exception as e:
+        logger.warning(f"读取汇总表状态失败: {e}")
+        value = None
+    _state['value'] = value if value in ('building', 'ready') else None
+    _state['checked_at'] = time.monotonic()
+    return _state['value']
+
+
+def rollup_ready():
+    return rollup_state() == 'ready'
+
+
+@event.listens_for(Session, 'before_commit')
+def _maintain_rollup(session):
+    """关联表有写入时，在提交前重算受影响项目的汇总行，与关联表的变化在同一事务中生效"""
+    change = pending_change(session)
+    if change is None:
+        return
+    platforms = platforms_for_tables(change.tables)
+    if not platforms or rollup_state(session) is None:
+        return
+    if change.project_ids is None:
+        # 无法只重算受影响的项目：在同一事务中把汇总表标记为未就绪，统计查询改走明细，直到重新执行 rebuild-rollup
+        session.execute(update(SystemSetting).where(SystemSetting.key == STATE_KEY).values(value='building'))
+        _state['value'], _state['checked_at'] = 'building', time.monotonic()
+        logger.warning("关联表变更未给出项目范围，汇总表已标记为未就绪，需执行 flask rebuild-rollup 重建")
+        return
+    for project_id in sorted(change.project_ids):
+        refresh_project_rollup(project_id, platforms, session=session)
+
+
+def _set_state(value):
+    setting = SystemSetting.query.filter_by(key=STATE_KEY).first()
+    if setting is None:
+        setting = SystemSetting(key=STATE_KEY, value=value, description='项目月度汇总表状态')
+        db.session.add(setting)
+    else:
+        setting.value = value
+    db.session.commit()
+    _state['value'], _state['checked_at'] = value, time.monotonic()
+
+
+def wait_for_processes():
+    """
+    等待各服务进程看到新的汇总表状态：它们缓存的状态最多 STATE_TTL 秒后过期。
+    汇总表未启用时进程不维护汇总行，重算开始前必须等它们都已按 'building' 在写入时维护，否则期间的写入会漏掉。
+    """
+    time.sleep(STATE_TTL)
+
+
+def rebuild_rollup(project_names=None, commit_every=50, wait=True):
+    """
+    由关联表重建汇总表，返回重建的项目数。
+    全部重建时先把状态置为 'building'，经 wait_for_processes 等待各服务进程开始维护后逐个项目重算，完成后置为 'ready'。
+    wait=False 跳过等待，只适用于没有其他进程在写入的场合（如服务已停止）。
+    """
+    full = not project_names
+    if full:
+        _set_state('building')
+        if wait:
+            wait_for_processes()
+    query = Project.query.with_entities(Project.id).order_by(Project.id)
+    if project_names:
+        query = query.filter(Project.project_name.in_(project_names))
+    project_ids = [project_id for (project_id,) in query.all()]
+    if full:
+        # 删除已不存在的项目留下的汇总行
+        db.session.execute(text(f"DELETE FROM {ROLLUP_TABLE} WHERE project_id NOT IN (SELECT id FROM projects)"))
+    for i, project_id in enumerate(project_ids, 1):
+        refresh_project_rollup(project_id)
+        if i % commit_every == 0:
+            db.session.commit()
+    db.session.commit()
+    if full:
+        _set_state('ready')
+    return len(project_ids)
+
+
+_MONTH_START = re.compile(r'^(\d{4})-(\d{2})(?:-01)?$')
+_MONTH_END = re.compile(r'^(\d{4})-(\d{2})(?:-(\d{2}))?$')
+
+
+def whole_months(start_date, end_date):
+    """
+    把交易日期筛选（'YYYY-MM-DD' 或 'YYYY-MM'，可为空）换算为汇总表的交易年月闭区间 (起, 止)，不筛选时返回 (None, None)。
+    起始日不是月初或截止日不是月末时汇总表无法精确回答，返回 None，由调用方查询明细。
+    """
+    start_date, end_date = (start_date or '').strip(), (end_date or '').strip()
+    if not start_date and not end_date:
+        return None, None
+    start_month, end_month = '0000-01', '9999-12'
+    if start_date:
+        match = _MONTH_START.match(start_date)
+        if not match:
+            return None
+        start_month = f"{match.group(1)}-{match.group(2)}"
+    if end_date:
+        match = _MONTH_END.match(end_date)
+        if not match:
+            return None
+        year, month = int(match.group(1)), int(match.group(2))
+        if not 1 <= month <= 12:
+            return None
+        if match.group(3) and int(match.group(3)) != calendar.monthrange(year, month)[1]:
+            return None
+        end_month = f"{match.group(1)}-{match.group(2)}"
+    return start_month, end_month
+
+
+def query_rollup(connection, project_ids, group_by, platforms, production_range=(0, 999912), transaction_range=None):
+    """
+    按 group_by 中的列和平台汇总，返回 {(分组值...): {平台: {'quantity', 'amount', 'issued', 'green', 'sold'}}}。
+    transaction_range 为交易年月闭区间，只作用于有交易时间的平台（台账行不受影响）。
+    """
+    conditions = ["project_id IN :project_ids", "platform IN :platforms",
+                  "production_period BETWEEN :start_period AND :end_period"]
+    params = {'project_ids': list(project_ids), 'platforms': list(platforms),
+              'start_period': production_range[0], 'end_period': production_range[1]}
+    if transaction_range and transaction_range != (None, None):
+        conditions.append("(platform = 'ledger' OR transaction_month BETWEEN :start_month AND :end_month)")
+        params['start_month'], params['end_month'] = transaction_range
+    columns = ', '.join(group_by)
+    sql = text(f"""
+        SELECT {columns}, platform, SUM(quantity), SUM(amount), SUM(issued), SUM(green), SUM(sold)
+        FROM {ROLLUP_TABLE}
+        WHERE {' AND '.join(conditions)}
+        GROUP BY {columns}, platform
+    """).bindparams(bindparam('project_ids', expanding=True), bindparam('platforms', expanding=True))
+    result = {}
+    width = len(group_by)
+    for row in connection.execute(sql, params):
+        totals = dict(zip(('quantity', 'amount', 'issued', 'green', 'sold'), (float(v or 0) for v in row[width + 1:])))
+        result.setdefault(tuple(row[:width]), {})[row[width]] = totals
+    return result
+
+
+def platform_fields(totals, platforms=TRADE_PLATFORMS):
+    """统计分析接口的各平台字段：{平台}_qty、{平台}_amt 和保留两位小数的均价 {平台}_avg"""
+    fields = {}
+    for platform in platforms:
+        values = totals.get(platform, {})
+        quantity, amount = values.get('quantity', 0.0), values.get('amount', 0.0)
+        fields[f'{platform}_qty'] = quantity
+        fields[f'{platform}_amt'] = amount
+        fields[f'{platform}_avg'] = round(amount / quantity, 2) if quantity > 0 else 0
+    return fields
+
+
+def format_period(period):
+    return f"{period // 100}-{period % 100:02d}"
@@ -1,21 +1,58 @@
 # 文件: api_routes.py
 # 包含所有API路由，使用蓝图，包括GUI客户端登录、数据提交和外部API
 
-from flask import Blueprint, jsonify, request, current_app, send_from_directory
+from flask import Blueprint, Response, jsonify, request, current_app, url_for
 from flask_login import current_user
 from ..models import db, User, Project
-import json
-import os
+import hashlib
 import logging
-from datetime import datetime
 from config import API_ACCESS_TOKEN
-from ..data_processors import update_derived_tables
+from ..ingestion import (ingestion_queue, ingestion_metrics, apply_submission, apply_batch, IngestionBusy,
+                         SOURCE_TO_COLUMN_MAP)
+from ..write_locks import LockTimeout
+from ..cursors import DeltaMergeError, check_delta
+from ..archive import submission_archive
+from ..module_registry import module_registry
+from .. import bootstrap_cache
+from ..gui_tokens import TOKEN_HEADER, gui_auth, issue_token, read_token, unit_allowed, unit_usage
+from ..compression import compress_response
+from ..timing import start_timer, stop_timer, current_timer, stage
 
 # 创建日志记录器
 logger = logging.getLogger(__name__)
 
 api = Blueprint('api', __name__, url_prefix='/api')
 
+
+@api.after_request
+def compress_api_response(response):
+    """按客户端的 Accept-Encoding 压缩JSON响应（项目列表、登录、状态查询等）"""
+    return compress_response(response, min_size=current_app.config.get('API_COMPRESS_MIN_BYTES', 1024),
+                             level=current_app.config.get('API_COMPRESS_LEVEL', 6))
+
+
+@api.after_request
+def add_server_timing(response):
+    """提交接口在响应头 Server-Timing 中给出本次请求各阶段的耗时"""
+    timer = current_timer()
+    if timer is not None:
+        response.headers['Server-Timing'] = timer.server_timing()
+    return response
+
+
+@api.teardown_request
+def clear_timer(exc):
+    stop_timer()
+
+
+def _busy_response(e):
+    """写库繁忙时返回 429，并在 Retry-After 中给出建议的重试秒数"""
+    response = jsonify({'success': False, 'message': str(e), 'retry_after': e.retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+
 # --- 新增的外部API接口 ---
 @api.route('/projects', methods=['GET'])
 def get_projects_api():
@@ -39,43 +76,64 @@ def get_projects_api():
 def get_secondary_units():
     """获取所有二级单位的列表用于登录下拉框"""
     try:
-        units = db.session.query(User.username).filter(User.username != 'admin').distinct().order_by(
-            User.username).all()
-        unit_list = [u[0] for u in units]
-        return jsonify({'units': unit_list})
+        return jsonify({'units': bootstrap_cache.get_secondary_units()})
     except Exception as e:
         logger.error(f"Failed to fetch units: {e}")
         return jsonify({'error': 'Failed to fetch units', 'details': str(e)}), 500
 
 @api.route('/login', methods=['POST'])
 def api_login():
-    """处理GUI的登录请求"""
+    """
+    处理GUI的登录请求，成功后签发登录令牌，之后的请求在 X-GUI-Token 头中携带。
+    已持有同一单位有效令牌的客户端可省略密码，直接续期，避免重复计算密码哈希；
+    续期的令牌沿用最初登录的时间，总寿命超过 GUI_TOKEN_MAX_LIFETIME 后必须重新输入密码。
+    """
     data = request.get_json()
-    if not data or 'username' not in data or 'password' not in data:
+    if not data or 'username' not in data:
         return jsonify({'success': False, 'message': '请求缺少用户名或密码'}), 400
 
     username = data['username']
-    password = data['password']
-
     user = User.query.filter_by(username=username).first()
-    if user and user.check_password(password):
-        projects = Project.query.filter_by(secondary_unit=username).with_entities(Project.project_name).order_by(
-            Project.project_name).all()
-        project_list = [p.project_name for p in projects]
-        return jsonify({'success': True, 'message': '登录成功', 'projects': project_list})
+    token = request.headers.get(TOKEN_HEADER)
+    current = read_token(token) if token else None
+    if current and current[0] == username:
+        # 续期也要确认账户仍然存在，已删除的单位不能凭旧令牌继续访问
+        if not user:
+            return jsonify({'success': False, 'message': '账户不存在，请重新登录', 'token_expired': True}), 401
+        issued_at = current[1]
+        unit_usage.record(username, request.endpoint)
     else:
-        return jsonify({'success': False, 'message': '无效的用户名或密码'}), 401
+        if 'password' not in data:
+            return jsonify({'success': False, 'message': '请求缺少用户名或密码'}), 400
+        if not user or not user.check_password(data['password']):
+            return jsonify({'success': False, 'message': '无效的用户名或密码'}), 401
+        issued_at = None
+
+    token, expires_in = issue_token(username, issued_at)
+    return jsonify({'success': True, 'message': '登录成功', 'token': token, 'expires_in': expires_in,
+                    'projects': bootstrap_cache.get_unit_project_names(username)})
 
 @api.route('/submit_data', methods=['POST'])
+@gui_auth
 def api_submit_data():
-    """【已重构】接收GUI提交的数据，更新主表、时间戳和关联表"""
-    data = request.get_json()
+    """
+    【已重构】接收GUI提交的数据，校验后放入后台队列更新主表、时间戳和关联表，立即返回任务ID。
+    mode 为 'delta' 时 data 只需包含 /api/status 返回的游标之后的记录（结构与完整数据相同），
+    服务器按自然键合并进已存数据，关联表只写入这些记录；省略时为 'full'，即完整数据。
+    """
+    timer = start_timer('request')
+    with stage('parse'):
+        data = request.get_json()
     if not data or 'project_name' not in data or 'source' not in data or 'data' not in data:
         return jsonify({'success': False, 'message': '无效的数据负载'}), 400
 
     project_name = data['project_name']
     source = data['source']
     scraped_data = data['data']
+    mode = data.get('mode', 'full')
+    if mode not in ('full', 'delta'):
+        return jsonify({'success': False, 'message': f'未知的提交模式: "{mode}"'}), 400
+    delta = mode == 'delta'
     
     # 打印接收到的数据结构，用于调试
     print(f"接收到数据源: {source}, 项目: {project_name}")
@@ -88,88 +146,235 @@ def api_submit_data():
         print(f"数据类型: {type(scraped_data)}")
 
 
-    # 1. 保存到本地文件 (可选，但保留)
-    try:
-        safe_project_name = "".join(c for c in project_name if c.isalnum() or c in ('_', '-')).rstrip()
-        safe_source = "".join(c for c in source if c.isalnum() or c in ('_', '-')).rstrip()
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"apidata_{safe_project_name}_{safe_source}_{timestamp}.txt"
-
-        data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "received_data")
-        if not os.path.exists(data_dir):
-            os.makedirs(data_dir)
-
-        filepath = os.path.join(data_dir, filename)
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(scraped_data, f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        logger.error(f"保存文件失败，项目: {project_name}: {e}")
+    # 1. 归档原始数据（序列化后交给后台线程压缩写入，不等待磁盘）
+    with stage('archive'):
+        submission_archive.append(project_name, source, scraped_data, mode if delta else None)
+
+    # 2. 校验项目和数据源，然后交给后台队列写库
+    if source not in SOURCE_TO_COLUMN_MAP:
+        return jsonify({'success': False, 'message': f'未知的数据源: "{source}"'}), 400
+    if delta:
+        try:
+            check_delta(source, scraped_data)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
 
-    # 2. 在一个事务中完成数据库所有操作
     try:
-        project = Project.query.filter_by(project_name=project_name).first()
+        with stage('lookup'):
+            project = Project.query.filter_by(project_name=project_name) \
+                .with_entities(Project.id, Project.secondary_unit).first()
         if not project:
             return jsonify({'success': False, 'message': f'项目 "{project_name}" 在数据库中未找到'}), 404
+        if not unit_allowed(project.secondary_unit):
+            return jsonify({'success': False, 'message': f'无权提交项目 "{project_name}" 的数据'}), 403
+
+        if not current_app.config.get('INGEST_ASYNC', True):
+            with ingestion_queue.sync_slot():
+                result = apply_submission(Project.query.get(project.id), source, scraped_data, delta=delta)
+            ingestion_metrics.record_timings(timer, source, sum(result.row_counts.values()))
+            if result.unchanged:
+                return jsonify({'success': True, 'message': '数据与上次提交相同，仅更新了时间戳',
+                                'unchanged': True, 'row_counts': {}})
+            return jsonify({'success': True, 'message': '数据已成功提交并保存到所有相关表',
+                            'unchanged': False, 'row_counts': result.row_counts})
+
+        with stage('enqueue'):
+            job = ingestion_queue.submit(project.id, project_name, source, scraped_data, delta=delta)
+        ingestion_metrics.record_timings(timer)
+        return jsonify({'success': True, 'message': '数据已接收，正在后台处理',
+                        'job_id': job.id, 'status': job.status, 'mode': mode}), 202
+
+    except DeltaMergeError as e:
+        logger.warning(f"增量数据无法合并，项目: {project_name}: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except (IngestionBusy, LockTimeout) as e:
+        logger.warning(f"提交被拒绝，项目: {project_name}: {e}")
+        return _busy_response(e)
+    except Exception as e:
+        logger.error(f"数据库保存失败，项目: {project_name}: {e}")
+        return jsonify({'success': False, 'message': f'数据库错误，操作已回滚: {str(e)}'}), 500
 
-        data_json_str = json.dumps(scraped_data, ensure_ascii=False)
-        current_time = datetime.now()
-
-        source_to_column_map = {
-            "能源局网站": ("data_nyj", "data_nyj_updated_at"),
-            "绿证交易平台": ("data_lzy", "data_lzy_updated_at"),
-            "北京电力交易中心": ("data_bjdl", "data_bjdl_updated_at"),
-            "广州电力交易中心": ("data_gjdl", "data_gjdl_updated_at")
-        }
-
-        column_info = source_to_column_map.get(source)
-        if not column_info:
-            return jsonify({'success': False, 'message': f'未知的数据源: "{source}"'}), 400
-
-        data_col, time_col = column_info
 
-        setattr(project, data_col, data_json_str)
-        setattr(project, time_col, current_time)
+@api.route('/submit_batch', methods=['POST'])
+@gui_auth
+def api_submit_batch():
+    """
+    一次提交多个项目、多个数据源的数据。
+    请求体: {"entries": [{"project_name": ..., "source": ..., "data": ...}, ...]}
+    所有项目在一次查询中解析，按 INGEST_BATCH_COMMIT_SIZE 分批提交；响应中按顺序给出每个条目的结果。
+    """
+    timer = start_timer('batch')
+    with stage('parse'):
+        payload = request.get_json()
+    entries = payload.get('entries') if isinstance(payload, dict) else None
+    if not isinstance(entries, list) or not entries:
+        return jsonify({'success': False, 'message': '无效的数据负载，缺少 entries 列表'}), 400
 
-        update_derived_tables(project.id, source)
+    max_entries = current_app.config.get('SUBMIT_BATCH_MAX_ENTRIES', 1000)
+    if len(entries) > max_entries:
+        return jsonify({'success': False, 'message': f'单次最多提交 {max_entries} 个条目'}), 413
 
-        db.session.commit()
+    logger.info(f"接收到批量提交: {len(entries)} 个条目")
 
-        return jsonify({'success': True, 'message': '数据已成功提交并保存到所有相关表'})
+    results = [None] * len(entries)
+    names = {e.get('project_name') for e in entries if isinstance(e, dict) and e.get('project_name')}
 
+    try:
+        with stage('lookup'):
+            projects = {p.project_name: p for p in Project.query.filter(Project.project_name.in_(names)).all()} \
+                if names else {}
+
+        # 校验条目；同一项目和数据源出现多次时只处理最后一条
+        latest = {}
+        for index, entry in enumerate(entries):
+            if not isinstance(entry, dict) or not entry.get('project_name') or not entry.get('source') \
+                    or 'data' not in entry:
+                results[index] = {'success': False, 'message': '缺少必要参数: project_name, source, data'}
+                continue
+            project_name, source = entry['project_name'], entry['source']
+            if source not in SOURCE_TO_COLUMN_MAP:
+                results[index] = {'success': False, 'message': f'未知的数据源: "{source}"'}
+                continue
+            if project_name not in projects:
+                results[index] = {'success': False, 'message': f'项目 "{project_name}" 在数据库中未找到'}
+                continue
+            if not unit_allowed(projects[project_name].secondary_unit):
+                results[index] = {'success': False, 'message': f'无权提交项目 "{project_name}" 的数据'}
+                continue
+            previous = latest.get((project_name, source))
+            if previous is not None:
+                results[previous] = {'success': True, 'message': '已被同一请求中较新的条目覆盖'}
+            latest[(project_name, source)] = index
+
+        # 归档原始数据（序列化后交给后台线程压缩写入，不等待磁盘）
+        with stage('archive'):
+            for index in latest.values():
+                entry = entries[index]
+                submission_archive.append(entry['project_name'], entry['source'], entry['data'])
+
+        indexes = sorted(latest.values())
+        items = [(projects[entries[i]['project_name']], entries[i]['source'], entries[i]['data']) for i in indexes]
+        batch_size = current_app.config.get('INGEST_BATCH_COMMIT_SIZE', 50)
+        with ingestion_queue.sync_slot():
+            batch_results = apply_batch(items, batch_size)
+        for index, result in zip(indexes, batch_results):
+            results[index] = result
+        ingestion_metrics.record_timings(timer, 'submit_batch', sum(
+            sum(r.get('row_counts', {}).values()) for r in results if r and r.get('success')))
+
+    except IngestionBusy as e:
+        logger.warning(f"批量提交被拒绝: {e}")
+        return _busy_response(e)
     except Exception as e:
         db.session.rollback()
-        logger.error(f"数据库保存失败，项目: {project_name}: {e}")
+        logger.error(f"批量提交失败: {e}")
         return jsonify({'success': False, 'message': f'数据库错误，操作已回滚: {str(e)}'}), 500
 
+    for entry, result in zip(entries, results):
+        if isinstance(entry, dict):
+            result.setdefault('project_name', entry.get('project_name'))
+            result.setdefault('source', entry.get('source'))
+
+    succeeded = sum(1 for r in results if r['success'])
+    return jsonify({'success': succeeded == len(results),
+                    'message': f'共 {len(results)} 个条目，成功 {succeeded} 个，失败 {len(results) - succeeded} 个',
+                    'results': results})
+
+
+@api.route('/jobs/<string:job_id>', methods=['GET'])
+def get_ingestion_job(job_id):
+    """查询后台提交任务的状态、行数和耗时"""
+    job = ingestion_queue.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': '任务不存在或已过期'}), 404
+    return jsonify(job.to_dict())
+
+
+@api.route('/ingest_metrics', methods=['GET'])
+def get_ingest_metrics():
+    """查询本进程的提交统计，包括内容未变而跳过写库的次数和数据量"""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({'error': 'Authorization header is missing or invalid. Expected format: Bearer <token>'}), 401
+    if auth_header.split(' ')[1] != API_ACCESS_TOKEN:
+        return jsonify({'error': 'Invalid or expired token.'}), 403
+
+    metrics = ingestion_metrics.to_dict()
+    metrics['jobs'] = ingestion_queue.stats()
+    metrics['units'] = unit_usage.to_dict()
+    return jsonify(metrics)
+
+
+def _module_response(module):
+    """
+    返回模块文件：带强ETag和Cache-Control，If-None-Match 命中时返回304；客户端支持时直接发送预压缩版本。
+    URL 中带当前版本号 (?v=) 时内容不会再变，可长期缓存。
+    """
+    encoding = 'gzip' if module.gzip_data is not None and request.accept_encodings['gzip'] else None
+    response = Response(module.gzip_data if encoding else module.data, mimetype='text/plain')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(module.etag(encoding))
+    if request.args.get('v') == module.version:
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        max_age = current_app.config.get('MODULE_CACHE_MAX_AGE', 0)
+        response.headers['Cache-Control'] = f'public, max-age={max_age}' if max_age else 'no-cache'
+    response.headers['Content-Disposition'] = f'attachment; filename={module.filename}'
+    response.headers['X-Module-Version'] = module.version
+    return response.make_conditional(request)
+
+
+@api.route('/modules', methods=['GET'])
+@gui_auth
+def get_module_manifest():
+    """模块版本清单：启动器比较 sha256 后只下载有变化的模块"""
+    manifest = module_registry.manifest()
+    for name, entry in manifest.items():
+        entry['url'] = url_for('api.get_named_module', name=name, v=entry['version'])
+    response = jsonify({'modules': manifest})
+    response.set_etag(hashlib.sha256(
+        ','.join(f"{name}:{entry['sha256']}" for name, entry in sorted(manifest.items())).encode()).hexdigest())
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
+@api.route('/modules/<string:name>', methods=['GET'])
+@gui_auth
+def get_named_module(name):
+    """按名称下载模块文件"""
+    module = module_registry.get(name)
+    if module is None:
+        return jsonify({"success": False, "message": f"服务器上未找到模块 {name}。"}), 404
+    return _module_response(module)
+
 
 @api.route('/get_module', methods=['GET'])
+@gui_auth
 def get_module():
     """
     核心功能：提供 m1.py 模块文件给启动器下载。
     Core Function: Serves the m1.py module file for the launcher to download.
+    带 If-None-Match 的请求在模块未变化时返回304，不再重复传输文件。
     """
-    module_directory = os.path.dirname(os.path.abspath(__file__))
-    module_filename = "m1.py"
-    print(f"请求获取模块文件: {os.path.join(module_directory, module_filename)}")
-    
-    try:
-        # 使用 send_from_directory 可以安全地发送文件
-        # Using send_from_directory is a secure way to send files
-        return send_from_directory(directory=module_directory, path=module_filename, as_attachment=True, mimetype='text/plain')
-        
-    except FileNotFoundError:
-        print(f"错误: 在目录 {module_directory} 中未找到模块文件 {module_filename}")
+    module = module_registry.get(request.args.get('name', 'm1'))
+    if module is None:
         return jsonify({"success": False, "message": "服务器上未找到模块文件。"}), 404
+    return _module_response(module)
 
 
 # --- 添加兼容旧版GUI客户端的路由 ---
 @api.route('/submit', methods=['POST'])
+@gui_auth
 def api_submit_compat():
     """兼容旧版GUI客户端的路由，重定向到submit_data"""
     print("收到 /api/submit 请求，重定向到 /api/submit_data")
     
     # 获取请求数据
-    request_data = request.json
+    timer = start_timer('request')
+    with stage('parse'):
+        request_data = request.json
     if not request_data:
         return jsonify({'success': False, 'message': '请求数据为空'}), 400
         
@@ -182,52 +387,34 @@ def api_submit_compat():
     
     print(f"处理项目: {project_name}, 数据源: {source}")
     
-    # 1. 保存原始数据到文件
-    try:
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"{project_name}_{source}_{timestamp}.json"
-        data_dir = os.path.join(current_app.config['DATA_DIR'], 'raw_data')
-        
-        if not os.path.exists(data_dir):
-            os.makedirs(data_dir)
-
-        filepath = os.path.join(data_dir, filename)
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(scraped_data, f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        logger.error(f"保存文件失败，项目: {project_name}: {e}")
+    # 1. 归档原始数据（序列化后交给后台线程压缩写入，不等待磁盘）
+    with stage('archive'):
+        submission_archive.append(project_name, source, scraped_data)
 
     # 2. 在一个事务中完成数据库所有操作
     try:
-        project = Project.query.filter_by(project_name=project_name).first()
+        with stage('lookup'):
+            project = Project.query.filter_by(project_name=project_name).first()
         if not project:
             return jsonify({'success': False, 'message': f'项目 "{project_name}" 在数据库中未找到'}), 404
+        if not unit_allowed(project.secondary_unit):
+            return jsonify({'success': False, 'message': f'无权提交项目 "{project_name}" 的数据'}), 403
 
-        data_json_str = json.dumps(scraped_data, ensure_ascii=False)
-        current_time = datetime.now()
-
-        source_to_column_map = {
-            "能源局网站": ("data_nyj", "data_nyj_updated_at"),
-            "绿证交易平台": ("data_lzy", "data_lzy_updated_at"),
-            "北京电力交易中心": ("data_bjdl", "data_bjdl_updated_at"),
-            "广州电力交易中心": ("data_gjdl", "data_gjdl_updated_at")
-        }
-
-        column_info = source_to_column_map.get(source)
-        if not column_info:
+        if source not in SOURCE_TO_COLUMN_MAP:
             return jsonify({'success': False, 'message': f'未知的数据源: "{source}"'}), 400
 
-        data_col, time_col = column_info
-
-        setattr(project, data_col, data_json_str)
-        setattr(project, time_col, current_time)
-
-        update_derived_tables(project.id, source)
-
-        db.session.commit()
+        with ingestion_queue.sync_slot():
+            result = apply_submission(project, source, scraped_data)
+        ingestion_metrics.record_timings(timer, source, sum(result.row_counts.values()))
+        if result.unchanged:
+            return jsonify({'success': True, 'message': '数据与上次提交相同，仅更新了时间戳', 'unchanged': True})
 
-        return jsonify({'success': True, 'message': '数据已成功提交并保存到所有相关表'})
+        return jsonify({'success': True, 'message': '数据已成功提交并保存到所有相关表', 'unchanged': False})
 
+    except (IngestionBusy, LockTimeout) as e:
+        db.session.rollback()
+        logger.warning(f"提交被拒绝，项目: {project_name}: {e}")
+        return _busy_response(e)
     except Exception as e:
         db.session.rollback()
         logger.error(f"数据库保存失败，项目: {project_name}: {e}")
@@ -235,25 +422,16 @@ def api_submit_compat():
 
 # --- 【新增】供GUI查询项目状态的API ---
 @api.route('/status/<string:secondary_unit>', methods=['GET'])
+@gui_auth
 def get_projects_by_unit(secondary_unit):
-    """根据二级单位名称，查询其所有项目的列表和各数据源的最后更新时间"""
+    """
+    根据二级单位名称，查询其所有项目的列表和各数据源的最后更新时间。
+    cursors 给出每个关联表已入库记录的游标字段最大值和条数，客户端据此只提交之后的记录（mode=delta）。
+    """
+    if not unit_allowed(secondary_unit):
+        return jsonify({'error': '无权查询其它单位的项目状态'}), 403
     try:
-        projects = Project.query.filter_by(secondary_unit=secondary_unit).order_by(Project.project_name).all()
-
-        if not projects:
-            return jsonify([])
-
-        result = []
-        for p in projects:
-            result.append({
-                'project_name': p.project_name,
-                'data_nyj_updated_at': p.data_nyj_updated_at.isoformat() if p.data_nyj_updated_at else None,
-                'data_lzy_updated_at': p.data_lzy_updated_at.isoformat() if p.data_lzy_updated_at else None,
-                'data_bjdl_updated_at': p.data_bjdl_updated_at.isoformat() if p.data_bjdl_updated_at else None,
-                'data_gjdl_updated_at': p.data_gjdl_updated_at.isoformat() if p.data_gjdl_updated_at else None,
-            })
-
-        return jsonify(result)
+        return jsonify(bootstrap_cache.get_unit_status(secondary_unit))
 
     except Exception as e:
         logger.error(f"查询项目状态失败，单位: {secondary_unit}: {e}")
@@ -1,7 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, jsonify
 from flask_login import login_required, current_user
 from ..models import db, Project, User, FAQ
-from sqlalchemy import text, func, desc, or_, and_
+from sqlalchemy import bindparam, text, func, desc, or_, and_
 from decimal import Decimal
 import calendar
 import io
@@ -11,9 +11,13 @@ import numpy as np
 import json
 import requests
 from datetime import datetime, timedelta
-from ..utils import generate_random_password, update_pwd_excel, project_to_dict, populate_project_from_form
+from ..utils import generate_random_password, update_pwd_excel, project_to_dict, populate_project_from_form, \
+    to_production_period, period_range
 from config import TABLE_HEADER_ORDERS
-from ..dashboard_cache import get_cached_data, calculate_dashboard_data, get_cache_info
+from ..dashboard_cache import get_dashboard_data, force_refresh_cache, get_cache_info
+from ..customer_volumes import customer_totals
+from ..rollup import (ROLLUP_TABLE, TRADE_PLATFORMS, format_period, platform_fields, query_rollup, rollup_ready,
+                      whole_months)
 
 dashboard_bp = Blueprint('dashboard', __name__, url_prefix='/dashboard')
 
@@ -105,12 +109,8 @@ def fetch_green_cert_price_from_api():
 def overview():
     """渲染数据概览仪表盘主页，使用缓存的预计算数据"""
     
-    # 尝试从缓存获取数据
-    cached_data = get_cached_data()
-    
-    # 如果缓存无效，则计算新数据
-    if cached_data is None:
-        cached_data = calculate_dashboard_data()
+    # 缓存过期时先返回上一份快照并在后台刷新，过期太久或尚无快照时才等待计算
+    cached_data, _ = get_dashboard_data()
     
     # 如果仍然没有数据，返回默认值
     if cached_data is None:
@@ -152,7 +152,6 @@ def refresh_cache():
     """手动刷新dashboard缓存的API接口"""
     try:
         # 强制刷新缓存
-        from dashboard_cache import force_refresh_cache
         new_data = force_refresh_cache()
         
         if new_data:
@@ -190,6 +189,20 @@ def cache_status():
         }), 500
 
 
+@dashboard_bp.route('/api/ingest-metrics')
+@login_required
+def ingest_metrics():
+    """管理员查看数据提交的统计：各阶段耗时分位数、各数据源每秒处理记录数、后台任务状态和各单位的请求数"""
+    if not current_user.is_admin:
+        return jsonify({'error': '只有管理员可以查看提交统计！'}), 403
+    from ..ingestion import ingestion_metrics, ingestion_queue
+    from ..gui_tokens import unit_usage
+    metrics = ingestion_metrics.to_dict()
+    metrics['jobs'] = ingestion_queue.stats()
+    metrics['units'] = unit_usage.to_dict()
+    return jsonify(metrics)
+
+
 @dashboard_bp.route('/projects')
 @login_required
 def projects():
@@ -917,6 +930,69 @@ def get_password(username):
         return jsonify({'error': str(e)}), 500
 
 
+# statistics 页面交易平台售出量包含的平台（不含双边线上）
+STATISTICS_TRADE_PLATFORMS = ('unilateral', 'offline', 'beijing', 'guangzhou')
+
+def _statistics_rows_from_rollup(connection, group_by_clause, sql_params, months):
+    """statistics 的汇总表版本：按维度合计核发量、核发平台售出量和交易平台售出量、金额"""
+    trade_platforms = ', '.join(f"'{platform}'" for platform in STATISTICS_TRADE_PLATFORMS)
+    params = dict(sql_params)
+    transaction_filter = ''
+    if months != (None, None):
+        transaction_filter = "AND (r.platform = 'ledger' OR r.transaction_month BETWEEN :start_month AND :end_month)"
+        params['start_month'], params['end_month'] = months
+    sql = text(f"""
+        WITH
+        RollupSums AS (
+            SELECT
+                {group_by_clause} as dimension_value,
+                SUM(CASE WHEN r.platform = 'ledger' THEN r.issued ELSE 0 END) as ordinary_total,
+                SUM(CASE WHEN r.platform = 'nyj' THEN r.quantity ELSE 0 END) as issued_platform_sold,
+                SUM(CASE WHEN r.platform IN ({trade_platforms}) THEN r.quantity ELSE 0 END) as trading_platform_sold,
+                SUM(CASE WHEN r.platform IN ({trade_platforms}) THEN r.amount ELSE 0 END) as trading_platform_amount
+            FROM projects p
+            JOIN {ROLLUP_TABLE} r ON p.id = r.project_id
+            WHERE p.id IN :project_ids
+              AND r.platform IN ('ledger', 'nyj', {trade_platforms})
+              AND r.production_period BETWEEN :start_period AND :end_period
+              {transaction_filter}
+              AND {group_by_clause} IS NOT NULL
+            GROUP BY {group_by_clause}
+        ),
+        CapacityData AS (
+            SELECT
+                {group_by_clause} as dimension_value,
+                COALESCE(SUM(CAST(p.capacity_mw AS DECIMAL(15,2))), 0) as total_capacity
+            FROM projects p
+            WHERE p.id IN :project_ids
+              AND {group_by_clause} IS NOT NULL
+            GROUP BY {group_by_clause}
+        ),
+        AllDimensions AS (
+            SELECT dimension_value FROM RollupSums
+            UNION
+            SELECT dimension_value FROM CapacityData
+        )
+        SELECT
+            d.dimension_value,
+            COALESCE(rs.ordinary_total, 0) as ordinary_total,
+            COALESCE(rs.issued_platform_sold, 0) as issued_platform_sold,
+            COALESCE(rs.trading_platform_sold, 0) as trading_platform_sold,
+            CASE
+                WHEN COALESCE(rs.trading_platform_sold, 0) > 0
+                THEN COALESCE(rs.trading_platform_amount, 0) / rs.trading_platform_sold
+                ELSE 0
+            END as avg_price,
+            COALESCE(cd.total_capacity, 0) as total_capacity,
+            COALESCE(rs.trading_platform_amount, 0) as trading_platform_amount
+        FROM AllDimensions d
+        LEFT JOIN RollupSums rs ON d.dimension_value = rs.dimension_value
+        LEFT JOIN CapacityData cd ON d.dimension_value = cd.dimension_value
+        ORDER BY ordinary_total DESC
+    """).bindparams(bindparam('project_ids', expanding=True))
+    return connection.execute(sql, params).fetchall()
+
+
 @dashboard_bp.route('/statistics')
 @login_required
 def statistics():
@@ -1075,8 +1151,7 @@ def statistics():
                 FROM projects p
                 JOIN nyj_green_certificate_ledger n ON p.id = n.project_id
                 WHERE p.id IN :project_ids
-                  AND n.production_year_month >= :start_month
-                  AND n.production_year_month <= :end_month
+                  AND n.production_period BETWEEN :start_period AND :end_period
                   AND {group_by_clause} IS NOT NULL
                 GROUP BY {group_by_clause}
             ),
@@ -1089,8 +1164,7 @@ def statistics():
                 FROM projects p
                 JOIN nyj_transaction_records tr ON p.id = tr.project_id
                 WHERE p.id IN :project_ids
-                  AND CONCAT(tr.production_year, '-', LPAD(tr.production_month, 2, '0')) >= :start_month
-                  AND CONCAT(tr.production_year, '-', LPAD(tr.production_month, 2, '0')) <= :end_month
+                  AND tr.production_period BETWEEN :start_period AND :end_period
                   {transaction_filter_clauses['tr']}
                   AND {group_by_clause} IS NOT NULL
                 GROUP BY {group_by_clause}
@@ -1105,19 +1179,19 @@ def statistics():
                 FROM (
                     SELECT p.id, {group_by_clause} as dimension_value, CAST(ul.total_quantity AS DECIMAL(15,2)) as qty, CAST(ul.total_amount AS DECIMAL(15,2)) as amt
                     FROM projects p JOIN gzpt_unilateral_listings ul ON p.id = ul.project_id
-                    WHERE p.id IN :project_ids AND ul.order_status = '1' AND ul.generate_ym >= :start_month AND ul.generate_ym <= :end_month {transaction_filter_clauses['ul']}
+                    WHERE p.id IN :project_ids AND ul.order_status = '1' AND ul.production_period BETWEEN :start_period AND :end_period {transaction_filter_clauses['ul']}
                     UNION ALL
                     SELECT p.id, {group_by_clause} as dimension_value, CAST(off.total_quantity AS DECIMAL(15,2)), CAST(off.total_amount AS DECIMAL(15,2))
                     FROM projects p JOIN gzpt_bilateral_offline_trades off ON p.id = off.project_id
-                    WHERE p.id IN :project_ids AND off.order_status = '3' AND off.generate_ym >= :start_month AND off.generate_ym <= :end_month {transaction_filter_clauses['off']}
+                    WHERE p.id IN :project_ids AND off.order_status = '3' AND off.production_period BETWEEN :start_period AND :end_period {transaction_filter_clauses['off']}
                     UNION ALL
                     SELECT p.id, {group_by_clause} as dimension_value, CAST(bj.transaction_quantity AS DECIMAL(15,2)), CAST(bj.transaction_quantity AS DECIMAL(15,2)) * CAST(bj.transaction_price AS DECIMAL(15,2))
                     FROM projects p JOIN beijing_power_exchange_trades bj ON p.id = bj.project_id
-                    WHERE p.id IN :project_ids AND bj.production_year_month >= :start_month AND bj.production_year_month <= :end_month {transaction_filter_clauses['bj']}
+                    WHERE p.id IN :project_ids AND bj.production_period BETWEEN :start_period AND :end_period {transaction_filter_clauses['bj']}
                     UNION ALL
                     SELECT p.id, {group_by_clause} as dimension_value, CAST(gz.gpc_certifi_num AS DECIMAL(15,2)), CAST(gz.total_cost AS DECIMAL(15,2))
                     FROM projects p JOIN guangzhou_power_exchange_trades gz ON p.id = gz.project_id
-                    WHERE p.id IN :project_ids AND CONCAT(SUBSTRING(gz.product_date, 1, 4), '-', LPAD(SUBSTRING(gz.product_date, 6), 2, '0')) >= :start_month AND CONCAT(SUBSTRING(gz.product_date, 1, 4), '-', LPAD(SUBSTRING(gz.product_date, 6), 2, '0')) <= :end_month {transaction_filter_clauses['gz']}
+                    WHERE p.id IN :project_ids AND gz.production_period BETWEEN :start_period AND :end_period {transaction_filter_clauses['gz']}
                 ) as all_trades
                 WHERE dimension_value IS NOT NULL
                 GROUP BY dimension_value
@@ -1166,16 +1240,22 @@ def statistics():
             ORDER BY ordinary_total DESC
         """)
         
-        # 构建SQL查询参数（始终绑定）
+        # 构建SQL查询参数（始终绑定），生产期按 production_period 索引做范围筛选
+        start_period, end_period = period_range(start_month, end_month)
         sql_params = {
             'project_ids': tuple(project_ids_list),
-            'start_month': start_month,
-            'end_month': end_month
+            'start_period': start_period,
+            'end_period': end_period
         }
         
         
         
-        result = connection.execute(sql, sql_params).fetchall()
+        # 汇总表就绪且交易时间筛选按整月时，从汇总表读取（结果列与上面的明细查询相同）
+        months = whole_months(transaction_start_date, transaction_end_date)
+        if months is not None and rollup_ready():
+            result = _statistics_rows_from_rollup(connection, group_by_clause, sql_params, months)
+        else:
+            result = connection.execute(sql, sql_params).fetchall()
         
         # 处理查询结果
         for row in result:
@@ -1308,6 +1388,41 @@ def get_filtered_projects():
     return jsonify({'projects': project_list})
 
 
+def _analysis_from_rollup(project_ids, production_start_month, production_end_month, months):
+    """get_analysis_data 的汇总表版本：按电量生产年月列出台账中有记录的月份及各平台合计"""
+    with db.engine.connect() as connection:
+        grouped = query_rollup(connection, project_ids, ('production_period',), ('ledger', 'nyj') + TRADE_PLATFORMS,
+                               period_range(production_start_month, production_end_month), months)
+    data = []
+    for (period,), totals in sorted(grouped.items(), reverse=True):
+        if period == 0 or 'ledger' not in totals:
+            continue
+        row = {
+            'production_year_month': format_period(period),
+            'ordinary_green': totals['ledger']['issued'],
+            'green_green': totals['ledger']['green'],
+            'issued_platform_sold': totals.get('nyj', {}).get('quantity', 0.0)
+        }
+        row.update(platform_fields(totals))
+        data.append(row)
+    return data
+
+
+def _transaction_time_from_rollup(project_ids, production_start_period, production_end_period, months):
+    """get_transaction_time_data 的汇总表版本：按交易年月列出各交易平台合计"""
+    with db.engine.connect() as connection:
+        grouped = query_rollup(connection, project_ids, ('transaction_month',), TRADE_PLATFORMS,
+                               (production_start_period, production_end_period), months)
+    data = []
+    for (month,), totals in sorted(grouped.items(), reverse=True):
+        if not month:
+            continue
+        row = {'transaction_year_month': month}
+        row.update(platform_fields(totals))
+        data.append(row)
+    return data
+
+
 @dashboard_bp.route('/get_analysis_data', methods=['POST'])
 @login_required
 def get_analysis_data():
@@ -1345,32 +1460,39 @@ def get_analysis_data():
     if not project_ids_list:
         return jsonify([])
     
+    # 汇总表就绪且交易时间筛选按整月时，一次查询汇总表得到所有生产年月的数据
+    months = whole_months(transaction_start_date, transaction_end_date)
+    if months is not None and rollup_ready():
+        return jsonify(_analysis_from_rollup(project_ids_list, production_start_month, production_end_month, months))
+    
     # 执行聚合统计
     with db.engine.connect() as connection:
         # 主查询：获取所有电量生产年月并按时间倒序排列
-        main_sql_conditions = ["project_id IN :project_ids", "production_year_month IS NOT NULL", "production_year_month != ''"]
+        # 生产年月统一使用整数 production_period (YYYYMM)，可以走 (project_id, production_period) 索引
+        main_sql_conditions = ["project_id IN :project_ids", "production_period IS NOT NULL"]
         main_sql_params = {'project_ids': tuple(project_ids_list)}
         
         # 添加生产时间筛选条件（只有当参数不为空时才添加）
         if production_start_month and production_start_month != '':
-            main_sql_conditions.append("production_year_month >= :production_start_month")
-            main_sql_params['production_start_month'] = production_start_month
+            main_sql_conditions.append("production_period >= :production_start_period")
+            main_sql_params['production_start_period'] = period_range(production_start_month, None)[0]
         if production_end_month and production_end_month != '':
-            main_sql_conditions.append("production_year_month <= :production_end_month")
-            main_sql_params['production_end_month'] = production_end_month
+            main_sql_conditions.append("production_period <= :production_end_period")
+            main_sql_params['production_end_period'] = period_range(None, production_end_month)[1]
             
         main_sql = text(f"""
-            SELECT DISTINCT production_year_month
+            SELECT production_period, MIN(production_year_month)
             FROM nyj_green_certificate_ledger 
             WHERE {' AND '.join(main_sql_conditions)}
-            ORDER BY production_year_month DESC
+            GROUP BY production_period
+            ORDER BY production_period DESC
         """)
         
         months_result = connection.execute(main_sql, main_sql_params).fetchall()
         
         data = []
         for month_row in months_result:
-            month = month_row[0]
+            period, month = month_row[0], month_row[1]
             
             # 1. 普通绿证和绿电绿证 - 从nyj_green_certificate_ledger表
             ledger_sql = text("""
@@ -1387,20 +1509,20 @@ def get_analysis_data():
                     END), 0) as green_total
                 FROM nyj_green_certificate_ledger 
                 WHERE project_id IN :project_ids 
-                AND production_year_month = :month
+                AND production_period = :period
             """)
             ledger_result = connection.execute(ledger_sql, {
                 'project_ids': tuple(project_ids_list), 
-                'month': month
+                'period': period
             }).fetchone()
             
             # 2. 核发平台售出量 - 从nyj_transaction_records表
             transaction_sql_conditions = [
                 "project_id IN :project_ids",
-                "CONCAT(production_year, '-', LPAD(production_month, 2, '0')) = :month",
+                "production_period = :period",
                 "transaction_num IS NOT NULL AND transaction_num != ''"
             ]
-            transaction_sql_params = {'project_ids': tuple(project_ids_list), 'month': month}
+            transaction_sql_params = {'project_ids': tuple(project_ids_list), 'period': period}
             
             # 添加交易时间筛选条件（只有当参数不为空时才添加）
             if transaction_start_date and transaction_start_date != '':
@@ -1420,10 +1542,10 @@ def get_analysis_data():
             # 3. 绿证平台售出-单向挂牌 - 从gzpt_unilateral_listings表
             unilateral_sql_conditions = [
                 "project_id IN :project_ids",
-                "generate_ym = :month",
+                "production_period = :period",
                 "order_status = '1'"
             ]
-            unilateral_sql_params = {'project_ids': tuple(project_ids_list), 'month': month}
+            unilateral_sql_params = {'project_ids': tuple(project_ids_list), 'period': period}
             
             # 添加交易时间筛选条件
             if transaction_start_date:
@@ -1445,10 +1567,10 @@ def get_analysis_data():
             # 4. 绿证平台售出-双边线下 - 从gzpt_bilateral_offline_trades表
             offline_sql_conditions = [
                 "project_id IN :project_ids",
-                "generate_ym = :month",
+                "production_period = :period",
                 "order_status = '3'"
             ]
-            offline_sql_params = {'project_ids': tuple(project_ids_list), 'month': month}
+            offline_sql_params = {'project_ids': tuple(project_ids_list), 'period': period}
             
             # 添加交易时间筛选条件
             if transaction_start_date:
@@ -1470,10 +1592,10 @@ def get_analysis_data():
             # 5. 绿证平台售出-双边线上 - 从gzpt_bilateral_online_trades表
             online_sql_conditions = [
                 "project_id IN :project_ids",
-                "generate_ym = :month",
+                "production_period = :period",
                 "order_status = '2'"
             ]
-            online_sql_params = {'project_ids': tuple(project_ids_list), 'month': month}
+            online_sql_params = {'project_ids': tuple(project_ids_list), 'period': period}
             
             # 添加交易时间筛选条件
             if transaction_start_date:
@@ -1495,9 +1617,9 @@ def get_analysis_data():
             # 6. 北交平台售出 - 从beijing_power_exchange_trades表
             beijing_sql_conditions = [
                 "project_id IN :project_ids",
-                "production_year_month = :month"
+                "production_period = :period"
             ]
-            beijing_sql_params = {'project_ids': tuple(project_ids_list), 'month': month}
+            beijing_sql_params = {'project_ids': tuple(project_ids_list), 'period': period}
             
             # 添加交易时间筛选条件
             if transaction_start_date:
@@ -1519,9 +1641,9 @@ def get_analysis_data():
             # 7. 广交平台售出 - 从guangzhou_power_exchange_trades表
             guangzhou_sql_conditions = [
                 "project_id IN :project_ids",
-                "CONCAT(SUBSTRING(product_date, 1, 4), '-', LPAD(SUBSTRING(product_date, 6), 2, '0')) = :month"
+                "production_period = :period"
             ]
-            guangzhou_sql_params = {'project_ids': tuple(project_ids_list), 'month': month}
+            guangzhou_sql_params = {'project_ids': tuple(project_ids_list), 'period': period}
             
             # 添加交易时间筛选条件
             if transaction_start_date:
@@ -1597,6 +1719,7 @@ def get_transaction_time_data():
     # 获取时间筛选参数
     production_start_month = filters.get('production_start_month')
     production_end_month = filters.get('production_end_month')
+    production_start_period, production_end_period = period_range(production_start_month, production_end_month)
     transaction_start_date = filters.get('transaction_start_date')
     transaction_end_date = filters.get('transaction_end_date')
     
@@ -1624,6 +1747,12 @@ def get_transaction_time_data():
     if not project_ids_list:
         return jsonify([])
     
+    # 汇总表就绪且交易时间筛选按整月时，一次查询汇总表得到所有交易年月的数据
+    months = whole_months(transaction_start_date, transaction_end_date)
+    if months is not None and rollup_ready():
+        return jsonify(_transaction_time_from_rollup(project_ids_list, production_start_period, production_end_period,
+                                                     months))
+    
     # 执行聚合统计
     with db.engine.connect() as connection:
         # 获取所有交易月份
@@ -1695,11 +1824,11 @@ def get_transaction_time_data():
                 unilateral_sql_conditions.append("order_time_str <= :transaction_end_date")
                 unilateral_sql_params['transaction_end_date'] = transaction_end_date
             if production_start_month and production_start_month != '':
-                unilateral_sql_conditions.append("generate_ym >= :production_start_month")
-                unilateral_sql_params['production_start_month'] = production_start_month
+                unilateral_sql_conditions.append("production_period >= :production_start_period")
+                unilateral_sql_params['production_start_period'] = production_start_period
             if production_end_month and production_end_month != '':
-                unilateral_sql_conditions.append("generate_ym <= :production_end_month")
-                unilateral_sql_params['production_end_month'] = production_end_month
+                unilateral_sql_conditions.append("production_period <= :production_end_period")
+                unilateral_sql_params['production_end_period'] = production_end_period
                 
             unilateral_sql = text(f"""
                 SELECT 
@@ -1725,11 +1854,11 @@ def get_transaction_time_data():
                 online_sql_conditions.append("order_time_str <= :transaction_end_date")
                 online_sql_params['transaction_end_date'] = transaction_end_date
             if production_start_month and production_start_month != '':
-                online_sql_conditions.append("generate_ym >= :production_start_month")
-                online_sql_params['production_start_month'] = production_start_month
+                online_sql_conditions.append("production_period >= :production_start_period")
+                online_sql_params['production_start_period'] = production_start_period
             if production_end_month and production_end_month != '':
-                online_sql_conditions.append("generate_ym <= :production_end_month")
-                online_sql_params['production_end_month'] = production_end_month
+                online_sql_conditions.append("production_period <= :production_end_period")
+                online_sql_params['production_end_period'] = production_end_period
                 
             online_sql = text(f"""
                 SELECT 
@@ -1755,11 +1884,11 @@ def get_transaction_time_data():
                 offline_sql_conditions.append("order_time_str <= :transaction_end_date")
                 offline_sql_params['transaction_end_date'] = transaction_end_date
             if production_start_month and production_start_month != '':
-                offline_sql_conditions.append("generate_ym >= :production_start_month")
-                offline_sql_params['production_start_month'] = production_start_month
+                offline_sql_conditions.append("production_period >= :production_start_period")
+                offline_sql_params['production_start_period'] = production_start_period
             if production_end_month and production_end_month != '':
-                offline_sql_conditions.append("generate_ym <= :production_end_month")
-                offline_sql_params['production_end_month'] = production_end_month
+                offline_sql_conditions.append("production_period <= :production_end_period")
+                offline_sql_params['production_end_period'] = production_end_period
                 
             offline_sql = text(f"""
                 SELECT 
@@ -1784,11 +1913,11 @@ def get_transaction_time_data():
                 beijing_sql_conditions.append("transaction_time <= :transaction_end_date")
                 beijing_sql_params['transaction_end_date'] = transaction_end_date
             if production_start_month and production_start_month != '':
-                beijing_sql_conditions.append("production_year_month >= :production_start_month")
-                beijing_sql_params['production_start_month'] = production_start_month
+                beijing_sql_conditions.append("production_period >= :production_start_period")
+                beijing_sql_params['production_start_period'] = production_start_period
             if production_end_month and production_end_month != '':
-                beijing_sql_conditions.append("production_year_month <= :production_end_month")
-                beijing_sql_params['production_end_month'] = production_end_month
+                beijing_sql_conditions.append("production_period <= :production_end_period")
+                beijing_sql_params['production_end_period'] = production_end_period
                 
             beijing_sql = text(f"""
                 SELECT 
@@ -1819,14 +1948,13 @@ def get_transaction_time_data():
                 guangzhou_sql_conditions.append("deal_time <= :transaction_end_date")
                 guangzhou_sql_params['transaction_end_date'] = transaction_end_date
             
-            # 生产时间筛选需转换 product_date 格式（只有当参数不为空时才添加）
-            production_ym_column = "CONCAT(SUBSTRING(product_date, 1, 4), '-', LPAD(SUBSTRING(product_date, 6), 2, '0'))"
+            # 生产时间筛选使用统一的 production_period（只有当参数不为空时才添加）
             if production_start_month and production_start_month != '':
-                guangzhou_sql_conditions.append(f"{production_ym_column} >= :production_start_month")
-                guangzhou_sql_params['production_start_month'] = production_start_month
+                guangzhou_sql_conditions.append("production_period >= :production_start_period")
+                guangzhou_sql_params['production_start_period'] = production_start_period
             if production_end_month and production_end_month != '':
-                guangzhou_sql_conditions.append(f"{production_ym_column} <= :production_end_month")
-                guangzhou_sql_params['production_end_month'] = production_end_month
+                guangzhou_sql_conditions.append("production_period <= :production_end_period")
+                guangzhou_sql_params['production_end_period'] = production_end_period
                 
             guangzhou_sql = text(f"""
                 SELECT 
@@ -2047,103 +2175,14 @@ def customer_transactions():
         else:
             start_month = '0000-01'
             end_month = '9999-12'
+        start_period, end_period = period_range(start_month, end_month)
 
-        # 构建交易时间筛选的SQL片段
-        transaction_filters = {
-            'ul': '', 'ol': '', 'off': '', 'bj': '', 'gz': ''
-        }
+        transaction_range = None
         if transaction_start_date and transaction_end_date:
-            end_date_for_query = f"{transaction_end_date} 23:59:59"
-            transaction_filters['ul'] = f"AND ul.order_time_str BETWEEN '{transaction_start_date}' AND '{end_date_for_query}'"
-            transaction_filters['ol'] = f"AND ol.order_time_str BETWEEN '{transaction_start_date}' AND '{end_date_for_query}'"
-            transaction_filters['off'] = f"AND off.order_time_str BETWEEN '{transaction_start_date}' AND '{end_date_for_query}'"
-            transaction_filters['bj'] = f"AND bj.transaction_time BETWEEN '{transaction_start_date}' AND '{end_date_for_query}'"
-            transaction_filters['gz'] = f"AND gz.deal_time BETWEEN '{transaction_start_date}' AND '{end_date_for_query}'"
-
-        # SQL 查询部分保持不变...
-        complete_sql = f"""
-            SELECT
-                customer_name,
-                SUM(total_quantity) as total_quantity,
-                CASE
-                    WHEN SUM(total_quantity) > 0 THEN SUM(total_amount) / SUM(total_quantity)
-                    ELSE 0
-                END as avg_price
-            FROM (
-                -- 绿证交易平台 - 单向挂牌
-                SELECT
-                    ul.member_name as customer_name,
-                    CAST(ul.total_quantity AS DECIMAL(15,2)) as total_quantity,
-                    CAST(ul.total_amount AS DECIMAL(15,2)) as total_amount
-                FROM projects p
-                JOIN gzpt_unilateral_listings ul ON p.id = ul.project_id
-                WHERE p.id IN :project_ids AND ul.order_status = '1'
-                AND ul.generate_ym >= :start_month AND ul.generate_ym <= :end_month
-                {transaction_filters['ul']}
-
-                UNION ALL
-
-                -- 绿证交易平台 - 双边线上 (如有)
-                SELECT
-                    ol.member_name as customer_name,
-                    CAST(ol.total_quantity AS DECIMAL(15,2)) as total_quantity,
-                    CAST(ol.total_amount AS DECIMAL(15,2)) as total_amount
-                FROM projects p
-                JOIN gzpt_bilateral_online_trades ol ON p.id = ol.project_id
-                WHERE p.id IN :project_ids
-                AND ol.generate_ym >= :start_month AND ol.generate_ym <= :end_month
-                {transaction_filters['ol']}
-
-                UNION ALL
+            transaction_range = (transaction_start_date, transaction_end_date)
 
-                -- 绿证交易平台 - 双边线下
-                SELECT
-                    off.member_name as customer_name,
-                    CAST(off.total_quantity AS DECIMAL(15,2)) as total_quantity,
-                    CAST(off.total_amount AS DECIMAL(15,2)) as total_amount
-                FROM projects p
-                JOIN gzpt_bilateral_offline_trades off ON p.id = off.project_id
-                WHERE p.id IN :project_ids AND off.order_status = '3'
-                AND off.generate_ym >= :start_month AND off.generate_ym <= :end_month
-                {transaction_filters['off']}
-
-                UNION ALL
-
-                -- 北京电力交易中心
-                SELECT
-                    bj.buyer_entity_name as customer_name,
-                    CAST(bj.transaction_quantity AS DECIMAL(15,2)) as total_quantity,
-                    CAST(bj.transaction_quantity AS DECIMAL(15,2)) * CAST(bj.transaction_price AS DECIMAL(15,2)) as total_amount
-                FROM projects p
-                JOIN beijing_power_exchange_trades bj ON p.id = bj.project_id
-                WHERE p.id IN :project_ids
-                AND bj.production_year_month >= :start_month AND bj.production_year_month <= :end_month
-                {transaction_filters['bj']}
-
-                UNION ALL
-
-                -- 广州电力交易中心
-                SELECT
-                    gz.buyer_entity_name as customer_name,
-                    CAST(gz.gpc_certifi_num AS DECIMAL(15,2)) as total_quantity,
-                    CAST(gz.total_cost AS DECIMAL(15,2)) as total_amount
-                FROM projects p
-                JOIN guangzhou_power_exchange_trades gz ON p.id = gz.project_id
-                WHERE p.id IN :project_ids
-                AND gz.product_date >= :start_month AND gz.product_date <= :end_month
-                {transaction_filters['gz']}
-
-            ) as all_trades
-            WHERE customer_name IS NOT NULL AND customer_name != '未知客户'
-            GROUP BY customer_name
-            HAVING total_quantity > 0
-            ORDER BY total_quantity DESC
-        """
-
-        result = connection.execute(
-            text(complete_sql),
-            {"project_ids": tuple(project_ids_list), "start_month": start_month, "end_month": end_month}
-        )
+        # 各平台分别按买方汇总后合并
+        result = customer_totals(connection, project_ids_list, (start_period, end_period), transaction_range)
         
         # 计算合计数据
         total_quantity_sum = 0
@@ -2151,8 +2190,8 @@ def customer_transactions():
         
         for row in result:
             quantity = float(row.total_quantity)
-            price = float(row.avg_price)
-            amount = quantity * price
+            amount = float(row.total_amount or 0)
+            price = amount / quantity
             
             total_quantity_sum += quantity
             total_amount_sum += amount
@@ -2209,80 +2248,10 @@ def customer_info():
         total_customers = 0
     else:
         with db.engine.connect() as connection:
-            # 获取所有有交易记录的客户名称（不限时间）
-            customer_sql = """
-                SELECT DISTINCT
-                    CASE 
-                        WHEN bj.buyer_entity_name IS NOT NULL THEN bj.buyer_entity_name
-                        WHEN gz.buyer_entity_name IS NOT NULL THEN gz.buyer_entity_name
-                        WHEN ul.member_name IS NOT NULL THEN ul.member_name
-                        WHEN ol.member_name IS NOT NULL THEN ol.member_name
-                        WHEN off.member_name IS NOT NULL THEN off.member_name
-                        ELSE '未知客户'
-                    END as customer_name
-                FROM projects p 
-                JOIN nyj_green_certificate_ledger n ON p.id = n.project_id
-                LEFT JOIN gzpt_unilateral_listings ul ON n.project_id = ul.project_id AND n.production_year_month = ul.generate_ym AND ul.order_status = '1'
-                LEFT JOIN gzpt_bilateral_online_trades ol ON n.project_id = ol.project_id AND n.production_year_month = ol.generate_ym
-                LEFT JOIN gzpt_bilateral_offline_trades off ON n.project_id = off.project_id AND n.production_year_month = off.generate_ym
-                LEFT JOIN beijing_power_exchange_trades bj ON n.project_id = bj.project_id AND n.production_year_month = bj.production_year_month
-                LEFT JOIN guangzhou_power_exchange_trades gz ON n.project_id = gz.project_id AND n.production_year_month = gz.product_date
-                WHERE p.id IN :project_ids
-                AND (
-                    ul.total_quantity > 0 OR ol.total_quantity > 0 OR off.total_quantity > 0 OR
-                    bj.transaction_quantity > 0 OR gz.gpc_certifi_num > 0
-                )
-                ORDER BY customer_name
-            """
-            
-            result = connection.execute(
-                text(customer_sql),
-                {"project_ids": project_ids_list}
-            )
-            
-            customer_names = [row.customer_name for row in result if row.customer_name != '未知客户']
-            
-            # 获取客户交易量数据用于排序
-            customer_volume_sql = """
-                SELECT 
-                    CASE 
-                        WHEN bj.buyer_entity_name IS NOT NULL THEN bj.buyer_entity_name
-                        WHEN gz.buyer_entity_name IS NOT NULL THEN gz.buyer_entity_name
-                        WHEN ul.member_name IS NOT NULL THEN ul.member_name
-                        WHEN ol.member_name IS NOT NULL THEN ol.member_name
-                        WHEN off.member_name IS NOT NULL THEN off.member_name
-                        ELSE '未知客户'
-                    END as customer_name,
-                    SUM(
-                        COALESCE(ul.total_quantity, 0) + 
-                        COALESCE(ol.total_quantity, 0) + 
-                        COALESCE(off.total_quantity, 0) + 
-                        COALESCE(bj.transaction_quantity, 0) + 
-                        COALESCE(gz.gpc_certifi_num, 0)
-                    ) as total_quantity
-                FROM projects p 
-                JOIN nyj_green_certificate_ledger n ON p.id = n.project_id
-                LEFT JOIN gzpt_unilateral_listings ul ON n.project_id = ul.project_id AND n.production_year_month = ul.generate_ym AND ul.order_status = '1'
-                LEFT JOIN gzpt_bilateral_online_trades ol ON n.project_id = ol.project_id AND n.production_year_month = ol.generate_ym
-                LEFT JOIN gzpt_bilateral_offline_trades off ON n.project_id = off.project_id AND n.production_year_month = off.generate_ym
-                LEFT JOIN beijing_power_exchange_trades bj ON n.project_id = bj.project_id AND n.production_year_month = bj.production_year_month
-                LEFT JOIN guangzhou_power_exchange_trades gz ON n.project_id = gz.project_id AND n.production_year_month = gz.product_date
-                WHERE p.id IN :project_ids
-                AND (
-                    ul.total_quantity > 0 OR ol.total_quantity > 0 OR off.total_quantity > 0 OR
-                    bj.transaction_quantity > 0 OR gz.gpc_certifi_num > 0
-                )
-                GROUP BY customer_name
-                HAVING total_quantity > 0
-            """
-            
-            volume_result = connection.execute(
-                text(customer_volume_sql),
-                {"project_ids": project_ids_list}
-            )
-            
-            # 创建客户交易量字典
-            customer_volumes = {row.customer_name: float(row.total_quantity) for row in volume_result if row.customer_name != '未知客户'}
+            # 有交易记录的客户（不限时间）及其成交量，用于排序；各平台分别按买方汇总后合并
+            customer_volumes = {row.customer_name: float(row.total_quantity)
+                                for row in customer_totals(connection, project_ids_list)}
+        customer_names = sorted(customer_volumes)
         
         # 从customer表中获取客户信息
         customers = Customer.query.filter(Customer.customer_name.in_(customer_names)).all()
@@ -2383,7 +2352,7 @@ def customer_map():
 @login_required
 def get_province_transaction_data():
     """获取各省份【买方】成交量数据API - (已修改为从缓存读取)"""
-    cached_data = get_cached_data()
+    cached_data, _ = get_dashboard_data()
     
     if cached_data and 'map_buyer_provinces' in cached_data:
         province_data = cached_data['map_buyer_provinces']
@@ -2399,7 +2368,7 @@ def get_province_transaction_data():
 @login_required
 def get_seller_province_transaction_data():
     """获取各省份【卖方】成交量数据API - (已修改为从缓存读取)"""
-    cached_data = get_cached_data()
+    cached_data, _ = get_dashboard_data()
     
     if cached_data and 'map_seller_provinces' in cached_data:
         province_data = cached_data['map_seller_provinces']
@@ -2480,6 +2449,7 @@ def get_customer_details():
         start_month = '0000-01'
         end_month = '9999-12'
     # --- 修改结束 ---
+    start_period, end_period = period_range(start_month, end_month)
 
     # 构建交易时间筛选的SQL片段
     transaction_filters = {
@@ -2517,7 +2487,7 @@ def get_customer_details():
                 CASE WHEN ul.total_quantity > 0 THEN CAST(ul.total_amount AS DECIMAL(15,2)) / CAST(ul.total_quantity AS DECIMAL(15,2)) ELSE 0 END AS price
             FROM projects p JOIN gzpt_unilateral_listings ul ON p.id = ul.project_id
             WHERE p.id IN :project_ids AND ul.member_name = :customer_name AND ul.order_status = '1'
-            AND ul.generate_ym BETWEEN :start_month AND :end_month
+            AND ul.production_period BETWEEN :start_period AND :end_period
             {transaction_filters['ul']}
 
             UNION ALL
@@ -2532,7 +2502,7 @@ def get_customer_details():
                 CASE WHEN ol.total_quantity > 0 THEN CAST(ol.total_amount AS DECIMAL(15,2)) / CAST(ol.total_quantity AS DECIMAL(15,2)) ELSE 0 END AS price
             FROM projects p JOIN gzpt_bilateral_online_trades ol ON p.id = ol.project_id
             WHERE p.id IN :project_ids AND ol.member_name = :customer_name
-            AND ol.generate_ym BETWEEN :start_month AND :end_month
+            AND ol.production_period BETWEEN :start_period AND :end_period
             {transaction_filters['ol']}
 
             UNION ALL
@@ -2547,7 +2517,7 @@ def get_customer_details():
                 CASE WHEN off.total_quantity > 0 THEN CAST(off.total_amount AS DECIMAL(15,2)) / CAST(off.total_quantity AS DECIMAL(15,2)) ELSE 0 END AS price
             FROM projects p JOIN gzpt_bilateral_offline_trades off ON p.id = off.project_id
             WHERE p.id IN :project_ids AND off.member_name = :customer_name AND off.order_status = '3'
-            AND off.generate_ym BETWEEN :start_month AND :end_month
+            AND off.production_period BETWEEN :start_period AND :end_period
             {transaction_filters['off']}
 
             UNION ALL
@@ -2562,7 +2532,7 @@ def get_customer_details():
                 CAST(bj.transaction_price AS DECIMAL(15,2)) AS price
             FROM projects p JOIN beijing_power_exchange_trades bj ON p.id = bj.project_id
             WHERE p.id IN :project_ids AND bj.buyer_entity_name = :customer_name
-            AND bj.production_year_month BETWEEN :start_month AND :end_month
+            AND bj.production_period BETWEEN :start_period AND :end_period
             {transaction_filters['bj']}
 
             UNION ALL
@@ -2577,7 +2547,7 @@ def get_customer_details():
                 CASE WHEN gz.gpc_certifi_num > 0 THEN CAST(gz.total_cost AS DECIMAL(15,2)) / CAST(gz.gpc_certifi_num AS DECIMAL(15,2)) ELSE 0 END AS price
             FROM projects p JOIN guangzhou_power_exchange_trades gz ON p.id = gz.project_id
             WHERE p.id IN :project_ids AND gz.buyer_entity_name = :customer_name
-            AND CONCAT(SUBSTRING(gz.product_date, 1, 4), '-', LPAD(SUBSTRING(gz.product_date, 6), 2, '0')) BETWEEN :start_month AND :end_month
+            AND gz.production_period BETWEEN :start_period AND :end_period
             {transaction_filters['gz']}
         ) as all_details
         WHERE quantity > 0
@@ -2590,8 +2560,8 @@ def get_customer_details():
             text(details_sql),
             {
                 "project_ids": tuple(project_ids_list), 
-                "start_month": start_month, 
-                "end_month": end_month,
+                "start_period": start_period,
+                "end_period": end_period,
                 "customer_name": customer_name
             }
         )
@@ -2996,15 +2966,38 @@ def get_dashboard_chart_data():
     volume_data = []
     price_data = []
     
+    # 汇总表就绪时一次查询得到所有 (交易年月, 生产年份) 的合计
+    if rollup_ready():
+        with db.engine.connect() as connection:
+            grouped = query_rollup(connection, project_ids_list, ('transaction_month', 'production_period'),
+                                   TRADE_PLATFORMS, (production_years[0] * 100 + 1, production_years[-1] * 100 + 12),
+                                   (transaction_months[0], transaction_months[-1]))
+        sums = {}
+        for (month, period), totals in grouped.items():
+            total = sums.setdefault((month, period // 100), [0.0, 0.0])
+            for values in totals.values():
+                total[0] += values['quantity']
+                total[1] += values['amount']
+        for month in transaction_months:
+            month_volume = {'month': month}
+            month_price = {'month': month}
+            for prod_year in production_years:
+                total_qty, total_amt = sums.get((month, prod_year), (0.0, 0.0))
+                month_volume[f'data_{prod_year}'] = round(total_qty / 10000, 2)  # 转换为万张
+                month_price[f'data_{prod_year}'] = round(total_amt / total_qty, 2) if total_qty > 0 else 0
+            volume_data.append(month_volume)
+            price_data.append(month_price)
+        return jsonify({'volume_data': volume_data, 'price_data': price_data})
+    
     with db.engine.connect() as connection:
         for month in transaction_months:
             month_volume = {'month': month, 'data_2023': 0, 'data_2024': 0, 'data_2025': 0}
             month_price = {'month': month, 'data_2023': 0, 'data_2024': 0, 'data_2025': 0}
             
             for prod_year in production_years:
-                # 构建生产年月范围
-                prod_start = f"{prod_year}-01"
-                prod_end = f"{prod_year}-12"
+                # 构建生产年月范围（production_period 为整数 YYYYMM）
+                prod_start = prod_year * 100 + 1
+                prod_end = prod_year * 100 + 12
                 
                 # 构建交易时间范围
                 trans_start = f"{month}-01 00:00:00"
@@ -3026,7 +3019,7 @@ def get_dashboard_chart_data():
                         COALESCE(SUM(CASE WHEN total_quantity != '' AND total_amount != '' THEN CAST(total_amount AS DECIMAL(15,2)) ELSE 0 END), 0) as amt
                     FROM gzpt_unilateral_listings 
                     WHERE project_id IN :project_ids 
-                    AND generate_ym BETWEEN :prod_start AND :prod_end
+                    AND production_period BETWEEN :prod_start AND :prod_end
                     AND order_time_str BETWEEN :trans_start AND :trans_end
                     AND order_status = '1'
                 """)
@@ -3047,7 +3040,7 @@ def get_dashboard_chart_data():
                         COALESCE(SUM(CASE WHEN total_quantity != '' AND total_amount != '' THEN CAST(total_amount AS DECIMAL(15,2)) ELSE 0 END), 0) as amt
                     FROM gzpt_bilateral_offline_trades 
                     WHERE project_id IN :project_ids 
-                    AND generate_ym BETWEEN :prod_start AND :prod_end
+                    AND production_period BETWEEN :prod_start AND :prod_end
                     AND order_time_str BETWEEN :trans_start AND :trans_end
                     AND order_status = '3'
                 """)
@@ -3068,7 +3061,7 @@ def get_dashboard_chart_data():
                         COALESCE(SUM(CASE WHEN total_quantity != '' AND total_amount != '' THEN CAST(total_amount AS DECIMAL(15,2)) ELSE 0 END), 0) as amt
                     FROM gzpt_bilateral_online_trades 
                     WHERE project_id IN :project_ids 
-                    AND generate_ym BETWEEN :prod_start AND :prod_end
+                    AND production_period BETWEEN :prod_start AND :prod_end
                     AND order_time_str BETWEEN :trans_start AND :trans_end
                 """)
                 result = connection.execute(online_sql, {
@@ -3088,7 +3081,7 @@ def get_dashboard_chart_data():
                         COALESCE(SUM(CASE WHEN transaction_quantity != '' AND transaction_price != '' THEN CAST(transaction_quantity AS DECIMAL(15,2)) * CAST(transaction_price AS DECIMAL(15,2)) ELSE 0 END), 0) as amt
                     FROM beijing_power_exchange_trades 
                     WHERE project_id IN :project_ids 
-                    AND production_year_month BETWEEN :prod_start AND :prod_end
+                    AND production_period BETWEEN :prod_start AND :prod_end
                     AND transaction_time BETWEEN :trans_start AND :trans_end
                 """)
                 result = connection.execute(beijing_sql, {
@@ -3108,7 +3101,7 @@ def get_dashboard_chart_data():
                         COALESCE(SUM(CASE WHEN gpc_certifi_num != 0 AND total_cost != 0 THEN CAST(total_cost AS DECIMAL(15,2)) ELSE 0 END), 0) as amt
                     FROM guangzhou_power_exchange_trades 
                     WHERE project_id IN :project_ids 
-                    AND CONCAT(SUBSTRING(product_date, 1, 4), '-', LPAD(SUBSTRING(product_date, 6), 2, '0')) BETWEEN :prod_start AND :prod_end
+                    AND production_period BETWEEN :prod_start AND :prod_end
                     AND deal_time BETWEEN :trans_start AND :trans_end
                 """)
                 result = connection.execute(guangzhou_sql, {
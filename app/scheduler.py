@@ -8,7 +8,7 @@ import threading
 import time
 from datetime import datetime
 # 确保从.dashboard_cache导入，如果scheduler.py在app目录下
-from .dashboard_cache import calculate_dashboard_data
+from .dashboard_cache import calculate_dashboard_data, full_calculation_age
 
 class DashboardScheduler:
     """Dashboard数据定时计算器"""
@@ -57,6 +57,12 @@ class DashboardScheduler:
         """带日志的数据计算（在应用上下文中执行）"""
         # 这是关键！使用with self.app.app_context()来确保数据库等操作可以正常工作
         with self.app.app_context():
+            # 共享快照刚由其它进程（或重启前的本进程）完整计算过时跳过，多个服务进程合计每个周期只计算一次；
+            # 按变更的部分重算不计入，周期性的完整计算仍作为兜底
+            age = full_calculation_age()
+            if age is not None and age < self.interval_seconds * 0.9:
+                print(f"[{datetime.now()}] 快照在 {int(age)} 秒前已完整计算，跳过本次计算")
+                return
             try:
                 print(f"[{datetime.now()}] 开始周期性计算dashboard数据...")
                 calculate_dashboard_data()
@@ -0,0 +1,141 @@
+# 文件: schema.py
+# 关联表的结构升级：这些表没有ORM模型，新增列和索引通过此处的幂等步骤完成
+
+import logging
+from sqlalchemy import inspect, text
+from .models import db
+from .utils import to_production_period, period_from_year_month
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+# 由 data_processors 写入的所有关联表
+DERIVED_TABLES = [
+    "nyj_green_certificate_ledger",
+    "nyj_transaction_records",
+    "gzpt_unilateral_listings",
+    "gzpt_bilateral_online_trades",
+    "gzpt_bilateral_offline_trades",
+    "beijing_power_exchange_trades",
+    "guangzhou_power_exchange_trades"
+]
+
+# 需要补充的列：(表名, 列名, 列定义)
+COLUMN_UPGRADES = [
+    # 规范化后每行数据的哈希，用于增量刷新时判断记录是否变化
+    (table_name, "row_hash", "CHAR(32) NULL") for table_name in DERIVED_TABLES
+] + [
+    # 统一的电量生产年月（整数 YYYYMM），替代各表格式不一的年月字符串用于范围筛选
+    (table_name, "production_period", "INT NULL") for table_name in DERIVED_TABLES
+] + [
+    # 项目原始数据在 source_payloads 中的内容哈希
+    ("projects", f"{column}_hash", "VARCHAR(64) NULL") for column in ("data_nyj", "data_lzy", "data_bjdl", "data_gjdl")
+] + [
+    # 原始数据最近一次被使用的时间，释放无引用的数据时留出宽限期
+    ("source_payloads", "last_used_at", "DATETIME NULL")
+]
+
+# 需要补充的索引：(表名, 索引名, 列)
+INDEX_UPGRADES = [
+    (table_name, "idx_project_period", ("project_id", "production_period")) for table_name in DERIVED_TABLES
+]
+
+# 各关联表中 production_period 的来源列，用于回填历史数据
+PERIOD_SOURCE_COLUMNS = {
+    "nyj_green_certificate_ledger": ("production_year_month",),
+    "nyj_transaction_records": ("production_year", "production_month"),
+    "gzpt_unilateral_listings": ("generate_ym",),
+    "gzpt_bilateral_online_trades": ("generate_ym",),
+    "gzpt_bilateral_offline_trades": ("generate_ym",),
+    "beijing_power_exchange_trades": ("production_year_month",),
+    "guangzhou_power_exchange_trades": ("product_date",)
+}
+
+# 列存在性检查的缓存，避免每次提交都查询 information_schema
+_column_cache = {}
+
+
+def has_column(table_name, column_name):
+    """检查表中是否存在指定列（结果会被缓存）"""
+    key = (table_name, column_name)
+    if key not in _column_cache:
+        try:
+            columns = inspect(db.engine).get_columns(table_name)
+            _column_cache[key] = any(c['name'] == column_name for c in columns)
+        except Exception as e:
+            logger.warning(f"读取表结构失败 {table_name}: {e}")
+            return False
+    return _column_cache[key]
+
+
+def upgrade_schema():
+    """
+    执行所有尚未应用的结构升级，返回已执行的语句列表。
+    报表只按 production_period 筛选生产年月，因此升级后立即为历史数据回填该列（只处理仍为 NULL 的行）。
+    """
+    # 先创建新增的表（如 source_payloads），已存在的表不受影响
+    db.create_all()
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    applied = []
+
+    with db.engine.begin() as connection:
+        for table_name, column_name, definition in COLUMN_UPGRADES:
+            if table_name not in existing_tables:
+                continue
+            columns = {c['name'] for c in inspector.get_columns(table_name)}
+            if column_name in columns:
+                continue
+            sql = f"ALTER TABLE {table_name} ADD COLUMN {column_name} {definition}"
+            connection.execute(text(sql))
+            applied.append(sql)
+
+        for table_name, index_name, columns in INDEX_UPGRADES:
+            if table_name not in existing_tables:
+                continue
+            indexes = {i['name'] for i in inspector.get_indexes(table_name)}
+            if index_name in indexes:
+                continue
+            sql = f"CREATE INDEX {index_name} ON {table_name} ({', '.join(columns)})"
+            connection.execute(text(sql))
+            applied.append(sql)
+
+    _column_cache.clear()
+    for table_name, count in backfill_production_periods().items():
+        if count:
+            applied.append(f"回填 {table_name}.production_period: {count} 行")
+    return applied
+
+
+def backfill_production_periods():
+    """
+    为历史数据回填 production_period，返回 {表名: 更新的行数}。
+    年月的不同写法只有几百种，按来源列的取值去重后逐个换算并更新，与入库时的换算规则完全一致。
+    """
+    updated = {}
+    for table_name, source_columns in PERIOD_SOURCE_COLUMNS.items():
+        if not has_column(table_name, "production_period"):
+            logger.warning(f"{table_name} 缺少 production_period 列，请先执行 flask upgrade-db")
+            continue
+        column_sql = ', '.join(source_columns)
+        values = db.session.execute(text(
+            f"SELECT DISTINCT {column_sql} FROM {table_name} WHERE production_period IS NULL")).fetchall()
+
+        where_sql = ' AND '.join(f"{col} = :v{i}" for i, col in enumerate(source_columns))
+        count = 0
+        for row in values:
+            if len(source_columns) == 2:
+                period = period_from_year_month(row[0], row[1])
+            else:
+                period = to_production_period(row[0])
+            if period is None or any(v is None for v in row):
+                continue
+            params = {f"v{i}": v for i, v in enumerate(row)}
+            params['period'] = period
+            result = db.session.execute(text(
+                f"UPDATE {table_name} SET production_period = :period "
+                f"WHERE production_period IS NULL AND {where_sql}"), params)
+            count += result.rowcount
+        db.session.commit()
+        updated[table_name] = count
+    return updated
@@ -0,0 +1,262 @@
+# 文件: snapshot_store.py
+# 看板快照的存储后端：默认为进程内字典；可选同一主机上各进程共享的内存映射文件，一次计算发布给所有进程
+
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 fcntl，mmap 后端的写锁只在本进程内生效
+    fcntl = None
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+# 一份快照：数据、计算完成的时间戳，以及该键每次发布递增的代数
+Snapshot = namedtuple('Snapshot', ['value', 'timestamp', 'generation'])
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat(sep=' ') if isinstance(value, datetime) else value.isoformat()
+    return str(value)
+
+
+# 快照文件：定长头（魔数、时间戳、代数）加紧凑JSON；数据结构版本体现在键名（即文件名）中
+MAGIC = b'GSN1'
+HEADER = struct.Struct('<4sdQ')
+
+
+def snapshot_path(directory, key):
+    return os.path.join(directory, f"{key}.snap")
+
+
+def read_snapshot_file(path):
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if len(mm) < HEADER.size:
+            raise ValueError('快照文件不完整')
+        magic, timestamp, generation = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC:
+            raise ValueError('快照文件格式不正确')
+        value = json.loads(mm[HEADER.size:])
+    return Snapshot(value, timestamp, generation)
+
+
+def write_snapshot_file(directory, key, snapshot):
+    """先写临时文件再原子改名替换，读者不会看到写了一半的文件；返回写入的字节数"""
+    body = json.dumps(snapshot.value, ensure_ascii=False, separators=(',', ':'), default=_json_default).encode('utf-8')
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{key}-", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, snapshot.timestamp, snapshot.generation))
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        _replace(tmp_path, snapshot_path(directory, key))
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return len(body)
+
+
+def _replace(src, dst, attempts=5):
+    # Windows 上目标文件正被其它进程读取时改名会失败，稍后重试
+    for attempt in range(attempts):
+        try:
+            os.replace(src, dst)
+            return
+        except PermissionError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(0.05 * (attempt + 1))
+
+
+class MemorySnapshotStore:
+    """
+    进程内存储：读取是一次字典操作，适合单进程部署。
+    给出 directory 时每次发布同时写入磁盘，创建时载入目录中已有的快照，
+    服务重启后即可返回上次的快照（按其原计算时间判断是否过期），不必等第一次计算完成。
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._entries = {}
+        # 后台刷新线程与请求线程并发读写；写盘也在锁内，磁盘上的快照与内存中的代数顺序一致
+        self._lock = threading.Lock()
+        # 读-改-写（lock）与单次读写（_lock）分开：计算期间其它线程仍可读取当前快照
+        self._update_lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._load_all()
+
+    def _load_all(self):
+        for name in os.listdir(self.directory):
+            if not name.endswith('.snap'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                self._entries[name[:-len('.snap')]] = read_snapshot_file(path)
+            except (OSError, ValueError) as e:
+                logger.warning(f"载入快照 {path} 失败: {e}")
+        if self._entries:
+            logger.info(f"已从磁盘载入快照: {', '.join(sorted(self._entries))}")
+
+    def get(self, key):
+        with self._lock:
+            return self._entries.get(key)
+
+    def put(self, key, value, timestamp=None):
+        with self._lock:
+            previous = self._entries.get(key)
+            snapshot = Snapshot(value, timestamp or time.time(), previous.generation + 1 if previous else 1)
+            self._entries[key] = snapshot
+            if self.directory:
+                # 写盘失败不影响本进程使用新快照，只是重启后载入的是旧一代
+                try:
+                    write_snapshot_file(self.directory, key, snapshot)
+                except OSError as e:
+                    logger.error(f"保存快照 {key} 失败: {e}")
+        return snapshot
+
+    def lock(self, key):
+        """键的读-改-写锁；快照只在本进程内共享，进程内的锁即可"""
+        return self._update_lock
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            if self.directory:
+                try:
+                    os.remove(snapshot_path(self.directory, key))
+                except FileNotFoundError:
+                    pass
+
+
+class MmapSnapshotStore:
+    """
+    文件存储：每个键一个文件，内容为定长头（魔数、时间戳、代数）加紧凑JSON。
+    写入先写临时文件再原子改名替换，读者不会看到写了一半的文件；
+    读取只做一次 stat，文件未变化时直接返回本进程已解码的快照，文件变化后通过 mmap 读取并解码一次。
+    多个进程写同一个键时，读-改-写由 lock(key) 在旁边的 .lock 文件上加 flock 串行化。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._cache = {}  # 键 -> (文件标识, Snapshot)
+        self._write_lock = threading.Lock()  # 没有 fcntl 时代替文件锁
+        self._held = threading.local()  # 本线程已持有文件锁的键，lock 可重入
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return snapshot_path(self.directory, key)
+
+    @contextmanager
+    def lock(self, key):
+        """
+        键的读-改-写锁：在 <键>.lock 上加排它 flock，同一主机上所有进程和线程的“读取→合并→原子替换”依次进行。
+        同一线程内可重入，持有锁时调用 put 不会再次加锁。
+        """
+        held = self._held.__dict__.setdefault('keys', set())
+        if key in held:
+            yield
+            return
+        held.add(key)
+        try:
+            if fcntl is None:
+                with self._write_lock:
+                    yield
+            else:
+                # 文件关闭时锁随之释放，进程异常退出也不会遗留
+                with open(os.path.join(self.directory, f"{key}.lock"), 'a') as f:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                    yield
+        finally:
+            held.discard(key)
+
+    @staticmethod
+    def _file_id(stat):
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            file_id = self._file_id(os.stat(path))
+        except FileNotFoundError:
+            return None
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == file_id:
+            return cached[1]
+        try:
+            snapshot = read_snapshot_file(path)
+        except (OSError, ValueError) as e:
+            # 读取期间文件被替换（Windows）或内容损坏：沿用已有的快照，下次再读
+            logger.warning(f"读取快照 {path} 失败: {e}")
+            return cached[1] if cached is not None else None
+        self._cache[key] = (file_id, snapshot)
+        return snapshot
+
+    def put(self, key, value, timestamp=None):
+        with self.lock(key):
+            previous = self.get(key)
+            snapshot = Snapshot(value, timestamp or time.time(), previous.generation + 1 if previous else 1)
+            size = write_snapshot_file(self.directory, key, snapshot)
+            # 本进程直接缓存新快照，不必再读回；其它进程在下一次 get 时发现文件变化
+            self._cache[key] = (self._file_id(os.stat(self._path(key))), snapshot)
+        logger.info(f"已发布快照 {key} 第 {snapshot.generation} 代 ({size} 字节)")
+        return snapshot
+
+    def delete(self, key):
+        self._cache.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class SnapshotStore:
+    """
+    按 DASHBOARD_SNAPSHOT_BACKEND 选择后端：'memory'（默认）或 'mmap'（DASHBOARD_SNAPSHOT_DIR 下的共享文件）。
+    memory 后端在 DASHBOARD_SNAPSHOT_PERSIST 为 True 时也把快照保存到该目录，供重启后载入。
+    """
+
+    def __init__(self, app=None):
+        self.backend = MemorySnapshotStore()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        directory = app.config.get('DASHBOARD_SNAPSHOT_DIR') or os.path.join(app.instance_path, 'snapshots')
+        if app.config.get('DASHBOARD_SNAPSHOT_BACKEND', 'memory') == 'mmap':
+            self.backend = MmapSnapshotStore(directory)
+        else:
+            self.backend = MemorySnapshotStore(directory if app.config.get('DASHBOARD_SNAPSHOT_PERSIST', True) else None)
+        app.extensions['snapshot_store'] = self
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def put(self, key, value, timestamp=None):
+        return self.backend.put(key, value, timestamp)
+
+    def lock(self, key):
+        """读-改-写一个键时持有的锁（mmap 后端跨进程生效），用法: with snapshot_store.lock(key): ..."""
+        return self.backend.lock(key)
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+
+snapshot_store = SnapshotStore()
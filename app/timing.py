@@ -0,0 +1,125 @@
+# 文件: timing.py
+# 提交处理的分阶段计时：记录一次提交中各阶段的耗时，汇总为滚动分位数，并生成 Server-Timing 响应头
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# 每个线程当前正在计时的提交（接口线程和后台写库线程各自独立）
+_local = threading.local()
+
+
+class StageTimer:
+    """一次提交各阶段的累计耗时（秒），同名阶段多次进入时累加"""
+
+    def __init__(self, label):
+        self.label = label
+        self.stages = {}
+        self.started_at = time.perf_counter()
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def total(self):
+        return time.perf_counter() - self.started_at
+
+    def to_dict(self):
+        """各阶段及总耗时（毫秒）"""
+        result = {name: round(seconds * 1000, 1) for name, seconds in self.stages.items()}
+        result['total'] = round(self.total() * 1000, 1)
+        return result
+
+    def server_timing(self):
+        """生成 Server-Timing 响应头的值"""
+        return ', '.join(f"{name};dur={ms}" for name, ms in self.to_dict().items())
+
+
+def start_timer(label):
+    """为当前线程开始一次计时，返回计时器"""
+    _local.timer = StageTimer(label)
+    return _local.timer
+
+
+def stop_timer():
+    """结束当前线程的计时，返回计时器（没有则返回 None）"""
+    timer = getattr(_local, 'timer', None)
+    _local.timer = None
+    return timer
+
+
+def current_timer():
+    return getattr(_local, 'timer', None)
+
+
+@contextmanager
+def stage(name):
+    """把代码块的耗时记入当前线程计时器的指定阶段；没有计时器时不做任何事"""
+    timer = current_timer()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+def timed_iter(records, name):
+    """只统计记录流产出记录所花的时间，使规范化与写库交替进行时也能分开计时"""
+    timer = current_timer()
+    if timer is None:
+        yield from records
+        return
+    iterator = iter(records)
+    elapsed = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                record = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - start
+            yield record
+    finally:
+        timer.add(name, elapsed)
+
+
+class RollingStats:
+    """按名称保存最近 window 个样本，计算分位数"""
+
+    def __init__(self, window=500):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, value):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.window)
+            samples.append(value)
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+    def summary(self):
+        """{名称: {'count', 'p50', 'p90', 'p99', 'max'}}"""
+        with self._lock:
+            snapshot = {name: sorted(samples) for name, samples in self._samples.items()}
+
+        def percentile(values, q):
+            return round(values[min(len(values) - 1, int(round(q * (len(values) - 1))))], 1)
+
+        return {name: {'count': len(values), 'p50': percentile(values, 0.5), 'p90': percentile(values, 0.9),
+                       'p99': percentile(values, 0.99), 'max': round(values[-1], 1)}
+                for name, values in snapshot.items() if values}
@@ -2,6 +2,9 @@
 # 包含所有辅助函数、数据解析和转换函数
 
 import os
+import re
+import json
+import numpy as np
 import pandas as pd
 from datetime import datetime
 import secrets
@@ -31,6 +34,50 @@ def parse_lzy_datetime(datetime_str):
         print(f"日期解析错误: {datetime_str}, 错误: {e}")
         return None
 
+# 标准ISO格式去除毫秒和时区部分后的形式；各位均为ASCII数字时 fromisoformat 与 strptime 的校验一致
+_ISO_SECONDS_PATTERN = re.compile(r'\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d', re.ASCII)
+
+def parse_lzy_datetime_column(values):
+    """
+    parse_lzy_datetime 的列式版本，结果与逐个调用一致，无法解析的值为 None。
+    一列值先去重（备忘表），再按格式分组解析：
+    标准ISO格式经正则和 datetime.fromisoformat（C实现）校验后直接改写为 'YYYY-MM-DD HH:MM:SS'，
+    旧格式交给 pandas 整列解析后格式化；
+    两种都解析不了的少数值再逐个交给 parse_lzy_datetime，以保持相同的容错行为。
+    """
+    unique = list({v for v in values if isinstance(v, str)})
+    if not unique:
+        return [None] * len(values)
+
+    memo = {}
+    # 1. ISO格式：去除毫秒和时区部分后应为19位的 'YYYY-MM-DDTHH:MM:SS'
+    rest = []
+    for value in unique:
+        head = value.partition('.')[0]
+        if _ISO_SECONDS_PATTERN.fullmatch(head):
+            try:
+                datetime.fromisoformat(head)
+            except ValueError:
+                pass
+            else:
+                memo[value] = f"{head[:10]} {head[11:]}"
+                continue
+        if 'T' not in value:
+            rest.append(value)
+        else:
+            memo[value] = parse_lzy_datetime(value)
+
+    # 2. 旧格式: 'Mmm+DD,+YYYY,+H:MM:SS AM/PM'
+    if rest:
+        cleaned = pd.Series([v.replace('+', ' ').replace('\u202f', ' ') for v in rest], dtype=object)
+        parsed = pd.to_datetime(cleaned, format='%b %d, %Y, %I:%M:%S %p', errors='coerce')
+        valid = parsed.notna().tolist()
+        formatted = np.datetime_as_string(parsed.to_numpy(dtype='datetime64[s]'), unit='s').tolist()
+        for value, text, ok in zip(rest, formatted, valid):
+            memo[value] = text.replace('T', ' ') if ok else parse_lzy_datetime(value)
+
+    return [memo.get(v) if isinstance(v, str) else None for v in values]
+
 def safe_int_cast(value):
     """安全地将值转换为整数，可以处理None和浮点数（如 5182.0）。"""
     if value is None:
@@ -40,6 +87,154 @@ def safe_int_cast(value):
     except (ValueError, TypeError):
         return None
 
+def safe_int_cast_column(values):
+    """safe_int_cast 的列式版本，对重复值只转换一次"""
+    memo = {}
+    result = []
+    for value in values:
+        try:
+            if value not in memo:
+                memo[value] = safe_int_cast(value)
+            result.append(memo[value])
+        except TypeError:
+            # 不可哈希的值（如列表、字典）直接转换
+            result.append(safe_int_cast(value))
+    return result
+
+_PERIOD_PATTERN = re.compile(r'^\s*(\d{4})\D{0,2}(\d{1,2})(?!\d)')
+
+def to_production_period(value):
+    """
+    将各平台的电量生产年月统一为整数 YYYYMM，无法识别时返回 None。
+    支持 'YYYY-MM'、'YYYY-M'、'YYYYMM'、'YYYY-MM-DD'、'YYYY年MM月' 以及整数 YYYYMM。
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        value = str(int(value))
+    elif not isinstance(value, str):
+        return None
+    match = _PERIOD_PATTERN.match(value)
+    if not match:
+        return None
+    year, month = int(match.group(1)), int(match.group(2))
+    return year * 100 + month if 1 <= month <= 12 else None
+
+def period_from_year_month(year, month):
+    """由年份和月份两列得到整数 YYYYMM"""
+    year, month = safe_int_cast(year), safe_int_cast(month)
+    if year is None or month is None or not 1 <= month <= 12:
+        return None
+    return year * 100 + month
+
+def period_range(start_month, end_month):
+    """将筛选用的起止年月（如 '2024-01'）转换为 production_period 的闭区间，缺省时不限制"""
+    return to_production_period(start_month) or 0, to_production_period(end_month) or 999912
+
+def production_period_column(values):
+    """to_production_period 的列式版本，对重复值只转换一次"""
+    memo = {}
+    result = []
+    for value in values:
+        try:
+            if value not in memo:
+                memo[value] = to_production_period(value)
+            result.append(memo[value])
+        except TypeError:
+            result.append(to_production_period(value))
+    return result
+
+_JSON_WHITESPACE = ' \t\n\r'
+
+def _skip_json_whitespace(text, pos):
+    while pos < len(text) and text[pos] in _JSON_WHITESPACE:
+        pos += 1
+    return pos
+
+def _iter_json_array_at(text, pos, decoder):
+    """从 text[pos] 处的 '[' 开始逐个解析数组元素，生成器的返回值为数组结束后的位置"""
+    pos = _skip_json_whitespace(text, pos + 1)
+    if text[pos:pos + 1] == ']':
+        return pos + 1
+    while True:
+        item, pos = decoder.raw_decode(text, pos)
+        yield item
+        pos = _skip_json_whitespace(text, pos)
+        sep = text[pos:pos + 1]
+        if sep == ',':
+            pos = _skip_json_whitespace(text, pos + 1)
+        elif sep == ']':
+            return pos + 1
+        else:
+            raise ValueError(f"JSON数组格式错误，位置: {pos}")
+
+def iter_json_array(text, key=None):
+    """
+    流式遍历JSON文本中的数组元素，每次只解析一个元素，不构建完整的列表。
+    key 为空时 text 本身应为数组；否则 text 应为对象，只遍历该键对应的数组，
+    其它键的数组会被逐个跳过。数组缺失或为 null 时不产生任何元素。
+    """
+    if not text:
+        return
+    decoder = json.JSONDecoder()
+    pos = _skip_json_whitespace(text, 0)
+
+    if key is None:
+        if text[pos:pos + 1] == '[':
+            yield from _iter_json_array_at(text, pos, decoder)
+        elif text[pos:pos + 4] != 'null':
+            raise ValueError("JSON顶层不是数组")
+        return
+
+    if text[pos:pos + 1] != '{':
+        raise ValueError("JSON顶层不是对象")
+    pos = _skip_json_whitespace(text, pos + 1)
+    if text[pos:pos + 1] == '}':
+        return
+    while True:
+        name, pos = decoder.raw_decode(text, pos)
+        pos = _skip_json_whitespace(text, pos)
+        if text[pos:pos + 1] != ':':
+            raise ValueError(f"JSON对象格式错误，位置: {pos}")
+        pos = _skip_json_whitespace(text, pos + 1)
+
+        is_array = text[pos:pos + 1] == '['
+        if name == key:
+            if is_array:
+                yield from _iter_json_array_at(text, pos, decoder)
+            return
+        if is_array:
+            # 跳过不需要的数组时同样逐个解析，避免一次性构建大列表
+            items = _iter_json_array_at(text, pos, decoder)
+            while True:
+                try:
+                    next(items)
+                except StopIteration as stop:
+                    pos = stop.value
+                    break
+        else:
+            _, pos = decoder.raw_decode(text, pos)
+
+        pos = _skip_json_whitespace(text, pos)
+        sep = text[pos:pos + 1]
+        if sep == ',':
+            pos = _skip_json_whitespace(text, pos + 1)
+        elif sep == '}':
+            return
+        else:
+            raise ValueError(f"JSON对象格式错误，位置: {pos}")
+
+def iter_payload_items(payload, key=None):
+    """从已解析的数据或其JSON文本中逐个取出记录；key 为空时数据本身即为记录数组"""
+    if not payload:
+        return iter(())
+    if isinstance(payload, (str, bytes)):
+        if isinstance(payload, bytes):
+            payload = payload.decode('utf-8')
+        return iter_json_array(payload, key)
+    items = payload.get(key) if key is not None else payload
+    return iter(items or ())
+
 def generate_random_password(length=12):
     return secrets.token_urlsafe(length)
 
@@ -0,0 +1,93 @@
+# 文件: write_locks.py
+# 按 (项目, 数据源) 串行化关联表写入：进程内锁保证同一进程的线程依次写入，MySQL 上再加 GET_LOCK 咨询锁覆盖多进程部署
+
+import hashlib
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from flask import current_app
+from .models import db
+from .timing import stage
+
+# 创建日志记录器
+logger = logging.getLogger(__name__)
+
+# 锁名 -> [进程内锁, 引用数]；引用数为持有和等待该锁的线程数，归零时移除，注册表不随写入过的项目数增长
+_local_locks = {}
+_registry_lock = threading.Lock()
+
+
+class LockTimeout(Exception):
+    """在超时时间内没有拿到写入锁；retry_after 为建议客户端等待的秒数"""
+    retry_after = 5
+
+
+def lock_name(project_id, source):
+    """MySQL 锁名最长64个字符，数据源名称用短哈希代替"""
+    return f"green:ingest:{project_id}:{hashlib.md5(source.encode('utf-8')).hexdigest()[:8]}"
+
+
+def _ref_local_lock(name):
+    """取得锁名对应的进程内锁并增加引用；用完后必须调用 _unref_local_lock"""
+    with _registry_lock:
+        entry = _local_locks.get(name)
+        if entry is None:
+            entry = _local_locks[name] = [threading.Lock(), 0]
+        entry[1] += 1
+        return entry[0]
+
+
+def _unref_local_lock(name):
+    with _registry_lock:
+        entry = _local_locks[name]
+        entry[1] -= 1
+        if not entry[1]:
+            del _local_locks[name]
+
+
+@contextmanager
+def project_write_lock(keys, timeout=None):
+    """
+    在写入 keys（[(project_id, source)]）对应的关联表期间持有锁。
+    多个键按锁名排序后依次加锁，避免两个批次交叉等待；超时抛出 LockTimeout。
+    咨询锁使用独立的数据库连接，不受会话提交时归还连接的影响。
+    """
+    if timeout is None:
+        timeout = current_app.config.get('INGEST_LOCK_TIMEOUT', 60)
+    names = sorted({lock_name(project_id, source) for project_id, source in keys})
+    deadline = time.monotonic() + timeout
+    referenced, held_local, held_db = [], [], []
+    connection = None
+    try:
+        with stage('lock'):
+            for name in names:
+                lock = _ref_local_lock(name)
+                referenced.append(name)
+                if not lock.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                    raise LockTimeout(f'等待写入锁超时: {name}')
+                held_local.append(lock)
+
+            if db.engine.dialect.name == 'mysql':
+                connection = db.engine.connect()
+                for name in names:
+                    got = connection.execute(db.text("SELECT GET_LOCK(:name, :timeout)"), {
+                        'name': name, 'timeout': max(0, int(deadline - time.monotonic()))}).scalar()
+                    if got != 1:
+                        raise LockTimeout(f'等待写入锁超时: {name}')
+                    held_db.append(name)
+        yield
+    finally:
+        if connection is not None:
+            try:
+                for name in held_db:
+                    connection.execute(db.text("SELECT RELEASE_LOCK(:name)"), {'name': name})
+                connection.close()
+            except Exception as e:
+                # 释放失败时丢弃该连接，连接断开后 MySQL 会自动释放其持有的锁
+                logger.error(f"释放写入锁失败: {e}")
+                connection.invalidate()
+        for lock in reversed(held_local):
+            lock.release()
+        for name in referenced:
+            _unref_local_lock(name)
@@ -22,8 +22,8 @@ def create_backup():
     backup_dir = f"D:\\code\\backup\\{timestamp}"
     
     # 需要排除的目录和文件
-    exclude_dirs = {'venv', '.idea', '__pycache__', '其它文件','received_data'}
-    exclude_files = {'backup.py'}
+    exclude_dirs = {'venv', '.idea', '__pycache__', '其它文件','received_data', 'archive', 'snapshots'}
+    exclude_files = {'backup.py', 'rebuild_checkpoint.txt'}
     
     try:
         # 创建备份目录
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+客户成交汇总基准
+在内存 SQLite 中生成每月多笔成交的模拟数据，对比原先以台账按 (项目, 月份) 左连接五个交易表的查询
+与各平台先按买方分组再 UNION ALL 合并的 customer_totals，并用逐笔累加的结果校验
+用法: python benchmark_customer_volumes.py [项目数] [月份数] [每平台每月成交笔数] [每月台账行数]
+"""
+
+import random
+import sys
+import time
+from collections import defaultdict
+
+from sqlalchemy import bindparam, create_engine, text
+
+from app.customer_volumes import customer_totals
+
+TRADE_TABLES = {
+    'gzpt_unilateral_listings': "generate_ym TEXT, member_name TEXT, total_quantity TEXT, total_amount TEXT, "
+                                "order_status TEXT, order_time_str TEXT",
+    'gzpt_bilateral_online_trades': "generate_ym TEXT, member_name TEXT, total_quantity TEXT, total_amount TEXT, "
+                                    "order_status TEXT, order_time_str TEXT",
+    'gzpt_bilateral_offline_trades': "generate_ym TEXT, member_name TEXT, total_quantity TEXT, total_amount TEXT, "
+                                     "order_status TEXT, order_time_str TEXT",
+    'beijing_power_exchange_trades': "production_year_month TEXT, buyer_entity_name TEXT, "
+                                     "transaction_quantity TEXT, transaction_price TEXT, transaction_time TEXT",
+    'guangzhou_power_exchange_trades': "product_date TEXT, buyer_entity_name TEXT, gpc_certifi_num REAL, "
+                                       "total_cost REAL, deal_time TEXT",
+}
+
+# 原客户信息页面的成交量查询：台账与五个交易表按 (项目, 月份) 左连接，同月多笔成交会相互放大
+# （SQLite 的 HAVING 会把与列同名的别名解析为列，这里写出完整的表达式）
+FANOUT_SQL = text("""
+    SELECT
+        CASE
+            WHEN bj.buyer_entity_name IS NOT NULL THEN bj.buyer_entity_name
+            WHEN gz.buyer_entity_name IS NOT NULL THEN gz.buyer_entity_name
+            WHEN ul.member_name IS NOT NULL THEN ul.member_name
+            WHEN ol.member_name IS NOT NULL THEN ol.member_name
+            WHEN off.member_name IS NOT NULL THEN off.member_name
+            ELSE '未知客户'
+        END as customer_name,
+        SUM(
+            COALESCE(ul.total_quantity, 0) +
+            COALESCE(ol.total_quantity, 0) +
+            COALESCE(off.total_quantity, 0) +
+            COALESCE(bj.transaction_quantity, 0) +
+            COALESCE(gz.gpc_certifi_num, 0)
+        ) as total_quantity
+    FROM projects p
+    JOIN nyj_green_certificate_ledger n ON p.id = n.project_id
+    LEFT JOIN gzpt_unilateral_listings ul ON n.project_id = ul.project_id AND n.production_year_month = ul.generate_ym AND ul.order_status = '1'
+    LEFT JOIN gzpt_bilateral_online_trades ol ON n.project_id = ol.project_id AND n.production_year_month = ol.generate_ym
+    LEFT JOIN gzpt_bilateral_offline_trades off ON n.project_id = off.project_id AND n.production_year_month = off.generate_ym
+    LEFT JOIN beijing_power_exchange_trades bj ON n.project_id = bj.project_id AND n.production_year_month = bj.production_year_month
+    LEFT JOIN guangzhou_power_exchange_trades gz ON n.project_id = gz.project_id AND n.production_year_month = gz.product_date
+    WHERE p.id IN :project_ids
+    AND (
+        ul.total_quantity > 0 OR ol.total_quantity > 0 OR off.total_quantity > 0 OR
+        bj.transaction_quantity > 0 OR gz.gpc_certifi_num > 0
+    )
+    GROUP BY customer_name
+    HAVING SUM(
+        COALESCE(ul.total_quantity, 0) + COALESCE(ol.total_quantity, 0) + COALESCE(off.total_quantity, 0) +
+        COALESCE(bj.transaction_quantity, 0) + COALESCE(gz.gpc_certifi_num, 0)
+    ) > 0
+""").bindparams(bindparam('project_ids', expanding=True))
+
+
+def create_schema(connection):
+    connection.execute(text("CREATE TABLE projects (id INTEGER PRIMARY KEY, project_name TEXT)"))
+    connection.execute(text("CREATE TABLE nyj_green_certificate_ledger (project_id INTEGER, "
+                            "production_year_month TEXT, production_period INTEGER)"))
+    connection.execute(text("CREATE INDEX idx_ledger ON nyj_green_certificate_ledger (project_id, production_year_month)"))
+    for table_name, columns in TRADE_TABLES.items():
+        month_column = columns.split(' ', 1)[0]
+        connection.execute(text(f"CREATE TABLE {table_name} (project_id INTEGER, production_period INTEGER, {columns})"))
+        # 与线上一致的 (project_id, production_period) 索引，另加原查询连接用的月份索引
+        connection.execute(text(f"CREATE INDEX idx_{table_name}_period ON {table_name} (project_id, production_period)"))
+        connection.execute(text(f"CREATE INDEX idx_{table_name}_month ON {table_name} (project_id, {month_column})"))
+
+
+def populate(connection, projects, months, trades, ledger_rows, customers=200):
+    """写入模拟数据，返回逐笔累加的 {客户: 成交量}（按各平台的订单状态条件）"""
+    expected = defaultdict(float)
+    rows = defaultdict(list)
+    for project_id in range(1, projects + 1):
+        rows['projects'].append({'id': project_id, 'project_name': f"项目{project_id}"})
+        for m in range(months):
+            year, month = 2023 + m // 12, m % 12 + 1
+            ym, period = f"{year}-{month:02d}", year * 100 + month
+            trade_time = f"{year + (month == 12)}-{month % 12 + 1:02d}-15 10:00:00"
+            rows['nyj_green_certificate_ledger'].extend(
+                {'project_id': project_id, 'production_year_month': ym, 'production_period': period}
+                for _ in range(ledger_rows))
+            for table_name in TRADE_TABLES:
+                for _ in range(trades):
+                    buyer = f"客户{random.randrange(customers):03d}"
+                    quantity = random.randint(1, 500)
+                    row = {'project_id': project_id, 'production_period': period}
+                    if table_name.startswith('gzpt_'):
+                        status = random.choice('123')
+                        row.update(generate_ym=ym, member_name=buyer, total_quantity=str(quantity),
+                                   total_amount=str(quantity * 5), order_status=status, order_time_str=trade_time)
+                        counted = {'gzpt_unilateral_listings': status == '1',
+                                   'gzpt_bilateral_offline_trades': status == '3'}.get(table_name, True)
+                    elif table_name.startswith('beijing'):
+                        row.update(production_year_month=ym, buyer_entity_name=buyer,
+                                   transaction_quantity=str(quantity), transaction_price='5', transaction_time=trade_time)
+                        counted = True
+                    else:
+                        row.update(product_date=ym, buyer_entity_name=buyer, gpc_certifi_num=quantity,
+                                   total_cost=quantity * 5, deal_time=trade_time)
+                        counted = True
+                    rows[table_name].append(row)
+                    if counted:
+                        expected[buyer] += quantity
+    for table_name, table_rows in rows.items():
+        columns = list(table_rows[0])
+        connection.execute(text(f"INSERT INTO {table_name} ({', '.join(columns)}) "
+                                f"VALUES ({', '.join(':' + c for c in columns)})"), table_rows)
+    return expected
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    projects = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    months = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+    trades = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    ledger_rows = int(sys.argv[4]) if len(sys.argv) > 4 else 2
+    random.seed(42)
+    engine = create_engine('sqlite://')
+    with engine.begin() as connection:
+        create_schema(connection)
+        expected = populate(connection, projects, months, trades, ledger_rows)
+    project_ids = list(range(1, projects + 1))
+    trade_count = projects * months * trades * len(TRADE_TABLES)
+    print(f"=== 客户成交汇总基准: {projects} 个项目 × {months} 个月，每平台每月 {trades} 笔成交，"
+          f"每月 {ledger_rows} 行台账，共 {trade_count} 笔成交 ===")
+
+    with engine.connect() as connection:
+        fanout_rows, fanout_time = timed(lambda: connection.execute(FANOUT_SQL, {'project_ids': project_ids}).fetchall())
+        print(f"台账左连接: {fanout_time:.3f} 秒")
+        union_rows, union_time = timed(customer_totals, connection, project_ids)
+        print(f"分平台汇总: {union_time:.3f} 秒 (加速 {fanout_time / union_time:.1f} 倍)")
+
+    expected_total = sum(expected.values())
+    fanout_total = sum(float(row.total_quantity) for row in fanout_rows)
+    print(f"逐笔累加成交量 {expected_total:.0f}，台账左连接得到 {fanout_total:.0f} "
+          f"({fanout_total / expected_total:.1f} 倍)")
+
+    actual = {row.customer_name: float(row.total_quantity) for row in union_rows}
+    if actual != dict(expected):
+        mismatch = next(name for name in set(actual) | set(expected) if actual.get(name) != expected.get(name))
+        print(f"✗ 分平台汇总与逐笔累加不一致: {mismatch} {actual.get(mismatch)} != {expected.get(mismatch)}")
+        sys.exit(1)
+    print(f"✓ 分平台汇总与逐笔累加一致 ({len(actual)} 个客户)")
+
+
+if __name__ == '__main__':
+    main()
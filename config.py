@@ -21,6 +21,97 @@ SQLALCHEMY_ENGINE_OPTIONS = {
     'pool_pre_ping': True  # 在每次使用连接前进行“ping”测试，确保连接是活动的
 }
 
+# --- 数据提交队列配置 ---
+# /api/submit_data 只做校验和入队，由后台线程池写库，接口立即返回任务ID
+INGEST_ASYNC = True
+INGEST_WORKERS = 2  # 后台写库线程数，避免占满 waitress 的请求线程和数据库连接
+INGEST_JOB_RETENTION_SECONDS = 3600  # 已完成任务在 /api/jobs/<id> 中保留的时间
+SUBMIT_BATCH_MAX_ENTRIES = 1000  # /api/submit_batch 单次请求最多的条目数
+INGEST_BATCH_COMMIT_SIZE = 50  # /api/submit_batch 每处理多少个条目提交一次事务
+INGEST_METRICS_WINDOW = 500  # 阶段耗时和吞吐量分位数基于最近多少次提交计算
+# 准入控制：超出时返回 429 和 Retry-After，避免突发提交把延迟无限拉长
+INGEST_MAX_BACKLOG = 200  # 排队和执行中的后台任务上限（合并到已排队任务的提交不受限制），0 表示不限制
+INGEST_MAX_SYNC_WRITERS = 4  # 同步写库接口（/api/submit、/api/submit_batch）的最大并发数
+INGEST_ADMISSION_WAIT = 2  # 同步写库等待空位的秒数
+INGEST_RETRY_AFTER_MAX = 120  # Retry-After 的上限（秒）
+# 同一项目和数据源的写入串行进行（进程内锁 + MySQL GET_LOCK），等待超过该秒数后放弃
+INGEST_LOCK_TIMEOUT = 60
+
+# --- API 压缩 ---
+# 提交接口接受 Content-Encoding: gzip / deflate / zstd（zstd 需安装 zstandard）的请求体
+REQUEST_MAX_DECOMPRESSED_BYTES = 256 * 1024 * 1024  # 解压后请求体的最大字节数，超过返回 413
+API_COMPRESS_MIN_BYTES = 1024  # 小于该长度的JSON响应不压缩
+API_COMPRESS_LEVEL = 6  # gzip/deflate 压缩级别
+
+# --- GUI登录令牌 ---
+# /api/login 成功后签发签名令牌（使用 SECRET_KEY），GUI 在 X-GUI-Token 头中携带，服务端只做HMAC校验
+GUI_TOKEN_TTL = 8 * 3600  # 令牌有效秒数
+GUI_TOKEN_MAX_LIFETIME = 7 * 86400  # 凭令牌续期（不输入密码）的总寿命，从最初凭密码登录时算起
+GUI_TOKEN_REQUIRED = False  # 为 True 时提交、状态和模块接口必须携带令牌；旧版客户端全部升级后再开启
+
+# --- GUI启动器模块 ---
+# /api/modules 提供版本清单，/api/modules/<名称> 和 /api/get_module 按内容哈希返回强ETag，未变化时返回304
+MODULE_DIR = None  # 模块文件所在目录，None 表示 app/routes
+MODULES = {'m1': 'm1.py'}  # 模块名称 -> 文件名
+MODULE_PRECOMPRESS = True  # 在内存中保留 gzip 预压缩版本，客户端支持时直接发送
+MODULE_CACHE_MAX_AGE = 0  # 客户端可不经校验直接使用缓存的秒数，0 表示每次都用 If-None-Match 校验
+
+# --- GUI启动数据缓存 ---
+# 二级单位列表、单位的项目列表和更新时间缓存在进程内，项目或用户变化提交后立即失效，TTL 仅作兜底
+# 失效只在提交变更的进程内生效，多进程部署时其他进程最多落后一个 TTL
+BOOTSTRAP_CACHE_TTL = 300
+BOOTSTRAP_STATUS_CACHE_TTL = 10  # 单位状态（更新时间和增量提交游标）的TTL，保持较短以免其他进程返回过期的游标
+
+# --- 看板快照 ---
+# 'memory': 每个进程各自计算并保存在内存中；
+# 'mmap': 保存在 DASHBOARD_SNAPSHOT_DIR 下的文件中，同一主机上的多个服务进程共享一次计算的结果
+DASHBOARD_SNAPSHOT_BACKEND = 'memory'
+DASHBOARD_SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshots')
+# 'memory' 后端也把每次计算的快照保存到 DASHBOARD_SNAPSHOT_DIR，重启后先返回上次的快照，同时在后台重新计算
+DASHBOARD_SNAPSHOT_PERSIST = True
+# 数据提交后只重算看板中受影响的部分，而不是等下一次完整计算
+DASHBOARD_EVENT_REFRESH = True
+# 合并多少秒内的变更再重算，批量提交时只重算一次
+DASHBOARD_EVENT_DELAY = 2
+# 快照过期后先返回旧数据并在后台刷新；过期超过该秒数时请求等待重新计算
+DASHBOARD_MAX_STALENESS = 60 * 60
+# 看板各部分并发计算的线程数，每个线程占用一个数据库连接，应小于连接池大小
+DASHBOARD_WORKERS = 4
+
+# --- 关联表刷新方式 ---
+# 'incremental': 按自然键和行哈希比对，只写入变化的行（需先执行 flask upgrade-db 添加 row_hash 列）
+# 'replace': 清空项目在关联表中的旧数据后全部重新插入
+DERIVED_REFRESH_MODE = 'incremental'
+INGEST_CHUNK_SIZE = 1000  # 关联表每批写入的记录数，单次提交的内存峰值由它而不是负载大小决定
+
+# --- 关联表批量写入 ---
+# 关联表以多行 INSERT ... VALUES 写入，每条语句的行数和估算长度受以下两项限制
+BULK_INSERT_MAX_ROWS = 500
+BULK_INSERT_MAX_BYTES = 1024 * 1024  # 需小于 MySQL 的 max_allowed_packet
+# 单次写入达到该行数时改用 LOAD DATA LOCAL INFILE，0 表示关闭；开启前需要服务端 local_infile=ON，
+# 并在 SQLALCHEMY_ENGINE_OPTIONS 中加入 'connect_args': {'local_infile': 1}
+BULK_LOAD_DATA_MIN_ROWS = 0
+
+# --- 关联表重建（flask rebuild-derived） ---
+# 修改了规范化规则后，从已存的原始数据重建关联表，无需各单位重新提交
+REBUILD_WORKERS = None  # 解析和规范化的子进程数，None 表示使用CPU核数
+REBUILD_WRITERS = 2  # 写库线程数，每个线程占用一个数据库连接
+REBUILD_CHECKPOINT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rebuild_checkpoint.txt')
+
+# --- 原始数据存储 ---
+# 提交的原始JSON压缩后按内容哈希存入 source_payloads，项目表只保存哈希（旧数据用 flask migrate-payloads 迁移）
+PAYLOAD_COMPRESS_LEVEL = 6  # zlib 压缩级别
+PAYLOAD_RELEASE_GRACE = 3600  # 无引用的原始数据至少这么多秒未被使用才删除，避免与并发的提交相互竞争
+# 部署步骤：Project 模型映射了 projects.data_*_hash 列，升级到该版本时须先执行 flask upgrade-db 补充这些列
+# （以及 source_payloads.last_used_at），再启动应用，否则所有查询项目的请求都会因缺列而失败
+
+# --- 提交归档 ---
+# 每次提交在请求线程中压缩，由后台线程追加到滚动的段文件中（文件名带进程号，多进程共用目录），并在 sqlite 索引中登记，可按项目/数据源/时间查询和重放
+ARCHIVE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive')  # 设为 None 可关闭归档
+ARCHIVE_SEGMENT_MAX_BYTES = 64 * 1024 * 1024  # 单个段文件的最大字节数，超过后滚动到新文件
+ARCHIVE_RETENTION_DAYS = 90  # 段文件中所有记录都超过该天数后整段删除，0 表示永久保留
+ARCHIVE_QUEUE_SIZE = 1000  # 待写入队列长度（队列中是序列化后未压缩的JSON字节，由后台线程压缩），队列满时丢弃归档而不阻塞请求
+
 # --- 数据查看页面表头顺序配置 ---
 TABLE_HEADER_ORDERS = {
     'nyj_green_certificate_ledger': ['电量生产年月', '省份', '城市', '核发量', '已上架', '未上架', '已出售', '未出售', '可交易量', '不可交易量', '普通绿证', '绿电绿证'],
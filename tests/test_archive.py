@@ -0,0 +1,28 @@
+# 文件: tests/test_archive.py
+# 提交归档：未配置目录时查询返回空结果；启用时后台线程压缩写入，可按索引读回
+
+import time
+
+from app.archive import SubmissionArchive
+
+
+def test_disabled_archive_reports_nothing(app):
+    archive = SubmissionArchive(app)  # 测试配置中 ARCHIVE_DIR 为 None
+    assert archive.append('测试项目', '广州电力交易中心', [{'orderNo': 'GZ-1'}]) is False
+    assert archive.find(project_name='测试项目') == []
+    assert archive.read(1) is None
+
+
+def test_archived_submission_can_be_read_back(app, tmp_path):
+    app.config['ARCHIVE_DIR'] = str(tmp_path / 'archive')
+    archive = SubmissionArchive(app)
+    data = [{'orderNo': 'GZ-1', 'gpcCertifiNum': 5}]
+    assert archive.append('测试项目', '广州电力交易中心', data, mode='delta')
+    data.append({'orderNo': 'GZ-2'})  # 入队后请求对数据的修改不影响归档
+
+    deadline = time.time() + 5
+    while not archive.find(project_name='测试项目') and time.time() < deadline:
+        time.sleep(0.02)
+    [entry] = archive.find(project_name='测试项目')
+    record = archive.read(entry['id'])
+    assert record['data'] == [{'orderNo': 'GZ-1', 'gpcCertifiNum': 5}] and record['mode'] == 'delta'
@@ -0,0 +1,71 @@
+# 文件: tests/test_compression.py
+# 请求体解压：解压后大小的限制、原始 deflate、多成员 gzip、截断的数据
+
+import gzip
+import io
+import zlib
+
+import pytest
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+
+from app.compression import DecodedInput, _READ_SIZE, _make_decoder, zstandard
+
+PAYLOAD = b'{"project_name": "p", "data": [' + b'1, ' * 50000 + b'1]}'
+
+
+def decode(encoding, body, max_size=len(PAYLOAD) * 4, read_size=_READ_SIZE):
+    """像应用那样经缓冲流读取解压后的请求体"""
+    return io.BufferedReader(DecodedInput(_make_decoder(encoding, io.BytesIO(body)), max_size), read_size).read()
+
+
+def raw_deflate(data):
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+@pytest.mark.parametrize('encoding, body', [
+    ('gzip', gzip.compress(PAYLOAD)),
+    ('deflate', zlib.compress(PAYLOAD)),
+    ('deflate', raw_deflate(PAYLOAD)),
+    ('gzip', gzip.compress(PAYLOAD[:1000]) + gzip.compress(PAYLOAD[1000:])),
+])
+def test_decodes_supported_formats(encoding, body):
+    assert decode(encoding, body)== PAYLOAD
+
+
+def test_bomb_is_expanded_in_bounded_chunks():
+    # 约1MB的压缩数据可以解压出1GB；每次解压的输出不超过读取块大小，超过上限时返回 413 而不是先整体展开
+    bomb = zlib.compress(b'\x00' * (64 * 1024 * 1024)) * 16
+    decoder = _make_decoder('deflate', io.BytesIO(bomb))
+    assert len(decoder.read(_READ_SIZE)) <= _READ_SIZE
+    with pytest.raises(RequestEntityTooLarge):
+        decode('gzip', gzip.compress(b'\x00' * (8 * 1024 * 1024)), max_size=1024 * 1024)
+
+
+def test_limit_allows_body_of_exact_size():
+    assert decode('gzip', gzip.compress(PAYLOAD), max_size=len(PAYLOAD))== PAYLOAD
+    with pytest.raises(RequestEntityTooLarge):
+        decode('gzip', gzip.compress(PAYLOAD), max_size=len(PAYLOAD) - 1)
+
+
+@pytest.mark.parametrize('encoding, body', [
+    ('gzip', gzip.compress(PAYLOAD)[:-10]),
+    ('deflate', zlib.compress(PAYLOAD)[:-10]),
+    ('gzip', b''),
+    ('gzip', gzip.compress(PAYLOAD) + b'garbage'),
+    ('deflate', zlib.compress(PAYLOAD) + b'garbage'),
+])
+def test_rejects_truncated_or_trailing_data(encoding, body):
+    with pytest.raises(BadRequest):
+        decode(encoding, body)
+
+
+@pytest.mark.skipif(zstandard is None, reason='未安装 zstandard')
+def test_zstd_frames_and_truncation():
+    compressor = zstandard.ZstdCompressor()
+    body = compressor.compress(PAYLOAD[:1000]) + compressor.compress(PAYLOAD[1000:])
+    assert decode('zstd', body)== PAYLOAD
+    with pytest.raises(BadRequest):
+        decode('zstd', body[:-5])
+    with pytest.raises(RequestEntityTooLarge):
+        decode('zstd', compressor.compress(b'\x00' * (8 * 1024 * 1024)), max_size=1024 * 1024)
@@ -0,0 +1,24 @@
+# 文件: tests/test_customer_volumes.py
+# 客户成交汇总：成交量不大于0的记录不计入客户的数量和金额
+
+from app import db
+from app.customer_volumes import customer_totals
+
+
+def add_guangzhou_trade(project_id, order_no, buyer, quantity, cost):
+    db.session.execute(db.text(
+        "INSERT INTO guangzhou_power_exchange_trades (project_id, order_no, buyer_entity_name, gpc_certifi_num, "
+        "total_cost, production_period) VALUES (:pid, :order_no, :buyer, :quantity, :cost, 202401)"),
+        {'pid': project_id, 'order_no': order_no, 'buyer': buyer, 'quantity': quantity, 'cost': cost})
+
+
+def test_non_positive_rows_do_not_reduce_totals(app, project):
+    add_guangzhou_trade(project.id, 'GZ-1', '客户A', '10', '100')
+    add_guangzhou_trade(project.id, 'GZ-2', '客户A', '-4', '-40')
+    add_guangzhou_trade(project.id, 'GZ-3', '客户A', '0', '5')
+    add_guangzhou_trade(project.id, 'GZ-4', '客户B', '-3', '-30')
+    db.session.commit()
+
+    with db.engine.connect() as connection:
+        rows = customer_totals(connection, [project.id])
+    assert [(row[0], float(row[1]), float(row[2])) for row in rows] == [('客户A', 10.0, 100.0)]
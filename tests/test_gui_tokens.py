@@ -0,0 +1,35 @@
+# 文件: tests/test_gui_tokens.py
+# GUI登录令牌：续期沿用最初登录时间、总寿命有上限，账户删除后不能续期
+
+import time
+
+from app import db
+from app.gui_tokens import TOKEN_HEADER, issue_token, read_token
+from app.models import User
+
+
+def login(client, token=None, **data):
+    headers = {TOKEN_HEADER: token} if token else {}
+    return client.post('/api/login', json=dict({'username': '测试单位'}, **data), headers=headers)
+
+
+def test_renewal_keeps_original_issue_time(app):
+    user = User(username='测试单位')
+    user.set_password('secret')
+    db.session.add(user)
+    db.session.commit()
+    client = app.test_client()
+
+    first = login(client, password='secret').get_json()
+    renewed = login(client, first['token']).get_json()
+    assert renewed['success']
+    assert read_token(renewed['token'])[1] == read_token(first['token'])[1]
+
+    # 超过最长寿命的令牌不能再续期，必须输入密码
+    old_token, _ = issue_token('测试单位', time.time() - app.config['GUI_TOKEN_MAX_LIFETIME'] - 1)
+    assert read_token(old_token) is None
+    assert login(client, old_token).status_code == 400
+
+    db.session.delete(user)
+    db.session.commit()
+    assert login(client, first['token']).status_code == 401
@@ -0,0 +1,118 @@
+# 文件: tests/test_ingestion.py
+# 提交写库：单条与批量提交的全量刷新结果一致，拿到写入锁后读取最新的项目数据，增量提交的合并与校验
+
+import json
+import threading
+
+import pytest
+
+from app import db
+from app.cursors import DeltaMergeError, check_delta, merge_payload
+from app.ingestion import apply_batch, apply_submission
+from app.models import Project
+from app.payload_store import get_project_payload
+
+from conftest import count_rows
+
+GUANGZHOU_DATA = [
+    {"orderNo": "GZ-1", "marketEntityNameBuyer": "客户A", "gpcCertifiNum": 5, "productDate": "2024-1"},
+    {"orderNo": "GZ-2", "marketEntityNameBuyer": "客户B", "gpcCertifiNum": 7, "productDate": "2024-2"},
+]
+
+
+def test_batch_replace_matches_single_submission(app, project):
+    app.config['DERIVED_REFRESH_MODE'] = 'replace'
+    other = Project(project_name='测试项目2', secondary_unit='测试单位')
+    db.session.add(other)
+    db.session.commit()
+
+    single = apply_submission(project, "广州电力交易中心", GUANGZHOU_DATA)
+    batch = apply_batch([(other, "广州电力交易中心", GUANGZHOU_DATA),
+                         (project, "广州电力交易中心", GUANGZHOU_DATA[:1])])
+
+    assert single.row_counts == batch[0]['row_counts'] == {"guangzhou_power_exchange_trades": 2}
+    assert batch[1]['row_counts'] == {"guangzhou_power_exchange_trades": 1}
+    assert count_rows("guangzhou_power_exchange_trades", other.id) == 2
+    assert count_rows("guangzhou_power_exchange_trades", project.id) == 1
+
+
+def run_in_other_session(app, func, *args):
+    """在另一个线程（各自的会话和连接）中执行并提交，模拟其他请求或进程"""
+    errors = []
+
+    def target():
+        with app.app_context():
+            try:
+                func(*args)
+            except Exception as e:
+                errors.append(e)
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    assert not errors, errors
+
+
+def test_submission_rereads_project_after_taking_lock(app, project):
+    apply_submission(project, "广州电力交易中心", GUANGZHOU_DATA)
+    stale = db.session.get(Project, project.id)
+    first_hash = stale.data_gjdl_hash
+
+    # 在本会话加载项目之后，另一个提交替换了原始数据
+    run_in_other_session(app, lambda: apply_submission(
+        db.session.get(Project, project.id), "广州电力交易中心", GUANGZHOU_DATA[:1]))
+
+    # 用锁外加载的项目再次提交第一份数据：必须按锁内的最新哈希判断，而不是误判为未变化
+    result = apply_submission(stale, "广州电力交易中心", GUANGZHOU_DATA)
+    assert not result.unchanged
+    assert db.session.get(Project, project.id).data_gjdl_hash == first_hash
+    assert count_rows("guangzhou_power_exchange_trades", project.id) == 2
+
+
+def test_concurrent_deltas_keep_each_others_records(app, project):
+    apply_submission(project, "广州电力交易中心", GUANGZHOU_DATA[:1])
+    stale = db.session.get(Project, project.id)
+    added = [{"orderNo": "GZ-3", "marketEntityNameBuyer": "客户C", "gpcCertifiNum": 1, "productDate": "2024-3"}]
+
+    # 两次增量提交：第二次使用在第一次提交之前加载的项目，合并时必须读取锁内最新的已存数据
+    run_in_other_session(app, lambda: apply_submission(
+        db.session.get(Project, project.id), "广州电力交易中心", GUANGZHOU_DATA[1:], delta=True))
+    apply_submission(stale, "广州电力交易中心", added, delta=True)
+
+    stored = json.loads(get_project_payload(db.session.get(Project, project.id), 'data_gjdl'))
+    assert [record['orderNo'] for record in stored] == ["GZ-1", "GZ-2", "GZ-3"]
+    assert count_rows("guangzhou_power_exchange_trades", project.id) == 3
+
+
+def test_beijing_delta_requires_header_row():
+    header = {"平价绿证交易结果": "项目名称", "Unnamed: 9": "绿证编号", "Unnamed: 11": "成交数量（张）"}
+    record = {"平价绿证交易结果": "项目A", "Unnamed: 9": "BJ-1", "Unnamed: 11": "10"}
+    check_delta("北京电力交易中心", [header, record])
+    for delta in ([record], [], [record, header]):
+        with pytest.raises(ValueError):
+            check_delta("北京电力交易中心", delta)
+
+
+def test_delta_replaces_record_with_differently_typed_key(app, project):
+    stored = [dict(GUANGZHOU_DATA[0], orderNo='1003')]
+    apply_submission(project, "广州电力交易中心", stored)
+    # 增量数据中同一订单号为整数：应替换已存记录，而不是追加一条重复记录
+    apply_submission(project, "广州电力交易中心", [dict(GUANGZHOU_DATA[0], orderNo=1003, gpcCertifiNum=9)], delta=True)
+
+    merged = json.loads(get_project_payload(db.session.get(Project, project.id), 'data_gjdl'))
+    assert [(record['orderNo'], record['gpcCertifiNum']) for record in merged] == [(1003, 9)]
+    assert count_rows("guangzhou_power_exchange_trades", project.id) == 1
+
+
+def test_delta_over_wrong_shape_payload_is_rejected(app, project):
+    # 已存数据为 JSON null：增量数据不能被当作全部数据替换已存数据
+    apply_submission(project, "广州电力交易中心", None)
+    with pytest.raises(DeltaMergeError):
+        apply_submission(db.session.get(Project, project.id), "广州电力交易中心", GUANGZHOU_DATA, delta=True)
+    db.session.rollback()
+    stored = get_project_payload(db.session.get(Project, project.id), 'data_gjdl')
+    assert json.loads(stored) is None
+
+    # 排队中的负载结构不对（对象而不是记录数组）时同样拒绝
+    with pytest.raises(DeltaMergeError):
+        merge_payload("广州电力交易中心", {"orderNo": 1}, GUANGZHOU_DATA)
@@ -0,0 +1,45 @@
+# 文件: tests/test_payload_store.py
+# 原始数据存储：释放无引用数据的宽限期，以及引用的数据缺失时报错
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from app.payload_store import load_payload, release_payload, set_project_payload, store_payload
+
+
+def payload_count():
+    return db.session.execute(db.text("SELECT COUNT(*) FROM source_payloads")).scalar()
+
+
+def age_payloads(seconds):
+    past = datetime.now() - timedelta(seconds=seconds)
+    db.session.execute(db.text("UPDATE source_payloads SET created_at = :t, last_used_at = :t"), {'t': past})
+
+
+def test_release_skips_recently_stored_payload(app, project):
+    content_hash = store_payload('[]')
+    age_payloads(app.config['PAYLOAD_RELEASE_GRACE'] + 60)
+    # 另一个提交刚保存了同一份内容，尚未提交对它的引用：释放时不能删除
+    store_payload('[]')
+    assert release_payload(content_hash) is False
+    assert payload_count() == 1
+
+
+def test_release_deletes_unreferenced_payload_after_grace(app, project):
+    content_hash = store_payload('[1]')
+    age_payloads(app.config['PAYLOAD_RELEASE_GRACE'] + 60)
+    assert release_payload(content_hash) is True
+    assert payload_count() == 0
+
+
+def test_release_keeps_referenced_payload(app, project):
+    set_project_payload(project, 'data_gjdl', '[2]')
+    age_payloads(app.config['PAYLOAD_RELEASE_GRACE'] + 60)
+    assert release_payload(project.data_gjdl_hash) is False
+
+
+def test_missing_payload_raises(app):
+    with pytest.raises(LookupError):
+        load_payload('0' * 64)
@@ -0,0 +1,34 @@
+# 文件: tests/test_rebuild.py
+# 关联表重建：锁内发现原始数据已变化时跳过，没有数据的数据源清空关联表
+
+from app import db
+from app.ingestion import apply_submission
+from app.models import Project
+from app.rebuild import iter_rebuild_tasks, normalize_payload, write_rebuilt
+
+from conftest import count_rows
+
+SOURCE = "广州电力交易中心"
+TABLE = "guangzhou_power_exchange_trades"
+RECORDS = [{"orderNo": "GZ-1", "gpcCertifiNum": 5, "productDate": "2024-1"}]
+
+
+def test_rebuild_skips_payload_replaced_after_read(app, project):
+    apply_submission(project, SOURCE, RECORDS)
+    (task,) = list(iter_rebuild_tasks(sources=[SOURCE]))
+    # 读取任务之后、写库之前，新的提交替换了原始数据
+    project = db.session.get(Project, task[0])
+    apply_submission(project, SOURCE, RECORDS + [{"orderNo": "GZ-2", "gpcCertifiNum": 1, "productDate": "2024-2"}])
+    project_id, source, tables, version = normalize_payload(*task)
+    assert write_rebuilt(project_id, source, tables, version) is None
+    assert count_rows(TABLE, project_id) == 2
+
+
+def test_rebuild_clears_source_without_data(app, project):
+    db.session.execute(db.text(f"INSERT INTO {TABLE} (project_id, order_no) VALUES (:pid, 'stale')"),
+                       {'pid': project.id})
+    db.session.commit()
+    (task,) = list(iter_rebuild_tasks(sources=[SOURCE]))
+    assert task[2] is None
+    assert write_rebuilt(task[0], task[1], [], task[3]) == 0
+    assert count_rows(TABLE, project.id) == 0
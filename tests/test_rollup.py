@@ -0,0 +1,31 @@
+# 文件: tests/test_rollup.py
+# 月度汇总表：无法确定受影响项目的变更把汇总表标记为未就绪，重建后恢复
+
+from app import db, rollup
+from app.change_events import record_change
+from app.ingestion import apply_submission
+from app.models import SystemSetting
+
+GUANGZHOU_DATA = [{"orderNo": "GZ-1", "gpcCertifiNum": 5, "totalCost": 50, "productDate": "2024-1",
+                   "dealTime": "2024-02-03T10:00:00"}]
+
+
+def stored_state():
+    return db.session.query(SystemSetting.value).filter(SystemSetting.key == rollup.STATE_KEY).scalar()
+
+
+def test_unscoped_change_marks_rollup_not_ready(app, project):
+    apply_submission(project, "广州电力交易中心", GUANGZHOU_DATA)
+    assert rollup.rebuild_rollup(wait=False) == 1
+    assert stored_state() == 'ready' and rollup.rollup_ready()
+
+    record_change({"guangzhou_power_exchange_trades"}, all_projects=True)
+    db.session.commit()
+    assert stored_state() == 'building'
+    assert not rollup.rollup_ready()
+
+    rollup.rebuild_rollup(wait=False)
+    assert stored_state() == 'ready'
+    rows = db.session.execute(db.text(
+        f"SELECT platform, quantity FROM {rollup.ROLLUP_TABLE} WHERE project_id = :pid"), {'pid': project.id}).fetchall()
+    assert [(platform, float(quantity)) for platform, quantity in rows] == [('guangzhou', 5.0)]
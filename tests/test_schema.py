@@ -0,0 +1,26 @@
+# 文件: tests/test_schema.py
+# 结构升级：升级后历史数据的 production_period 已回填，报表的生产年月筛选不会漏掉旧记录
+
+from app import db, schema
+from app.ingestion import apply_submission
+from app.schema import upgrade_schema
+
+GUANGZHOU_DATA = [{"orderNo": "GZ-1", "gpcCertifiNum": 5, "totalCost": 50, "productDate": "2024-1",
+                   "dealTime": "2024-02-03T10:00:00"}]
+
+
+def test_upgrade_backfills_production_period(app, project, monkeypatch):
+    # SQLite 的索引名在整个库内唯一，各表同名的 idx_project_period 无法创建，这里只验证回填
+    monkeypatch.setattr(schema, 'INDEX_UPGRADES', [])
+    apply_submission(project, "广州电力交易中心", GUANGZHOU_DATA)
+    # 模拟新增该列之前写入的记录
+    db.session.execute(db.text("UPDATE guangzhou_power_exchange_trades SET production_period = NULL"))
+    db.session.commit()
+
+    applied = upgrade_schema()
+    assert "回填 guangzhou_power_exchange_trades.production_period: 1 行" in applied
+    period = db.session.execute(db.text(
+        "SELECT production_period FROM guangzhou_power_exchange_trades WHERE project_id = :pid"),
+        {'pid': project.id}).scalar()
+    assert period == 202401
+    assert not any(sql.startswith("回填") for sql in upgrade_schema())
@@ -0,0 +1,41 @@
+# 文件: tests/test_snapshot_store.py
+# 看板快照：多个进程共享快照文件时读-改-写不丢更新，按变更的部分重算不刷新快照的计算时间
+
+import threading
+import time
+
+from app import dashboard_cache
+from app.snapshot_store import MmapSnapshotStore, snapshot_store
+
+
+def test_mmap_updates_from_separate_stores_are_not_lost(tmp_path):
+    # 两个存储实例相当于两个进程：各自的线程锁互不相干，只有文件锁能串行化
+    stores = [MmapSnapshotStore(str(tmp_path)) for _ in range(2)]
+
+    def bump(store):
+        for _ in range(20):
+            with store.lock('counter'):
+                current = store.get('counter')
+                time.sleep(0.001)
+                store.put('counter', (current.value if current else 0) + 1)
+
+    threads = [threading.Thread(target=bump, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    snapshot = MmapSnapshotStore(str(tmp_path)).get('counter')
+    assert snapshot.value == 40 and snapshot.generation == 40
+
+
+def test_partial_refresh_keeps_snapshot_timestamp(app, monkeypatch):
+    monkeypatch.setattr(dashboard_cache, 'DASHBOARD_SECTIONS', {
+        'fake': ({'guangzhou_power_exchange_trades'}, lambda connection, data, project_ids: {'_fake': 1}),
+    })
+    published = snapshot_store.put(dashboard_cache.SNAPSHOT_KEY, {'_fake': 0}, timestamp=time.time() - 3600)
+
+    assert dashboard_cache.refresh_sections({'guangzhou_power_exchange_trades'}) == ['fake']
+    snapshot = snapshot_store.get(dashboard_cache.SNAPSHOT_KEY)
+    assert snapshot.value['_fake'] == 1
+    assert snapshot.timestamp == published.timestamp
+    assert not dashboard_cache.is_cache_valid()
@@ -0,0 +1,80 @@
+# 文件: tests/test_sync_records.py
+# 增量刷新的幂等性：同一份数据重复入库，关联表的行数保持不变
+
+from app import db
+from app.data_processors import (SOURCE_TABLES, iter_source_rows, normalize_key_part, sync_records,
+                                 update_derived_tables)
+
+from conftest import count_rows, create_derived_table
+
+GZPT_DATA = {
+    "单向挂牌": [{"orderId": "001", "memberName": "客户A", "totalQuantity": "10", "generateYm": "2024-01"},
+                 {"orderId": "002", "memberName": "客户B", "totalQuantity": "20", "generateYm": "2024-02"}],
+    "双边线上": [{"orderId": 1003, "memberName": "客户C", "totalQuantity": "30", "generateYm": "2024-03"}],
+    "双边线下": [],
+}
+
+GUANGZHOU_DATA = [
+    {"orderNo": "GZ-A1", "marketEntityNameBuyer": "客户A", "gpcCertifiNum": 5, "productDate": "2024-1"},
+    {"orderNo": "gz-b2", "marketEntityNameBuyer": "客户B", "gpcCertifiNum": 7, "productDate": "2024-2"},
+]
+
+
+def ingest_twice(project_id, source, data):
+    counts = []
+    for _ in range(2):
+        update_derived_tables(project_id, source, incremental=True, data=data)
+        db.session.commit()
+        counts.append({table: count_rows(table, project_id) for table in SOURCE_TABLES[source]})
+    return counts
+
+
+def test_normalize_key_part():
+    assert normalize_key_part(1003) == normalize_key_part('1003') == normalize_key_part(' 1003.0 ')
+    assert normalize_key_part('001') == normalize_key_part(1)
+    assert normalize_key_part('GZ-A1') == normalize_key_part('gz-a1 ')
+    assert normalize_key_part(None) is None and normalize_key_part('  ') is None
+
+
+def test_repeated_ingest_is_stable(project):
+    first, second = ingest_twice(project.id, "绿证交易平台", GZPT_DATA)
+    assert first == second == {"gzpt_unilateral_listings": 2, "gzpt_bilateral_online_trades": 1,
+                               "gzpt_bilateral_offline_trades": 0}
+
+
+def test_repeated_ingest_with_integer_key_column(project):
+    # 键列为整数时数据库读回 1、2，而提交数据中是 '001'、'002'；未规范化时两次入库会先插入再删除，最终丢失数据
+    create_derived_table("gzpt_unilateral_listings", {"order_id": "INTEGER"})
+    first, second = ingest_twice(project.id, "绿证交易平台", GZPT_DATA)
+    assert first["gzpt_unilateral_listings"] == second["gzpt_unilateral_listings"] == 2
+
+
+def test_repeated_ingest_with_case_insensitive_key(project):
+    # 模拟 MySQL 不区分大小写的排序规则：数据库中保存的键与提交数据大小写不同
+    update_derived_tables(project.id, "广州电力交易中心", incremental=True, data=GUANGZHOU_DATA)
+    db.session.execute(db.text("UPDATE guangzhou_power_exchange_trades SET order_no = UPPER(order_no)"))
+    db.session.commit()
+    ids_sql = db.text("SELECT id FROM guangzhou_power_exchange_trades ORDER BY id")
+    before = db.session.execute(ids_sql).scalars().all()
+    update_derived_tables(project.id, "广州电力交易中心", incremental=True, data=GUANGZHOU_DATA)
+    db.session.commit()
+    # 不应再插入新行后删除旧行（在 MySQL 上按旧键删除会把新插入的行一并删掉）
+    assert db.session.execute(ids_sql).scalars().all() == before
+
+
+def test_changed_record_is_updated_in_place(project):
+    update_derived_tables(project.id, "广州电力交易中心", incremental=True, data=GUANGZHOU_DATA)
+    changed = [dict(GUANGZHOU_DATA[0], gpcCertifiNum=9), GUANGZHOU_DATA[1]]
+    update_derived_tables(project.id, "广州电力交易中心", incremental=True, data=changed)
+    db.session.commit()
+    rows = db.session.execute(db.text(
+        "SELECT order_no, gpc_certifi_num FROM guangzhou_power_exchange_trades ORDER BY order_no")).fetchall()
+    assert [(row[0], int(row[1])) for row in rows] == [("GZ-A1", 9), ("gz-b2", 7)]
+
+
+def test_replace_and_incremental_write_the_same_row_hash(project):
+    # 全量写入（列式值元组）与增量刷新计算的行哈希必须一致，否则下一次增量刷新会重写所有行
+    update_derived_tables(project.id, "绿证交易平台", incremental=False, data=GZPT_DATA)
+    for table_name, make_rows in iter_source_rows(project.id, "绿证交易平台", GZPT_DATA):
+        stats = sync_records(project.id, table_name, make_rows)
+        assert stats['inserted'] == stats['updated'] == stats['deleted'] == 0 and not stats['full_rebuild']
@@ -0,0 +1,36 @@
+# 文件: tests/test_write_locks.py
+# 写入锁：进程内锁的注册表只保留正在持有或等待的锁名
+
+import threading
+
+import pytest
+
+from app import write_locks
+from app.write_locks import LockTimeout, project_write_lock
+
+
+def test_local_locks_are_removed_after_release(app):
+    with project_write_lock([(1, '广州电力交易中心'), (2, '广州电力交易中心')]):
+        assert len(write_locks._local_locks) == 2
+    assert write_locks._local_locks == {}
+
+
+def test_waiter_shares_the_lock_and_cleans_up_after_timeout(app):
+    acquired, release = threading.Event(), threading.Event()
+
+    def hold():
+        with app.app_context(), project_write_lock([(1, '广州电力交易中心')]):
+            acquired.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    acquired.wait(5)
+    with pytest.raises(LockTimeout):
+        with project_write_lock([(1, '广州电力交易中心')], timeout=0.05):
+            pass
+    # 等待超时的线程已释放引用，持有者的引用仍在
+    assert [entry[1] for entry in write_locks._local_locks.values()] == [1]
+    release.set()
+    holder.join()
+    assert write_locks._local_locks == {}